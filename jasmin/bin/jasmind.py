@@ -175,6 +175,7 @@ class JasminDaemon(BaseDaemon):
 
     def stopSMPPClientManagerPBService(self):
         """Stop SMPP Client Manager PB server"""
+        self.components['smppcm-pb-factory'].removeAmqpBroker()
         return self.components['smppcm-pb-server'].stopListening()
 
     @defer.inlineCallbacks
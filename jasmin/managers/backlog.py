@@ -0,0 +1,127 @@
+"""
+Backlog of submit.sm.<cid> queues
+
+Connectors that are unbound or throttled stop draining their queue while HTTP and SMPP server
+users keep submitting: messages pile up until they expire. The BacklogMonitor estimates how long
+every connector would take to drain its backlog so new submits can be refused (or sent through
+another connector) instead of being enqueued.
+"""
+
+import time
+
+from twisted.internet import defer, task
+
+# Weight of the last measured drain rate in its moving average
+RATE_SMOOTHING = 0.3
+
+
+class Backlog:
+    """Depth and drain rate of a connector's queues"""
+
+    def __init__(self):
+        self.depth = 0
+        self.consumers = 0
+        self.published = 0
+        self.rate = None
+        self.polled_at = None
+
+    def update(self, depth, consumers, now):
+        """Set the depth measured at now, messages published since the last update are counted
+        as drained unless they are still waiting"""
+        if self.polled_at is not None and now > self.polled_at:
+            drained = max(self.depth + self.published - depth, 0)
+            rate = drained / (now - self.polled_at)
+            if self.rate is None:
+                self.rate = rate
+            else:
+                self.rate = RATE_SMOOTHING * rate + (1 - RATE_SMOOTHING) * self.rate
+
+        self.depth = depth
+        self.consumers = consumers
+        self.published = 0
+        self.polled_at = now
+
+    def drain_time(self):
+        """Return the estimated seconds needed to drain the backlog, 0 until the drain rate is
+        known"""
+        if self.depth == 0 or self.rate is None:
+            return 0
+        if self.rate <= 0:
+            return float('inf')
+        return self.depth / self.rate
+
+
+class BacklogMonitor:
+    """Polls the depth of connectors queues every interval seconds
+
+    queues is a callable returning a dict of cid -> names of the queues holding messages of this
+    connector (its submit.sm.<cid> queue and its retry queues), depths are read with passive
+    queue declarations on a dedicated channel of amqpBroker (an AmqpFactory).
+    """
+
+    def __init__(self, amqpBroker, queues, interval, log, clock=time.time):
+        self.amqpBroker = amqpBroker
+        self.queues = queues
+        self.interval = interval
+        self.log = log
+        self.clock = clock
+        self.backlogs = {}
+        self.chan = None
+        self.broker_chan = None
+        self.lc = task.LoopingCall(self.poll)
+
+    def start(self):
+        self.lc.start(self.interval, now=False)
+
+    def stop(self):
+        if self.lc.running:
+            self.lc.stop()
+
+    def published(self, cid):
+        """Count a message published to cid's queue"""
+        if cid in self.backlogs:
+            self.backlogs[cid].published += 1
+
+    def drain_time(self, cid):
+        if cid not in self.backlogs:
+            return 0
+        return self.backlogs[cid].drain_time()
+
+    @defer.inlineCallbacks
+    def channel(self):
+        # Channels are lost with the connection
+        if self.chan is None or self.broker_chan is not self.amqpBroker.chan:
+            self.chan = yield self.amqpBroker.open_channel()
+            self.broker_chan = self.amqpBroker.chan
+
+        defer.returnValue(self.chan)
+
+    @defer.inlineCallbacks
+    def poll(self):
+        if not self.amqpBroker.connected:
+            return
+
+        queues = self.queues()
+        for cid in list(self.backlogs):
+            if cid not in queues:
+                del self.backlogs[cid]
+
+        for cid, names in queues.items():
+            depth = 0
+            consumers = 0
+            try:
+                for name in names:
+                    chan = yield self.channel()
+                    reply = yield chan.queue_declare(queue=name, passive=True)
+                    depth += reply.message_count
+                    consumers += reply.consumer_count
+            except Exception as e:
+                # The broker closed the channel, it is opened again on the next declaration
+                self.chan = None
+                self.log.warning('Cannot poll backlog of connector [cid:%s]: %s', cid, e)
+                continue
+
+            backlog = self.backlogs.setdefault(cid, Backlog())
+            backlog.update(depth, consumers, self.clock())
+            self.log.debug('Backlog of connector [cid:%s]: %s messages, %s consumers, drain time: %.1fs',
+                           cid, depth, consumers, backlog.drain_time())
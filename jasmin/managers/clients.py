@@ -11,10 +11,13 @@ from twisted.spread import pb
 import jasmin
 from jasmin.protocols.smpp.protocol import SMPPServerProtocol
 from jasmin.protocols.smpp.services import SMPPClientService
+from jasmin.queues.publish import PublishError
 from jasmin.tools.migrations.configuration import ConfigurationMigrator
 from smpp.pdu.pdu_types import RegisteredDeliveryReceipt
 from smpp.twisted.protocol import SMPPSessionStates
-from .configs import SMPPClientSMListenerConfig
+from .backlog import BacklogMonitor
+from .configs import SMPPClientSMListenerConfig, DLRLookupConfig
+from .dlrstore import get_dlr_store
 from .content import SubmitSmContent
 from .listeners import SMPPClientSMListener
 
@@ -33,7 +36,9 @@ class SMPPClientManagerPB(pb.Avatar):
         self.config = SMPPClientPBConfig
         self.avatar = None
         self.redisClient = None
+        self.dlr_store = None
         self.amqpBroker = None
+        self.backlog = None
         self.interceptorpb_client = None
         self.RouterPB = None
         self.connectors = []
@@ -74,10 +79,60 @@ class SMPPClientManagerPB(pb.Avatar):
     def addAmqpBroker(self, amqpBroker):
         self.amqpBroker = amqpBroker
 
+        if self.backlog is not None:
+            self.backlog.stop()
+            self.backlog = None
+        if self.config.submit_sm_max_drain_time > 0:
+            self.backlog = BacklogMonitor(amqpBroker, self.backlogQueues,
+                                          self.config.submit_sm_backlog_poll_interval, self.log)
+            self.backlog.start()
+
         self.log.info('Added amqpBroker to SMPPClientManagerPB')
 
+    def removeAmqpBroker(self):
+        if self.backlog is not None:
+            self.backlog.stop()
+            self.backlog = None
+        self.amqpBroker = None
+
+        self.log.info('Removed amqpBroker from SMPPClientManagerPB')
+
+    @defer.inlineCallbacks
+    def declareSubmitSmQueue(self, queue):
+        """Declare a submit.sm.<cid> queue with x-max-priority set to submit_sm_max_priority (if
+        greater than 0)
+
+        A queue existing with other arguments (declared before submit_sm_max_priority was changed)
+        is refused with PRECONDITION_FAILED and the broker closes the channel: it is first declared
+        on a dedicated channel, the existing queue is then used as is (passive declaration) until it
+        is deleted.
+        """
+        arguments = {}
+        if self.config.submit_sm_max_priority > 0:
+            arguments['x-max-priority'] = self.config.submit_sm_max_priority
+
+        try:
+            chan = yield self.amqpBroker.open_channel()
+            yield chan.queue_declare(queue=queue, arguments=arguments)
+            yield chan.channel_close()
+        except Exception as e:
+            self.log.warning('Queue %s exists with other arguments than %s, it must be deleted for '
+                             'submit_sm_max_priority to take effect: %s', queue, arguments, e)
+            yield self.amqpBroker.named_queue_declare(queue=queue, passive=True)
+        else:
+            yield self.amqpBroker.named_queue_declare(queue=queue, arguments=arguments)
+
+    def backlogQueues(self):
+        """Return the queues holding messages of every connector, polled by the backlog monitor"""
+        queues = {}
+        for c in self.connectors:
+            queues[c['id']] = ['submit.sm.%s' % c['id']] + c['sm_listener'].retries.retry_queues()
+        return queues
+
     def addRedisClient(self, redisClient):
         self.redisClient = redisClient
+        # DLR maps are stored in the same store DLRLookup is configured with
+        self.dlr_store = get_dlr_store(DLRLookupConfig(self.config.config_file), redisClient)
 
         self.log.info('Added Redis Client to SMPPClientManagerPB')
 
@@ -241,9 +296,6 @@ class SMPPClientManagerPB(pb.Avatar):
             self.log.error('AMQP Broker channel is not yet ready')
             defer.returnValue(False)
 
-        # Fix prefetch limit per consumer to 1 to get correct throttling
-        yield self.amqpBroker.chan.basic_qos(prefetch_count=1)
-
         # Declare queues
         # First declare the messaging exchange (has no effect if its already declared)
         yield self.amqpBroker.chan.exchange_declare(exchange='messaging', type='topic')
@@ -251,7 +303,7 @@ class SMPPClientManagerPB(pb.Avatar):
         submit_sm_queue = 'submit.sm.%s' % c.id
         routing_key = 'submit.sm.%s' % c.id
         self.log.info('Binding %s queue to %s route_key', submit_sm_queue, routing_key)
-        yield self.amqpBroker.named_queue_declare(queue=submit_sm_queue)
+        yield self.declareSubmitSmQueue(submit_sm_queue)
         yield self.amqpBroker.chan.queue_bind(queue=submit_sm_queue,
                                               exchange="messaging",
                                               routing_key=routing_key)
@@ -377,16 +429,17 @@ class SMPPClientManagerPB(pb.Avatar):
             # Stop the queue consumer if any
             if connector['consumer_tag'] is not None:
                 self.log.debug('Stopping submit_sm_q consumer in connector [%s]', cid)
-                yield self.amqpBroker.chan.basic_cancel(consumer_tag=connector['consumer_tag'])
+                yield self.amqpBroker.cancel(connector['consumer_tag'])
 
-            # Start a new consumer
-            yield self.amqpBroker.chan.basic_consume(queue=submit_sm_queue,
-                                                     no_ack=False, consumer_tag=consumerTag)
+            # Start a new consumer allowing as many unacknowledged messages as the connector's
+            # window of outstanding submit_sm
+            yield self.amqpBroker.consume(submit_sm_queue, consumerTag,
+                                          connector['config'].max_pending_submits)
         except Exception as e:
             self.log.error('Error consuming from queue %s: %s', submit_sm_queue, e)
             defer.returnValue(False)
 
-        submit_sm_q = yield self.amqpBroker.client.queue(consumerTag)
+        submit_sm_q = yield self.amqpBroker.queue(consumerTag)
         self.log.info('%s is consuming from queue: %s', consumerTag, submit_sm_queue)
 
         # Set callbacks for every consumed message from submit_sm_queue queue
@@ -421,7 +474,7 @@ class SMPPClientManagerPB(pb.Avatar):
         # Stop the queue consumer
         if connector['consumer_tag'] is not None:
             self.log.debug('Stopping submit_sm_q consumer in connector [%s]', cid)
-            yield self.amqpBroker.chan.basic_cancel(consumer_tag=connector['consumer_tag'])
+            yield self.amqpBroker.cancel(connector['consumer_tag'])
 
             # Cleaning
             self.log.debug('Cleaning objects in connector [%s]', cid)
@@ -436,19 +489,7 @@ class SMPPClientManagerPB(pb.Avatar):
             submitSmQueueName = 'submit.sm.%s' % cid
             self.log.debug('Deleting queue [%s]', submitSmQueueName)
             yield self.amqpBroker.chan.queue_delete(queue=submitSmQueueName)
-
-        # Reject & requeue any pending message to avoid loosing messages after
-        # clearing timers
-        if len(connector['sm_listener'].rejectTimers) > 0:
-            for msgid, timer in list(connector['sm_listener'].rejectTimers.items()):
-                if timer.active():
-                    func = timer.func
-                    kw = timer.kw
-                    timer.cancel()
-                    del connector['sm_listener'].rejectTimers[msgid]
-
-                    self.log.debug('Rejecting/requeuing msgid [%s] before stopping connector', msgid)
-                    yield func(**kw)
+            yield connector['sm_listener'].retries.delete()
 
         # Stop timers in message listeners
         self.log.debug('Clearing sm_listener timers in connector [%s]', cid)
@@ -531,6 +572,21 @@ class SMPPClientManagerPB(pb.Avatar):
 
         return self.getConnectorDetails(cid)
 
+    def perspective_connector_admits(self, cid):
+        """Return False if the connector's backlog would take more than submit_sm_max_drain_time
+        seconds to drain, new messages must not be enqueued to it
+        """
+
+        if self.backlog is None:
+            return True
+
+        drain_time = self.backlog.drain_time(cid)
+        if drain_time > self.config.submit_sm_max_drain_time:
+            self.log.debug('Connector [%s] does not admit new messages, drain time: %.1fs', cid, drain_time)
+            return False
+
+        return True
+
     def perspective_connector_config(self, cid):
         """This will return the connector SMPPClientConfig object
         """
@@ -561,12 +617,6 @@ class SMPPClientManagerPB(pb.Avatar):
             self.log.error('Trying to enqueue a SUBMIT_SM when no broker were added')
             defer.returnValue(False)
 
-        # TODO: Future implementation, submitting a sm to a disconnected broker would be possible
-        #    through a local in memory queue
-        if self.amqpBroker.connected == False:
-            self.log.error('AMQP Broker is not connected')
-            defer.returnValue(False)
-
         # Define the destination and response queue names
         pubQueueName = "submit.sm.%s" % cid
         responseQueueName = "submit.sm.resp.%s" % cid
@@ -580,23 +630,35 @@ class SMPPClientManagerPB(pb.Avatar):
             PickledSubmitSmPDU = SubmitSmPDU
             SubmitSmPDU = pickle.loads(PickledSubmitSmPDU)
 
-        # Publishing a pickled PDU
+        # RabbitMQ handles priorities above the queue's x-max-priority as the maximum
+        if self.config.submit_sm_max_priority > 0:
+            priority = min(priority, self.config.submit_sm_max_priority)
+
+        # Publishing a pickled PDU, or an encoded one if pickle is not the configured pdu_encoding
         self.log.debug('Publishing SubmitSmPDU with routing_key=%s, priority=%s', pubQueueName, priority)
+        if self.config.pdu_encoding == 'pickle':
+            body, prePickle = PickledSubmitSmPDU, False
+        else:
+            body, prePickle = SubmitSmPDU, True
         c = SubmitSmContent(
             uid=uid,
-            body=PickledSubmitSmPDU,
+            body=body,
             replyto=responseQueueName,
             submit_sm_bill=submit_sm_bill,
             priority=priority,
             expiration=validity_period,
             source_connector='httpapi' if source_connector == 'httpapi' else 'smppsapi',
-            destination_cid=cid)
-        yield self.amqpBroker.publish(exchange='messaging', routing_key=pubQueueName, content=c)
+            destination_cid=cid,
+            pickleProtocol=self.pickleProtocol,
+            prePickle=prePickle,
+            encoding=self.config.pdu_encoding)
 
+        # DLR mappings are written before publishing, their batched write must be complete before
+        # the connector gets a submit_sm_resp for this message
         if source_connector == 'httpapi' and dlr_url is not None:
             # Enqueue DLR request in redis 'dlr' key if it is a httpapi request
-            if self.redisClient is None or str(self.redisClient) == '<Redis Connection: Not connected>':
-                self.log.warning("DLR is not enqueued for SubmitSmPDU [msgid:%s], RC is not connected.",
+            if self.dlr_store is None or not self.dlr_store.available():
+                self.log.warning("DLR is not enqueued for SubmitSmPDU [msgid:%s], DLR store is not available.",
                               c.properties['message-id'])
             else:
                 self.log.debug('Setting DLR url (%s) and level (%s) for message id:%s, expiring in %s',
@@ -612,16 +674,17 @@ class SMPPClientManagerPB(pb.Avatar):
                               'method': dlr_method,
                               'connector': dlr_connector,
                               'expiry': connector['config'].dlr_expiry}
-                self.redisClient.hmset(hashKey, hashValues).addCallback(
-                    lambda response: self.redisClient.expire(
-                        hashKey, connector['config'].dlr_expiry))
+                try:
+                    yield self.dlr_store.set(hashKey, hashValues, connector['config'].dlr_expiry)
+                except Exception as e:
+                    self.log.error('DLR is not enqueued for SubmitSmPDU [msgid:%s]: %s', c.properties['message-id'], e)
         elif (isinstance(source_connector, SMPPServerProtocol) and
               SubmitSmPDU.params['registered_delivery'].receipt != RegisteredDeliveryReceipt.NO_SMSC_DELIVERY_RECEIPT_REQUESTED):
             # If submit_sm is successfully sent from a SMPPServerProtocol connector and DLR is
             # requested, then map message-id to the source_connector to permit related deliver_sm
             # messages holding further receipts to be sent back to the right connector
-            if self.redisClient is None or str(self.redisClient) == '<Redis Connection: Not connected>':
-                self.log.warning("SMPPs mapping is not done for SubmitSmPDU [msgid:%s], RC is not connected.",
+            if self.dlr_store is None or not self.dlr_store.available():
+                self.log.warning("SMPPs mapping is not done for SubmitSmPDU [msgid:%s], DLR store is not available.",
                               c.properties['message-id'])
             else:
                 self.log.debug(
@@ -643,8 +706,27 @@ class SMPPClientManagerPB(pb.Avatar):
                               'sub_date': datetime.datetime.now(),
                               'rd_receipt': SubmitSmPDU.params['registered_delivery'].receipt,
                               'expiry': source_connector.factory.config.dlr_expiry}
-                self.redisClient.hmset(hashKey, hashValues).addCallback(
-                    lambda response: self.redisClient.expire(
-                        hashKey, source_connector.factory.config.dlr_expiry))
+                try:
+                    yield self.dlr_store.set(hashKey, hashValues, source_connector.factory.config.dlr_expiry)
+                except Exception as e:
+                    self.log.error('SMPPs mapping is not done for SubmitSmPDU [msgid:%s]: %s',
+                                   c.properties['message-id'], e)
+
+        msgid = c.properties['message-id']
+        d = self.amqpBroker.publish(exchange='messaging', routing_key=pubQueueName, content=c)
+        if not self.amqpBroker.connected and not d.called:
+            # Buffered until the broker is reconnected, the caller is not held until then
+            self.log.warning('AMQP Broker is not connected, SubmitSmPDU [msgid:%s] is buffered', msgid)
+            d.addErrback(lambda f: self.log.error('SubmitSmPDU [msgid:%s] is not published: %s',
+                                                  msgid, f.value))
+        else:
+            try:
+                yield d
+            except PublishError as e:
+                self.log.error('SubmitSmPDU [msgid:%s] is not published: %s', msgid, e)
+                defer.returnValue(False)
+
+        if self.backlog is not None:
+            self.backlog.published(cid)
 
-        defer.returnValue(c.properties['message-id'])
+        defer.returnValue(msgid)
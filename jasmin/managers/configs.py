@@ -39,6 +39,20 @@ class SMPPClientPBConfig(ConfigFile):
         self.log_date_format = self._get('client-management', 'log_date_format', '%Y-%m-%d %H:%M:%S')
         self.pickle_protocol = self._getint('client-management', 'pickle_protocol', 2)
 
+        # Encoding of PDUs published on AMQP: pickle or smpp (c.f. jasmin.managers.pducodec)
+        self.pdu_encoding = self._get('client-management', 'pdu_encoding', 'pickle')
+
+        # x-max-priority of submit.sm.<cid> queues (up to 255), 0 to declare them with no priority
+        # support; published priorities are capped to it
+        self.submit_sm_max_priority = min(max(
+            self._getint('client-management', 'submit_sm_max_priority', 0), 0), 255)
+
+        # Admission control (c.f. jasmin.managers.backlog): submits to a connector are refused when
+        # its backlog would take more than submit_sm_max_drain_time seconds to drain, 0 to disable
+        self.submit_sm_max_drain_time = self._getfloat('client-management', 'submit_sm_max_drain_time', 0)
+        self.submit_sm_backlog_poll_interval = self._getfloat(
+            'client-management', 'submit_sm_backlog_poll_interval', 5)
+
 
 class SMPPClientSMListenerConfig(ConfigFile):
     """Config handler for 'sm-listener' section"""
@@ -70,6 +84,9 @@ class SMPPClientSMListenerConfig(ConfigFile):
         self.dlr_lookup_retry_delay = self._getint(
             'sm-listener', 'dlr_lookup_max_retries', 2)
 
+        # DLRs are spread over dlr_shards shards by SMPP message id, 0 to disable sharding
+        self.dlr_shards = self._getint('sm-listener', 'dlr_shards', 0)
+
         self.log_level = logging.getLevelName(self._get('sm-listener', 'log_level', 'INFO'))
         self.log_file = self._get('sm-listener', 'log_file', '%s/messages.log' % LOG_PATH)
         self.log_rotate = self._get('sm-listener', 'log_rotate', 'midnight')
@@ -89,6 +106,17 @@ class DLRLookupConfig(ConfigFile):
         self.dlr_lookup_retry_delay = self._getint('dlr', 'dlr_lookup_retry_delay', 10)
         self.dlr_lookup_max_retries = self._getint('dlr', 'dlr_lookup_max_retries', 2)
 
+        # DLR maps storage: redis or sqlite (embedded, single node only)
+        self.dlr_store = self._get('dlr', 'dlr_store', 'redis')
+        self.dlr_store_path = self._get('dlr', 'dlr_store_path', '%s/dlr-maps.sqlite' % STORE_PATH)
+        self.dlr_store_sweep_interval = self._getint('dlr', 'dlr_store_sweep_interval', 60)
+
+        # Max outstanding lookups
+        self.dlr_lookup_concurrency = max(1, self._getint('dlr', 'dlr_lookup_concurrency', 10))
+
+        # Consumed DLR shards (when sharding is enabled in sm-listener), consumes all DLRs if empty
+        self.shards = [int(s) for s in self._get('dlr', 'shards', '').split(',') if s.strip() != '']
+
         self.smpp_receipt_on_success_submit_sm_resp = self._getbool('dlr', 'smpp_receipt_on_success_submit_sm_resp',
                                                                     False)
 
@@ -12,6 +12,8 @@ from smpp.pdu.pdu_types import CommandId, CommandStatus
 
 from pkg_resources import iter_entry_points
 
+from jasmin.managers import pducodec
+
 
 class InvalidParameterError(Exception):
     """Raised when a parameter is invalid
@@ -28,17 +30,29 @@ for entry_point in iter_entry_points(group='jasmin.content', name='msgid'):
     break
 
 
+def decode_body(content):
+    """Return the PDU (or routable) held by a PDU content, whatever its encoding is"""
+    if content.properties.get('content-type') == pducodec.CONTENT_TYPE:
+        return pducodec.decode(content.body)
+
+    return pickle.loads(content.body)
+
+
 class PDU(Content):
-    """A generic SMPP PDU Content"""
+    """A generic SMPP PDU Content
+
+    When prePickle is True, body is encoded with encoding: 'pickle' or 'smpp' (c.f.
+    jasmin.managers.pducodec), PDUs that cannot be encoded as SMPP binary are pickled.
+    """
 
     pickleProtocol = pickle.HIGHEST_PROTOCOL
 
     def __init__(self, body="", children=None, properties=None, pickleProtocol=pickle.HIGHEST_PROTOCOL,
-                 prePickle=False):
+                 prePickle=False, encoding='pickle'):
         self.pickleProtocol = pickleProtocol
 
         if prePickle is True:
-            body = pickle.dumps(body, self.pickleProtocol)
+            body = self.encode(body, encoding, properties)
 
         # Add creation date in header
         if 'headers' not in properties:
@@ -47,6 +61,18 @@ class PDU(Content):
 
         Content.__init__(self, body, children, properties)
 
+    def encode(self, body, encoding, properties):
+        if encoding == 'smpp':
+            try:
+                body = pducodec.encode(body)
+            except ValueError:
+                pass
+            else:
+                properties['content-type'] = pducodec.CONTENT_TYPE
+                return body
+
+        return pickle.dumps(body, self.pickleProtocol)
+
 
 class DLR(Content):
     """A DLR is published to dlr.* routes for DLRLookup"""
@@ -93,7 +119,7 @@ class DLRContentForHttpapi(Content):
             raise InvalidParameterError("Invalid message_status: %s" % message_status)
         if dlr_level not in [1, 2, 3]:
             raise InvalidParameterError("Invalid dlr_level: %s" % dlr_level)
-        if method not in ['POST', 'GET']:
+        if method not in ['POST', 'GET', 'BATCH']:
             raise InvalidParameterError('Invalid method: %s' % method)
 
         properties = {'message-id': msgid, 'headers': {'try-count': 0,
@@ -144,10 +170,12 @@ class SubmitSmContent(PDU):
     """A SMPP SubmitSm Content"""
 
     def __init__(self, uid, body, replyto, submit_sm_bill=None, priority=1, expiration=None, msgid=None,
-                 source_connector='httpapi', destination_cid=None):
+                 source_connector='httpapi', destination_cid=None, pickleProtocol=pickle.HIGHEST_PROTOCOL,
+                 prePickle=False, encoding='pickle'):
         props = {}
 
-        # RabbitMQ does not support priority (yet), anyway, we may use any other amqp broker that supports it
+        # Priority is honored by RabbitMQ if the queue is declared with x-max-priority
+        # (c.f. client-management/submit_sm_max_priority)
         if not isinstance(priority, int):
             raise InvalidParameterError("Invalid priority argument: %s" % priority)
         if not isinstance(priority, int) or priority < 0:
@@ -168,23 +196,25 @@ class SubmitSmContent(PDU):
         if expiration is not None:
             props['headers']['expiration'] = expiration
 
-        PDU.__init__(self, body, properties=props)
+        PDU.__init__(self, body, properties=props, pickleProtocol=pickleProtocol, prePickle=prePickle,
+                     encoding=encoding)
 
 
 class SubmitSmRespContent(PDU):
     """A SMPP SubmitSmResp Content"""
 
-    def __init__(self, body, msgid, pickleProtocol=pickle.HIGHEST_PROTOCOL, prePickle=True):
+    def __init__(self, body, msgid, pickleProtocol=pickle.HIGHEST_PROTOCOL, prePickle=True, encoding='pickle'):
         props = {'message-id': msgid}
 
-        PDU.__init__(self, body, properties=props, pickleProtocol=pickleProtocol, prePickle=prePickle)
+        PDU.__init__(self, body, properties=props, pickleProtocol=pickleProtocol, prePickle=prePickle,
+                     encoding=encoding)
 
 
 class DeliverSmContent(PDU):
     """A SMPP DeliverSm Content"""
 
     def __init__(self, body, sourceCid, pickleProtocol=pickle.HIGHEST_PROTOCOL, prePickle=True,
-                 concatenated=False, will_be_concatenated=False):
+                 concatenated=False, will_be_concatenated=False, encoding='pickle'):
         props = {}
 
         props['message-id'] = randomUniqueId('deliver_sm', None, sourceCid, None)
@@ -195,7 +225,8 @@ class DeliverSmContent(PDU):
                             'concatenated': concatenated,
                             'will_be_concatenated': will_be_concatenated}
 
-        PDU.__init__(self, body, properties=props, pickleProtocol=pickleProtocol, prePickle=prePickle)
+        PDU.__init__(self, body, properties=props, pickleProtocol=pickleProtocol, prePickle=prePickle,
+                     encoding=encoding)
 
 
 class SubmitSmRespBillContent(Content):
@@ -1,16 +1,18 @@
 import sys
 import logging
+import zlib
 from logging.handlers import TimedRotatingFileHandler
 
 from twisted.internet import defer
-from twisted.internet import reactor
 from txamqp.queue import Closed
 from txredisapi import ConnectionError
 from smpp.pdu.pdu_types import RegisteredDeliveryReceipt
 
+from jasmin.managers.dlrstore import DLRStoreError, get_dlr_store
 from jasmin.managers.content import DLRContentForHttpapi, DLRContentForSmpps
+from jasmin.queues.retry import RetryScheduler, retries
 from jasmin.tools.singleton import Singleton
-from jasmin.tools import to_enum
+from jasmin.tools import to_enum, qos
 
 LOG_CATEGORY = "dlr"
 
@@ -27,6 +29,23 @@ class DLRMapNotFound(Exception):
     """Raised if no dlr is found in Redis db"""
 
 
+def dlr_key(dlr):
+    """Return the key shared by all DLRs of one message: the SMPP message id an ESME_ROK submit_sm_resp
+    maps (its deliver_sm receipts are published with this id), a failed submit_sm_resp is not followed
+    by any receipt and is keyed on its queue message id"""
+    headers = dlr.properties.get('headers', {})
+    return headers.get('smpp_msgid', dlr.properties['message-id'])
+
+
+def dlr_routing_key(kind, dlr, shards=0):
+    """Return the routing key of a DLR (kind is submit_sm_resp or deliver_sm), DLRs of the same
+    message are always published to the same shard"""
+    if shards > 0:
+        return 'dlr.%s.%s' % (zlib.crc32(str(dlr_key(dlr)).encode()) % shards, kind)
+
+    return 'dlr.%s' % kind
+
+
 class DLRLookup:
     """
     Will consume dlr pdus (submit_sm, deliver_sm or data_sm), lookup for matching dlr maps in redis db
@@ -39,8 +58,10 @@ class DLRLookup:
         self.config = config
         self.amqpBroker = amqpBroker
         self.redisClient = redisClient
-        self.requeue_timers = {}
-        self.lookup_retrials = {}
+        self.store = get_dlr_store(config, redisClient)
+        self.retries = None
+        self.lookups = qos.SendWindow(config.dlr_lookup_concurrency)
+        self.lookups_by_msgid = {}
 
         # Set up a dedicated logger
         self.log = logging.getLogger(LOG_CATEGORY)
@@ -64,12 +85,18 @@ class DLRLookup:
 
         consumerTag = 'DLRLookup-%s' % self.pid
         queueName = 'DLRLookup-%s' % self.pid  # A local queue to this object
-        routing_key = 'dlr.*'
+        if len(self.config.shards) > 0:
+            routing_keys = ['dlr.%s.*' % shard for shard in self.config.shards]
+        else:
+            # Unsharded (dlr.<kind>) and sharded (dlr.<shard>.<kind>) DLRs
+            routing_keys = ['dlr.*', 'dlr.*.*']
         yield self.amqpBroker.chan.exchange_declare(exchange='messaging', type='topic')
         yield self.amqpBroker.named_queue_declare(queue=queueName)
-        yield self.amqpBroker.chan.queue_bind(queue=queueName, exchange="messaging", routing_key=routing_key)
-        yield self.amqpBroker.chan.basic_consume(queue=queueName, no_ack=False, consumer_tag=consumerTag)
-        self.amqpBroker.client.queue(consumerTag).addCallback(self.setup_callbacks)
+        for routing_key in routing_keys:
+            yield self.amqpBroker.chan.queue_bind(queue=queueName, exchange="messaging", routing_key=routing_key)
+        yield self.amqpBroker.consume(queueName, consumerTag, self.amqpBroker.config.dlr_prefetch)
+        self.retries = RetryScheduler(self.amqpBroker, queueName, self.log)
+        self.amqpBroker.queue(consumerTag).addCallback(self.setup_callbacks)
 
     @defer.inlineCallbacks
     def rejectAndRequeueMessage(self, message, delay=True):
@@ -78,43 +105,32 @@ class DLRLookup:
         if delay:
             self.log.debug("Requeuing Content[%s] with delay: %s seconds",
                            msgid, self.config.dlr_lookup_retry_delay)
-
-            # Requeue the message with a delay
-            timer = reactor.callLater(self.config.dlr_lookup_retry_delay,
-                                      self.rejectMessage,
-                                      message=message,
-                                      requeue=1)
-
-            # If any, clear timer before setting a new one
-            if msgid in self.requeue_timers:
-                timer = self.requeue_timers[msgid]
-                if timer.active():
-                    timer.cancel()
-                del self.requeue_timers[msgid]
-
-            # Set new timer
-            self.requeue_timers[msgid] = timer
-            defer.returnValue(timer)
+            yield self.retries.retry(message, self.config.dlr_lookup_retry_delay)
         else:
             self.log.debug("Requeuing Content[%s] without delay", msgid)
-            yield self.rejectMessage(message, requeue=1)
+            yield self.retries.retry(message)
 
     @defer.inlineCallbacks
     def rejectMessage(self, message, requeue=0):
-        if requeue == 0 and message.content.properties['message-id'] in self.lookup_retrials:
-            # Remove retrial tracker
-            del self.lookup_retrials[message.content.properties['message-id']]
-
-        yield self.amqpBroker.chan.basic_reject(delivery_tag=message.delivery_tag, requeue=requeue)
+        yield self.amqpBroker.reject(message, requeue)
 
     @defer.inlineCallbacks
     def ackMessage(self, message):
-        # Remove retrial tracker
-        if message.content.properties['message-id'] in self.lookup_retrials:
-            # Remove retrial tracker
-            del self.lookup_retrials[message.content.properties['message-id']]
+        yield self.amqpBroker.ack(message)
 
-        yield self.amqpBroker.chan.basic_ack(message.delivery_tag)
+    def getLookupRetrials(self, message):
+        """Return the current lookup try of message, retries are counted in its headers"""
+        return retries(message) + 1
+
+    @defer.inlineCallbacks
+    def get_map(self, key):
+        """Return the dlr map (or smpp msgid mapping) stored in key"""
+        try:
+            _map = yield self.store.get(key)
+        except ValueError as e:
+            raise DLRMapError('Cannot decode dlr map in %s: %s' % (key, e))
+
+        defer.returnValue(_map)
 
     def setup_callbacks(self, q):
         if self.q is None:
@@ -125,19 +141,35 @@ class DLRLookup:
 
     @defer.inlineCallbacks
     def dlr_callback_dispatcher(self, message):
+        """Up to dlr_lookup_concurrency lookups are processed at once, the next message is taken
+        from the queue when a slot is free; lookups of the same message are processed in order"""
+        yield self.lookups.acquire()
+
         # Again ...
         self.setup_callbacks(self.q)
 
-        # retrial tracking
-        if message.content.properties['message-id'] in self.lookup_retrials:
-            self.lookup_retrials[message.content.properties['message-id']] += 1
-        else:
-            self.lookup_retrials[message.content.properties['message-id']] = 1
+        msgid = dlr_key(message.content)
+        previous = self.lookups_by_msgid.get(msgid)
+        done = defer.Deferred()
+        self.lookups_by_msgid[msgid] = done
+        try:
+            if previous is not None:
+                yield previous
 
-        # Dispatching
-        if message.routing_key == 'dlr.submit_sm_resp':
+            yield self.dispatch(message)
+        finally:
+            if self.lookups_by_msgid.get(msgid) is done:
+                del self.lookups_by_msgid[msgid]
+            done.callback(None)
+            self.lookups.release()
+
+    @defer.inlineCallbacks
+    def dispatch(self, message):
+        # Dispatching, sharded routing keys are dlr.<shard>.<kind>
+        kind = message.routing_key.split('.')[-1]
+        if kind == 'submit_sm_resp':
             yield self.submit_sm_resp_dlr_callback(message)
-        elif message.routing_key == 'dlr.deliver_sm':
+        elif kind == 'deliver_sm':
             yield self.deliver_sm_dlr_callback(message)
         else:
             self.log.error('Unknown routing_key in dlr_callback_dispatcher: %s', message.routing_key)
@@ -164,13 +196,13 @@ class DLRLookup:
             dlr_status = dlr_status.decode()
 
         try:
-            if self.redisClient is None:
-                raise RedisError('RC undefined !')
+            if not self.store.available():
+                raise RedisError('DLR store is not available !')
 
             # Check for DLR request from redis 'dlr' key
             # If there's a pending delivery receipt request then serve it
             # back by publishing a DLRContentForHttpapi to the messaging exchange
-            dlr = yield self.redisClient.hgetall("dlr:%s" % msgid)
+            dlr = yield self.get_map("dlr:%s" % msgid)
 
             if dlr is None or len(dlr) == 0:
                 raise DLRMapNotFound('No dlr map for msgid[%s]' % msgid)
@@ -210,7 +242,7 @@ class DLRLookup:
                     # receiving a deliver_sm (terminal receipt)
                     if dlr_level == 1 or dlr_status != 'ESME_ROK':
                         self.log.debug('Removing DLR request for msgid[%s]', msgid)
-                        yield self.redisClient.delete("dlr:%s" % msgid)
+                        yield self.store.delete("dlr:%s" % msgid)
                 else:
                     self.log.debug(
                         'Terminal level receipt is requested, will not send any DLR receipt at this level.')
@@ -222,8 +254,7 @@ class DLRLookup:
                                    smpp_msgid, msgid, dlr_expiry)
                     hashKey = "queue-msgid:%s" % smpp_msgid
                     hashValues = {'msgid': msgid, 'connector_type': 'httpapi'}
-                    yield self.redisClient.hmset(hashKey, hashValues)
-                    yield self.redisClient.expire(hashKey, dlr_expiry)
+                    yield self.store.set(hashKey, hashValues, dlr_expiry)
             elif dlr['sc'] == 'smppsapi':
                 self.log.debug('There is a SMPPs mapping for msgid[%s] ...', msgid)
                 system_id = dlr['system_id']
@@ -273,14 +304,13 @@ class DLRLookup:
                                        smpp_msgid, msgid, smpps_map_expiry)
                         hashKey = "queue-msgid:%s" % smpp_msgid
                         hashValues = {'msgid': msgid, 'connector_type': 'smppsapi'}
-                        yield self.redisClient.hmset(hashKey, hashValues)
-                        yield self.redisClient.expire(hashKey, smpps_map_expiry)
+                        yield self.store.set(hashKey, hashValues, smpps_map_expiry)
         except DLRMapError as e:
             self.log.error('[msgid:%s] DLR Content: %s', msgid, e)
             yield self.rejectMessage(message)
-        except (RedisError, ConnectionError) as e:
-            if msgid in self.lookup_retrials and self.lookup_retrials[msgid] < self.config.dlr_lookup_max_retries:
-                self.log.error('[msgid:%s] (retrials: %s/%s) RedisError: %s', msgid, self.lookup_retrials[msgid],
+        except (RedisError, ConnectionError, DLRStoreError) as e:
+            if self.getLookupRetrials(message) < self.config.dlr_lookup_max_retries:
+                self.log.error('[msgid:%s] (retrials: %s/%s) RedisError: %s', msgid, self.getLookupRetrials(message),
                                self.config.dlr_lookup_max_retries, e)
                 yield self.rejectAndRequeueMessage(message)
             else:
@@ -312,10 +342,10 @@ class DLRLookup:
             pdu_dlr_status = pdu_dlr_status.decode()
 
         try:
-            if self.redisClient is None:
-                raise RedisError('RC undefined !')
+            if not self.store.available():
+                raise RedisError('DLR store is not available !')
 
-            q = yield self.redisClient.hgetall("queue-msgid:%s" % msgid)
+            q = yield self.get_map("queue-msgid:%s" % msgid)
             if len(q) != 2 or 'msgid' not in q or 'connector_type' not in q:
                 raise DLRMapNotFound('Got a DLR for an unknown message id: %s (coded:%s)' % (pdu_dlr_id, msgid))
 
@@ -323,7 +353,7 @@ class DLRLookup:
             connector_type = q['connector_type']
 
             # Get dlr and ensure it's sc (source_connector) is same as q['connector_type']
-            dlr = yield self.redisClient.hgetall("dlr:%s" % submit_sm_queue_id)
+            dlr = yield self.get_map("dlr:%s" % submit_sm_queue_id)
             if dlr is None or len(dlr) == 0:
                 raise DLRMapNotFound('Got a DLR for an unknown message id: %s (coded:%s)' % (pdu_dlr_id, msgid))
             if len(dlr) > 0 and dlr['sc'] != connector_type:
@@ -363,7 +393,7 @@ class DLRLookup:
 
                     if pdu_dlr_status in final_states:
                         self.log.debug('Removing HTTP dlr map for msgid[%s]', submit_sm_queue_id)
-                        yield self.redisClient.delete('dlr:%s' % submit_sm_queue_id)
+                        yield self.store.delete('dlr:%s' % submit_sm_queue_id)
             elif connector_type == 'smppsapi':
                 self.log.debug('There is a SMPPs mapping for msgid[%s] ...', msgid)
                 system_id = dlr['system_id']
@@ -405,21 +435,21 @@ class DLRLookup:
 
                     if pdu_dlr_status in final_states:
                         self.log.debug('Removing SMPPs dlr map for msgid[%s]', submit_sm_queue_id)
-                        yield self.redisClient.delete('dlr:%s' % submit_sm_queue_id)
+                        yield self.store.delete('dlr:%s' % submit_sm_queue_id)
         except DLRMapError as e:
             self.log.error('[msgid:%s] DLRMapError: %s', msgid, e)
             yield self.rejectMessage(message)
-        except (RedisError, ConnectionError) as e:
-            if msgid in self.lookup_retrials and self.lookup_retrials[msgid] < self.config.dlr_lookup_max_retries:
-                self.log.error('[msgid:%s] (retrials: %s/%s) RedisError: %s', msgid, self.lookup_retrials[msgid],
+        except (RedisError, ConnectionError, DLRStoreError) as e:
+            if self.getLookupRetrials(message) < self.config.dlr_lookup_max_retries:
+                self.log.error('[msgid:%s] (retrials: %s/%s) RedisError: %s', msgid, self.getLookupRetrials(message),
                                self.config.dlr_lookup_max_retries, e)
                 yield self.rejectAndRequeueMessage(message)
             else:
                 self.log.error('[msgid:%s] (final) RedisError: %s', msgid, e)
                 yield self.rejectMessage(message)
         except DLRMapNotFound as e:
-            if msgid in self.lookup_retrials and self.lookup_retrials[msgid] < self.config.dlr_lookup_max_retries:
-                self.log.error('[msgid:%s] (retrials: %s/%s) DLRMapNotFound: %s', msgid, self.lookup_retrials[msgid],
+            if self.getLookupRetrials(message) < self.config.dlr_lookup_max_retries:
+                self.log.error('[msgid:%s] (retrials: %s/%s) DLRMapNotFound: %s', msgid, self.getLookupRetrials(message),
                                self.config.dlr_lookup_max_retries, e)
                 yield self.rejectAndRequeueMessage(message)
             else:
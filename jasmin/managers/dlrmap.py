@@ -0,0 +1,135 @@
+"""
+Compact encoding of DLR maps
+
+DLR maps (dlr:<msgid>) and smpp message id mappings (queue-msgid:<smpp_msgid>) are stored as
+single redis strings holding a version byte, the map kind, a fixed struct of numeric fields and
+length-prefixed strings; decoded maps are dicts holding the same keys and values than the redis
+hashes used by older releases.
+"""
+
+import struct
+from datetime import datetime
+
+from smpp.pdu.pdu_types import RegisteredDeliveryReceipt, AddrNpi, AddrTon
+
+VERSION = 1
+
+# Map kinds
+HTTPAPI = 1
+SMPPSAPI = 2
+QUEUE_MSGID = 3
+
+HEADER = struct.Struct('!BB')
+STRING_LENGTH = struct.Struct('!H')
+NONE_LENGTH = 0xFFFF
+
+# Fixed numeric fields and strings of every map kind
+HTTPAPI_FIELDS = struct.Struct('!BI')  # level, expiry
+HTTPAPI_STRINGS = ['url', 'method', 'connector']
+SMPPSAPI_FIELDS = struct.Struct('!BBBBBdI')  # source/dest ton & npi, rd_receipt, sub_date, expiry
+SMPPSAPI_STRINGS = ['system_id', 'source_addr', 'destination_addr']
+QUEUE_MSGID_FIELDS = struct.Struct('!B')  # connector_type
+QUEUE_MSGID_STRINGS = ['msgid']
+
+CONNECTOR_TYPES = {'httpapi': HTTPAPI, 'smppsapi': SMPPSAPI}
+
+
+def encode_strings(mapping, keys):
+    data = []
+    for key in keys:
+        value = mapping.get(key)
+        if value is None:
+            data.append(STRING_LENGTH.pack(NONE_LENGTH))
+            continue
+
+        if isinstance(value, str):
+            value = value.encode()
+        elif not isinstance(value, bytes):
+            value = str(value).encode()
+        data.append(STRING_LENGTH.pack(len(value)))
+        data.append(value)
+
+    return b''.join(data)
+
+
+def decode_strings(blob, offset, keys):
+    mapping = {}
+    for key in keys:
+        length, = STRING_LENGTH.unpack_from(blob, offset)
+        offset += STRING_LENGTH.size
+        if length == NONE_LENGTH:
+            mapping[key] = None
+            continue
+
+        mapping[key] = blob[offset:offset + length].decode(errors='replace')
+        offset += length
+
+    return mapping
+
+
+def encode(mapping):
+    """Encode a DLR map (having a 'sc' key) or a smpp message id mapping (having a 'connector_type'
+    key)"""
+    if mapping.get('sc') == 'httpapi':
+        return b''.join([
+            HEADER.pack(VERSION, HTTPAPI),
+            HTTPAPI_FIELDS.pack(mapping['level'], mapping['expiry']),
+            encode_strings(mapping, HTTPAPI_STRINGS)])
+    elif mapping.get('sc') == 'smppsapi':
+        return b''.join([
+            HEADER.pack(VERSION, SMPPSAPI),
+            SMPPSAPI_FIELDS.pack(mapping['source_addr_ton'].value, mapping['source_addr_npi'].value,
+                                 mapping['dest_addr_ton'].value, mapping['dest_addr_npi'].value,
+                                 mapping['rd_receipt'].value, mapping['sub_date'].timestamp(),
+                                 mapping['expiry']),
+            encode_strings(mapping, SMPPSAPI_STRINGS)])
+    elif mapping.get('connector_type') in CONNECTOR_TYPES:
+        return b''.join([
+            HEADER.pack(VERSION, QUEUE_MSGID),
+            QUEUE_MSGID_FIELDS.pack(CONNECTOR_TYPES[mapping['connector_type']]),
+            encode_strings(mapping, QUEUE_MSGID_STRINGS)])
+
+    raise ValueError('Cannot encode unknown map: %s' % mapping)
+
+
+def decode(blob):
+    """Decode an encoded map, raise a ValueError if it cannot be decoded"""
+    if isinstance(blob, str):
+        # Redis client decodes values when they are valid utf-8
+        blob = blob.encode()
+    if not isinstance(blob, bytes) or len(blob) < HEADER.size:
+        raise ValueError('Cannot decode map: %r' % blob)
+
+    try:
+        version, kind = HEADER.unpack_from(blob)
+        if version != VERSION:
+            raise ValueError('Unsupported map version: %s' % version)
+
+        offset = HEADER.size
+        if kind == HTTPAPI:
+            level, expiry = HTTPAPI_FIELDS.unpack_from(blob, offset)
+            mapping = decode_strings(blob, offset + HTTPAPI_FIELDS.size, HTTPAPI_STRINGS)
+            mapping.update({'sc': 'httpapi', 'level': level, 'expiry': expiry})
+        elif kind == SMPPSAPI:
+            (source_addr_ton, source_addr_npi, dest_addr_ton, dest_addr_npi, rd_receipt, sub_date,
+             expiry) = SMPPSAPI_FIELDS.unpack_from(blob, offset)
+            mapping = decode_strings(blob, offset + SMPPSAPI_FIELDS.size, SMPPSAPI_STRINGS)
+            mapping.update({
+                'sc': 'smppsapi',
+                'source_addr_ton': AddrTon(source_addr_ton),
+                'source_addr_npi': AddrNpi(source_addr_npi),
+                'dest_addr_ton': AddrTon(dest_addr_ton),
+                'dest_addr_npi': AddrNpi(dest_addr_npi),
+                'rd_receipt': RegisteredDeliveryReceipt(rd_receipt),
+                'sub_date': datetime.fromtimestamp(sub_date),
+                'expiry': expiry})
+        elif kind == QUEUE_MSGID:
+            connector_type, = QUEUE_MSGID_FIELDS.unpack_from(blob, offset)
+            mapping = decode_strings(blob, offset + QUEUE_MSGID_FIELDS.size, QUEUE_MSGID_STRINGS)
+            mapping['connector_type'] = {v: k for k, v in CONNECTOR_TYPES.items()}[connector_type]
+        else:
+            raise ValueError('Unknown map kind: %s' % kind)
+    except (struct.error, KeyError) as e:
+        raise ValueError('Cannot decode map: %s' % e)
+
+    return mapping
@@ -0,0 +1,155 @@
+"""
+DLR maps storage backends
+
+DLR maps (dlr:<msgid>) and smpp message id mappings (queue-msgid:<smpp_msgid>) are set when
+submitting messages and receiving submit_sm_resp, they are looked up by DLRLookup until they
+expire; maps are stored encoded with jasmin.managers.dlrmap.
+"""
+
+import logging
+import sqlite3
+import time
+
+from twisted.enterprise import adbapi
+from twisted.internet import defer, task
+from txredisapi import ResponseError
+
+from jasmin.managers import dlrmap
+
+# Same logger as DLRLookup
+LOG_CATEGORY = "dlr"
+
+
+class DLRStoreError(Exception):
+    """Raised when the store cannot be reached"""
+
+
+class DLRStore:
+    """DLR maps store interface, all methods but available() return deferreds
+
+    get() fires with the map (or an empty dict if not found or expired) and errbacks with a
+    ValueError if the map cannot be decoded.
+    """
+
+    def available(self):
+        raise NotImplementedError
+
+    def set(self, key, mapping, expiry):
+        raise NotImplementedError
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+
+class RedisDLRStore(DLRStore):
+    """Stores DLR maps in redis, maps are written in batches (c.f. jasmin.redis.client)"""
+
+    def __init__(self, redisClient):
+        self.redisClient = redisClient
+
+    def available(self):
+        return self.redisClient is not None and str(self.redisClient) != '<Redis Connection: Not connected>'
+
+    def set(self, key, mapping, expiry):
+        return self.redisClient.set_expire(key, dlrmap.encode(mapping), expiry)
+
+    @defer.inlineCallbacks
+    def get(self, key):
+        try:
+            blob = yield self.redisClient.cached_get(key)
+        except ResponseError as e:
+            if not str(e).startswith('WRONGTYPE'):
+                raise DLRStoreError(e)
+
+            # Maps set by older releases are redis hashes
+            _map = yield self.redisClient.hgetall(key)
+            defer.returnValue(_map)
+
+        if blob is None:
+            defer.returnValue({})
+
+        defer.returnValue(dlrmap.decode(blob))
+
+    def delete(self, key):
+        return self.redisClient.batched_delete(key)
+
+
+class SQLiteDLRStore(DLRStore):
+    """Stores DLR maps in an embedded SQLite database (WAL mode), holding far more pending maps
+    than memory permits; expired maps are deleted every sweep_interval seconds
+    """
+
+    def __init__(self, path, sweep_interval=60, log=None):
+        self.path = path
+        self.log = log or logging.getLogger(LOG_CATEGORY)
+        self.dbpool = adbapi.ConnectionPool('sqlite3', path, check_same_thread=False,
+                                            cp_min=1, cp_max=1, cp_openfun=self.prepare)
+
+        self.sweeper = task.LoopingCall(self.sweep)
+        self.sweeper.start(sweep_interval, now=False)
+
+    def prepare(self, connection):
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        connection.execute('CREATE TABLE IF NOT EXISTS dlr_maps ('
+                           'key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL NOT NULL)')
+        connection.execute('CREATE INDEX IF NOT EXISTS dlr_maps_expires_at ON dlr_maps (expires_at)')
+        connection.commit()
+
+    def run(self, *args):
+        return self.dbpool.runOperation(*args).addErrback(self.failed)
+
+    def failed(self, failure):
+        failure.trap(sqlite3.Error)
+        raise DLRStoreError(failure.value)
+
+    def available(self):
+        return self.dbpool.running
+
+    def set(self, key, mapping, expiry):
+        return self.run('INSERT OR REPLACE INTO dlr_maps (key, value, expires_at) VALUES (?, ?, ?)',
+                        (key, dlrmap.encode(mapping), time.time() + expiry))
+
+    @defer.inlineCallbacks
+    def get(self, key):
+        rows = yield self.dbpool.runQuery('SELECT value FROM dlr_maps WHERE key = ? AND expires_at > ?',
+                                          (key, time.time())).addErrback(self.failed)
+        if len(rows) == 0:
+            defer.returnValue({})
+
+        defer.returnValue(dlrmap.decode(bytes(rows[0][0])))
+
+    def delete(self, key):
+        return self.run('DELETE FROM dlr_maps WHERE key = ?', (key,))
+
+    def sweep(self):
+        """Delete expired maps, failures (a locked database ...) are logged and never stop the
+        sweeper"""
+        return self.run('DELETE FROM dlr_maps WHERE expires_at <= ?', (time.time(),)).addErrback(
+            self.sweep_failed)
+
+    def sweep_failed(self, failure):
+        self.log.error('Cannot delete expired DLR maps from %s: %s', self.path, failure.value)
+
+    def close(self):
+        if self.sweeper.running:
+            self.sweeper.stop()
+        self.dbpool.close()
+
+
+# SQLite stores are shared by all DLR maps users of the same process
+sqlite_stores = {}
+
+
+def get_dlr_store(config, redisClient):
+    """Return the DLR store configured in config (a DLRLookupConfig)"""
+    if config.dlr_store == 'sqlite':
+        if config.dlr_store_path not in sqlite_stores:
+            sqlite_stores[config.dlr_store_path] = SQLiteDLRStore(config.dlr_store_path,
+                                                                  config.dlr_store_sweep_interval)
+        return sqlite_stores[config.dlr_store_path]
+
+    return RedisDLRStore(redisClient)
@@ -2,12 +2,11 @@
 import pickle
 import sys
 import logging
-from datetime import datetime, timedelta
+from datetime import datetime
 from logging.handlers import TimedRotatingFileHandler
 
 from dateutil import parser
 from twisted.internet import defer
-from twisted.internet import reactor
 from txamqp.queue import Closed
 from smpp.pdu.operations import SubmitSM, DeliverSM
 from smpp.pdu.pdu_types import CommandStatus, DataCodingScheme, DataCodingGsmMsgClass, EsmClassGsmFeatures
@@ -15,9 +14,12 @@ from smpp.twisted.protocol import DataHandlerResponse
 from smpp.pdu.error import SMPPRequestTimoutError
 
 from jasmin.managers.configs import SMPPClientPBConfig
-from jasmin.managers.content import SubmitSmRespContent, DeliverSmContent, SubmitSmRespBillContent, DLR
+from jasmin.managers.content import (SubmitSmRespContent, DeliverSmContent, SubmitSmRespBillContent, DLR,
+                                     decode_body)
+from jasmin.managers.dlr import dlr_routing_key
 from jasmin.protocols.smpp.error import *
 from jasmin.protocols.smpp.operations import SMPPOperationFactory
+from jasmin.queues.retry import RetryScheduler, retries
 from jasmin.routing.Routables import RoutableDeliverSm
 from jasmin.routing.jasminApi import Connector
 from jasmin.tools import qos
@@ -40,13 +42,14 @@ class SMPPClientSMListener:
         self.RouterPB = RouterPB
         self.interceptorpb_client = interceptorpb_client
         self.submit_sm_q = None
-        self.qos_last_submit_sm_at = None
-        self.rejectTimers = {}
-        self.submit_retrials = {}
         self.qosTimer = None
+        self.submit_sm_pacer = None
+        self.submit_sm_window = None
 
-        # Set pickleProtocol
-        self.pickleProtocol = SMPPClientPBConfig(self.config.config_file).pickle_protocol
+        # Set pickleProtocol and pduEncoding
+        pb_config = SMPPClientPBConfig(self.config.config_file)
+        self.pickleProtocol = pb_config.pickle_protocol
+        self.pduEncoding = pb_config.pdu_encoding
 
         # Set up a dedicated logger
         self.log = logging.getLogger(LOG_CATEGORY)
@@ -62,31 +65,23 @@ class SMPPClientSMListener:
             self.log.addHandler(handler)
             self.log.propagate = False
 
+        self.retries = RetryScheduler(self.amqpBroker, 'submit.sm.%s' % self.SMPPClientFactory.config.id, self.log)
+
     def setSubmitSmQ(self, queue):
         self.log.debug('Setting a new submit_sm_q: %s', queue)
         self.submit_sm_q = queue
 
-    def clearRejectTimer(self, msgid):
-        if msgid in self.rejectTimers:
-            timer = self.rejectTimers[msgid]
-            if timer.active():
-                timer.cancel()
-            del self.rejectTimers[msgid]
-
-    def clearRejectTimers(self):
-        for msgid, timer in list(self.rejectTimers.items()):
-            if timer.active():
-                timer.cancel()
-            del self.rejectTimers[msgid]
-
     def clearQosTimer(self):
         if self.qosTimer is not None and self.qosTimer.called is False:
             self.qosTimer.cancel()
             self.qosTimer = None
 
+        # Waiting messages will go through their normal path (requeued if connector is not bound)
+        if self.submit_sm_pacer is not None:
+            self.submit_sm_pacer.flush()
+
     def clearAllTimers(self):
         self.clearQosTimer()
-        self.clearRejectTimers()
 
     @defer.inlineCallbacks
     def rejectAndRequeueMessage(self, message, delay=True):
@@ -101,73 +96,76 @@ class SMPPClientSMListener:
 
             self.log.debug("Requeuing SubmitSmPDU[%s] in %s seconds",
                            msgid, requeue_delay)
-
-            # Requeue the message with a delay
-            timer = reactor.callLater(requeue_delay,
-                                      self.rejectMessage,
-                                      message=message,
-                                      requeue=1)
-
-            # If any, clear timer before setting a new one
-            self.clearRejectTimer(msgid)
-
-            self.rejectTimers[msgid] = timer
-            defer.returnValue(timer)
+            yield self.retries.retry(message, requeue_delay)
         else:
             self.log.debug("Requeuing SubmitSmPDU[%s] without delay", msgid)
-            yield self.rejectMessage(message, requeue=1)
+            yield self.retries.retry(message)
 
     @defer.inlineCallbacks
     def rejectMessage(self, message, requeue=0):
-        yield self.amqpBroker.chan.basic_reject(delivery_tag=message.delivery_tag, requeue=requeue)
+        yield self.amqpBroker.reject(message, requeue)
 
     @defer.inlineCallbacks
     def ackMessage(self, message):
-        yield self.amqpBroker.chan.basic_ack(message.delivery_tag)
+        yield self.amqpBroker.ack(message)
+
+    def getSubmitRetrials(self, message):
+        """Return the current submit try of message, retries are counted in its headers"""
+        return retries(message) + 1
+
+    def getSubmitSmPacer(self):
+        """Return the submit_sm token bucket, kept in sync with connector's throughput and burst"""
+        config = self.SMPPClientFactory.config
+        if self.submit_sm_pacer is None:
+            self.submit_sm_pacer = qos.TokenBucket(config.submit_sm_throughput, config.submit_sm_burst)
+        else:
+            self.submit_sm_pacer.set(config.submit_sm_throughput, config.submit_sm_burst)
+
+        return self.submit_sm_pacer
+
+    def getSubmitSmWindow(self):
+        """Return the window of outstanding submit_sm, kept in sync with connector's max_pending_submits"""
+        if self.submit_sm_window is None:
+            self.submit_sm_window = qos.SendWindow(self.SMPPClientFactory.config.max_pending_submits)
+        elif self.submit_sm_window.size != self.SMPPClientFactory.config.max_pending_submits:
+            self.submit_sm_window.resize(self.SMPPClientFactory.config.max_pending_submits)
+
+        return self.submit_sm_window
 
     @defer.inlineCallbacks
     def submit_sm_callback(self, message):
         """This callback is a queue listener
         it is called whenever a message was consumed from queue
         c.f. test_amqp.ConsumeTestCase for use cases
+
+        Up to max_pending_submits messages are sent without waiting for their submit_sm_resp,
+        the next message is taken from the queue when a slot is free in this window and the
+        submit_sm_throughput allows it.
         """
-        msgid = None
+        window = self.getSubmitSmWindow()
+        yield window.acquire()
         try:
-            msgid = message.content.properties['message-id']
-            SubmitSmPDU = pickle.loads(message.content.body)
-
+            # QoS throttling
+            yield self.getSubmitSmPacer().consume()
+        finally:
             self.submit_sm_q.get().addCallback(self.submit_sm_callback).addErrback(self.submit_sm_errback)
 
-            self.log.debug("Callbacked a submit_sm with a SubmitSmPDU[%s] (?): %s", msgid, SubmitSmPDU)
+        try:
+            r = yield self.submit_sm(message)
+        finally:
+            window.release()
 
-            # Update submit_sm retrial tracker
-            if msgid in self.submit_retrials:
-                self.submit_retrials[msgid] += 1
-            else:
-                self.submit_retrials[msgid] = 1
-
-            if self.qos_last_submit_sm_at is None:
-                self.qos_last_submit_sm_at = datetime(1970, 1, 1)
-
-            if self.SMPPClientFactory.config.submit_sm_throughput > 0:
-                # QoS throttling
-                qos_throughput_second = 1 / float(self.SMPPClientFactory.config.submit_sm_throughput)
-                qos_throughput_ysecond_td = timedelta(microseconds=qos_throughput_second * 1000000)
-                qos_delay = datetime.now() - self.qos_last_submit_sm_at
-                if qos_delay < qos_throughput_ysecond_td:
-                    qos_slow_down = float((qos_throughput_ysecond_td - qos_delay).microseconds) / 1000000
-                    # We're faster than submit_sm_throughput,
-                    # slow down before taking a new message from the queue
-                    self.log.debug(
-                        "QoS: submit_sm_callback faster (%s) than throughput (%s), slowing down %ss (requeuing).",
-                        qos_delay, qos_throughput_ysecond_td, qos_slow_down)
+        defer.returnValue(r)
 
-                    # New QoS controller (>=0.10.13):
-                    # Will pause for a delay then allow handling the message normally
-                    # This will avoid impacting resources by requeuing on rabbitmq
-                    yield qos.slow_down(qos_slow_down)
+    @defer.inlineCallbacks
+    def submit_sm(self, message):
+        """Send a consumed message to the SMSC and wait for its submit_sm_resp"""
+        msgid = None
+        try:
+            msgid = message.content.properties['message-id']
+            SubmitSmPDU = decode_body(message.content)
 
-                self.qos_last_submit_sm_at = datetime.now()
+            self.log.debug("Callbacked a submit_sm with a SubmitSmPDU[%s] (?): %s", msgid, SubmitSmPDU)
 
             # Verify if message is a SubmitSm PDU
             if isinstance(SubmitSmPDU, SubmitSM) is False:
@@ -193,7 +191,7 @@ class SMPPClientSMListener:
                 if msgAge.seconds > self.config.submit_max_age_smppc_not_ready:
                     self.log.error(
                         "SMPPC [cid:%s] is not connected: Discarding (#%s) SubmitSmPDU[%s], over-aged %s seconds.",
-                        self.SMPPClientFactory.config.id, self.submit_retrials[msgid],
+                        self.SMPPClientFactory.config.id, self.getSubmitRetrials(message),
                         msgid, msgAge.seconds)
                     yield self.rejectMessage(message)
                     defer.returnValue(False)
@@ -204,7 +202,7 @@ class SMPPClientSMListener:
                         delay_str = ''
                     self.log.error(
                         "SMPPC [cid:%s] is not connected: Requeuing (#%s) SubmitSmPDU[%s]%s, aged %s seconds.",
-                        self.SMPPClientFactory.config.id, self.submit_retrials[msgid],
+                        self.SMPPClientFactory.config.id, self.getSubmitRetrials(message),
                         msgid, delay_str, msgAge.seconds)
                     yield self.rejectAndRequeueMessage(message,
                                                        delay=self.config.submit_retrial_delay_smppc_not_ready)
@@ -217,7 +215,7 @@ class SMPPClientSMListener:
                 if msgAge.seconds > self.config.submit_max_age_smppc_not_ready:
                     self.log.error(
                         "SMPPC [cid:%s] is not bound: Discarding (#%s) SubmitSmPDU[%s], over-aged %s seconds.",
-                        self.SMPPClientFactory.config.id, self.submit_retrials[msgid],
+                        self.SMPPClientFactory.config.id, self.getSubmitRetrials(message),
                         msgid, msgAge.seconds)
                     yield self.rejectMessage(message)
                     defer.returnValue(False)
@@ -227,7 +225,7 @@ class SMPPClientSMListener:
                     else:
                         delay_str = ''
                     self.log.error("SMPPC [cid:%s] is not bound: Requeuing (#%s) SubmitSmPDU[%s]%s, aged %s seconds.",
-                                   self.SMPPClientFactory.config.id, self.submit_retrials[msgid],
+                                   self.SMPPClientFactory.config.id, self.getSubmitRetrials(message),
                                    msgid, delay_str, msgAge)
                     yield self.rejectAndRequeueMessage(
                         message, delay=self.config.submit_retrial_delay_smppc_not_ready)
@@ -235,7 +233,7 @@ class SMPPClientSMListener:
 
             # Finally: send the sms !
             self.log.debug("Sending SubmitSmPDU[%s] through SMPPClientFactory [cid:%s] after %s requeues.",
-                           msgid, self.SMPPClientFactory.config.id, self.submit_retrials[msgid])
+                           msgid, self.SMPPClientFactory.config.id, self.getSubmitRetrials(message))
             d = self.SMPPClientFactory.smpp.sendDataRequest(SubmitSmPDU)
             d.addCallback(self.submit_sm_resp_event, message)
             yield d
@@ -270,9 +268,6 @@ class SMPPClientSMListener:
 
 
             if r.response.status == CommandStatus.ESME_ROK:
-                # No more retrials !
-                del self.submit_retrials[msgid]
-
                 # Get bill information
                 if submit_sm_resp_bill is not None and submit_sm_resp_bill.getTotalAmounts() > 0:
                     total_bill_amount = submit_sm_resp_bill.getTotalAmounts()
@@ -343,13 +338,10 @@ class SMPPClientSMListener:
                     retrial = self.config.submit_error_retrial[r.response.status.name]
 
                     # Still have some retries to go ?
-                    if self.submit_retrials[msgid] < retrial['count']:
+                    if self.getSubmitRetrials(amqpMessage) < retrial['count']:
                         # Requeue the message for later redelivery
                         yield self.rejectAndRequeueMessage(amqpMessage, delay=retrial['delay'])
                         will_be_retried = True
-                    else:
-                        # Prevent this list from over-growing
-                        del self.submit_retrials[msgid]
 
                 # Do not log text for privacy reasons
                 # Added in #691
@@ -377,9 +369,6 @@ class SMPPClientSMListener:
 
             # It is a final submit_sm_resp !
             if not will_be_retried:
-                # Cancel any mapped rejectTimer to this message
-                # (in case this message was rejected in the past)
-                self.clearRejectTimer(msgid)
                 self.log.debug("ACKing amqpMessage [%s] having routing_key [%s]",
                                msgid, amqpMessage.routing_key)
                 # ACK the message in queue, this will remove it from the queue
@@ -391,7 +380,9 @@ class SMPPClientSMListener:
                           smpp_msgid=r.response.params['message_id'])
             else:
                 dlr = DLR(pdu_type=r.response.id, msgid=msgid, status=r.response.status)
-            yield self.amqpBroker.publish(exchange='messaging', routing_key='dlr.submit_sm_resp', content=dlr)
+            yield self.amqpBroker.publish(exchange='messaging',
+                                          routing_key=dlr_routing_key('submit_sm_resp', dlr, self.config.dlr_shards),
+                                          content=dlr)
 
             # Bill will be charged by bill_request.submit_sm_resp.UID queue consumer
             if total_bill_amount > 0:
@@ -409,7 +400,8 @@ class SMPPClientSMListener:
                 # Send back submit_sm_resp to submit.sm.resp.CID queue
                 # There's no actual listeners on this queue, it can be used to
                 # track submit_sm_resp messages from a 3rd party app
-                content = SubmitSmRespContent(r.response, msgid, pickleProtocol=self.pickleProtocol)
+                content = SubmitSmRespContent(r.response, msgid, pickleProtocol=self.pickleProtocol,
+                                              encoding=self.pduEncoding)
                 self.log.debug("Sending back SubmitSmRespContent[%s] with routing_key[%s]",
                                msgid, amqpMessage.content.properties['reply-to'])
                 yield self.amqpBroker.publish(exchange='messaging',
@@ -626,7 +618,8 @@ class SMPPClientSMListener:
             content = DeliverSmContent(routable,
                                        self.SMPPClientFactory.config.id,
                                        pickleProtocol=self.pickleProtocol,
-                                       concatenated=concatenated)
+                                       concatenated=concatenated,
+                                       encoding=self.pduEncoding)
             msgid = content.properties['message-id']
 
             if routable.pdu.dlr is None:
@@ -738,13 +731,14 @@ class SMPPClientSMListener:
             else:
                 # This is a DLR !
                 # Send DLR to DLRLookup
+                dlr = DLR(pdu_type=routable.pdu.id,
+                          msgid=self.code_dlr_msgid(routable.pdu),
+                          status=routable.pdu.dlr['stat'],
+                          cid=self.SMPPClientFactory.config.id,
+                          dlr_details=routable.pdu.dlr)
                 yield self.amqpBroker.publish(exchange='messaging',
-                                              routing_key='dlr.deliver_sm',
-                                              content=DLR(pdu_type=routable.pdu.id,
-                                                          msgid=self.code_dlr_msgid(routable.pdu),
-                                                          status=routable.pdu.dlr['stat'],
-                                                          cid=self.SMPPClientFactory.config.id,
-                                                          dlr_details=routable.pdu.dlr))
+                                              routing_key=dlr_routing_key('deliver_sm', dlr, self.config.dlr_shards),
+                                              content=dlr)
         except (InterceptorRunError, DeliverSmInterceptionError) as e:
             # Do not log text for privacy reasons
             # Added in #691
@@ -0,0 +1,145 @@
+"""
+Compact wire format of PDUs published on AMQP
+
+PDU contents (c.f. jasmin.managers.content and jasmin.routing.content) may carry raw SMPP binary
+PDUs instead of pickled objects: the body holds a version byte, a length-prefixed json header map
+and the SMPP PDUs of the message (long messages are chained through nextPdu).
+The header map restores what the SMPP encoding cannot carry: mandatory parameters left to None,
+integer data_coding values, unset sequence numbers and, for routables, the source connector,
+date and tags.
+"""
+
+import json
+import struct
+from copy import copy
+from datetime import datetime
+from io import BytesIO
+
+from smpp.pdu.pdu_encoding import PDUEncoder
+from smpp.pdu.pdu_types import PDU, DataCoding, DataCodingScheme
+
+from jasmin.routing.Routables import RoutableDeliverSm
+from jasmin.routing.jasminApi import Connector
+
+VERSION = 1
+
+# AMQP content-type of bodies encoded with this module
+CONTENT_TYPE = 'application/x-jasmin-smpp'
+
+HEADER = struct.Struct('!BH')  # version, header map length
+PDU_LENGTH = struct.Struct('!L')
+
+encoder = PDUEncoder()
+
+
+def encode_pdu(pdu):
+    """Return the SMPP binary PDU, the bitmask of its mandatory params set to None and its int
+    data_coding (or None)"""
+    params = dict(pdu.params)
+    unset = 0
+    for i, name in enumerate(pdu.mandatoryParams):
+        if params.get(name) is None:
+            unset |= 1 << i
+
+    # data_coding is kept as an int until the SubmitSm is sent (c.f. SMPPClientProtocol.preSubmitSm)
+    data_coding = None
+    if isinstance(params.get('data_coding'), int):
+        data_coding = params['data_coding']
+        params['data_coding'] = DataCoding(DataCodingScheme.RAW, data_coding)
+
+    _pdu = copy(pdu)
+    _pdu.params = params
+    if pdu.seqNum is None:
+        _pdu.seqNum = 1
+
+    return encoder.encode(_pdu), unset, data_coding
+
+
+def encode(obj):
+    """Encode a PDU (with its nextPdu chain) or a RoutableDeliverSm
+
+    Raise ValueError if obj cannot be represented as SMPP binary PDUs
+    """
+    header = {}
+    if isinstance(obj, RoutableDeliverSm):
+        header['routable'] = {'connector': obj.connector.cid,
+                              'datetime': obj.datetime.isoformat(),
+                              'tags': obj.getTags()}
+        pdu = obj.pdu
+    elif isinstance(obj, PDU):
+        pdu = obj
+    else:
+        raise ValueError('Cannot encode %s' % type(obj))
+
+    data = []
+    unset = []
+    data_coding = []
+    unsequenced = []
+    try:
+        while pdu is not None:
+            if pdu.seqNum is None:
+                unsequenced.append(len(data))
+            pdu_data, pdu_unset, pdu_data_coding = encode_pdu(pdu)
+            data.append(pdu_data)
+            unset.append(pdu_unset)
+            data_coding.append(pdu_data_coding)
+            pdu = getattr(pdu, 'nextPdu', None)
+    except Exception as e:
+        raise ValueError('Cannot encode PDU: %s' % e)
+
+    if any(unset):
+        header['unset'] = unset
+    if any(dc is not None for dc in data_coding):
+        header['data_coding'] = data_coding
+    if len(unsequenced) > 0:
+        header['unsequenced'] = unsequenced
+
+    header = json.dumps(header, separators=(',', ':')).encode()
+    return HEADER.pack(VERSION, len(header)) + header + b''.join(data)
+
+
+def decode(blob):
+    """Decode a body encoded with encode(), return a PDU or a RoutableDeliverSm
+
+    Raise ValueError if blob is not a valid body
+    """
+    try:
+        version, header_length = HEADER.unpack_from(blob)
+        if version != VERSION:
+            raise ValueError('Unknown version: %s' % version)
+        offset = HEADER.size + header_length
+        header = json.loads(blob[HEADER.size:offset])
+
+        pdus = []
+        while offset < len(blob):
+            pdu_length, = PDU_LENGTH.unpack_from(blob, offset)
+            pdus.append(encoder.decode(BytesIO(blob[offset:offset + pdu_length])))
+            offset += pdu_length
+    except ValueError:
+        raise
+    except Exception as e:
+        raise ValueError('Invalid body: %s' % e)
+
+    if len(pdus) == 0:
+        raise ValueError('Invalid body: no PDU')
+
+    for i, pdu in enumerate(pdus):
+        if i in header.get('unsequenced', []):
+            pdu.seqNum = None
+        if 'unset' in header:
+            for j, name in enumerate(pdu.mandatoryParams):
+                if header['unset'][i] & (1 << j):
+                    pdu.params[name] = None
+        if header.get('data_coding', [None] * len(pdus))[i] is not None:
+            pdu.params['data_coding'] = header['data_coding'][i]
+        if i > 0:
+            pdus[i - 1].nextPdu = pdu
+
+    if 'routable' in header:
+        routable = RoutableDeliverSm(pdus[0], Connector(header['routable']['connector']),
+                                     datetime.fromisoformat(header['routable']['datetime']))
+        for tag in header['routable']['tags']:
+            routable.addTag(tag)
+        return routable
+
+    return pdus[0]
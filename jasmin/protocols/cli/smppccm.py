@@ -26,14 +26,15 @@ SMPPClientConfigKeyMap = {
     'def_msg_id': 'sm_default_msg_id', 'coding': 'data_coding', 'requeue_delay': 'requeue_delay',
     'submit_throughput': 'submit_sm_throughput', 'dlr_expiry': 'dlr_expiry', 'dlr_msgid': 'dlr_msg_id_bases',
     'con_fail_retry': 'reconnectOnConnectionFailure', 'dst_npi': 'dest_addr_npi',
-    'trx_to': 'inactivityTimerSecs', 'ssl': 'useSSL'}
+    'trx_to': 'inactivityTimerSecs', 'ssl': 'useSSL', 'submit_burst': 'submit_sm_burst',
+    'max_pending': 'max_pending_submits'}
 
 # Keys to be kept in string type, as requested in #64 and #105
 SMPPClientConfigStringKeys = [
     'host', 'systemType', 'username', 'password', 'addressRange', 'useSSL', 'source_addr']
 
 # When updating a key from RequireRestartKeys, the connector need restart for update to take effect
-RequireRestartKeys = ['host', 'port', 'username', 'password', 'systemType']
+RequireRestartKeys = ['host', 'port', 'username', 'password', 'systemType', 'max_pending_submits']
 
 
 def castOutputToBuiltInType(key, value):
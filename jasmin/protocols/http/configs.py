@@ -18,6 +18,9 @@ class HTTPApiConfig(ConfigFile):
 
         self.billing_feature = self._getbool('http-api', 'billing_feature', True)
 
+        # Maximum number of messages accepted in one /send/batch request
+        self.batch_max_messages = self._getint('http-api', 'batch_max_messages', 1000)
+
         # Logging
         self.access_log = self._get(
             'http-api', 'access_log', '%s/http-accesslog.log' % LOG_PATH)
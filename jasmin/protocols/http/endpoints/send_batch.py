@@ -0,0 +1,271 @@
+from datetime import datetime
+import re
+import json
+
+from twisted.internet import reactor, defer
+from twisted.web.server import NOT_DONE_YET
+
+from jasmin.protocols.http.errors import HttpApiError, UrlArgsValidationError, ChargingError
+from jasmin.protocols.http.validation import UrlArgsValidator
+from jasmin.protocols.http.endpoints import authenticate_user
+from jasmin.protocols.http.endpoints.send import (Send, send_fields, set_default_args, validate_content_args,
+                                                  get_short_message)
+
+# Batch messages are validated the same way /send arguments are, credentials are given
+# once for the whole batch
+batch_message_fields = {k: v for k, v in send_fields.items() if k not in [b'username', b'password']}
+
+
+class BatchMessage:
+    """Holds one batch message arguments the same way they are held in a twisted request"""
+
+    def __init__(self, message):
+        self.args = {}
+        for key, value in message.items():
+            # Make the values look like they came from form encoding all surrounded by [ ]
+            if isinstance(value, str):
+                value = value.encode()
+            elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                value = str(value).encode()
+            elif value is not None:
+                # Booleans, lists and objects cannot be given in a /send request
+                raise UrlArgsValidationError("Argument [%s] has an invalid value: [%s]." % (key, json.dumps(value)))
+
+            if isinstance(key, str):
+                key = key.encode()
+
+            self.args[key] = [value]
+
+
+class SendBatch(Send):
+    """/send/batch sends many messages in one request: user is authenticated once, charged
+    once for the whole batch and all SubmitSmPDUs are published in a single burst.
+
+    Throughput quota is applied per message: a batch of n valid messages is accepted if the user
+    may send now, its next request is then refused until n messages could have been sent.
+    """
+
+    def error_to_json(self, e):
+        return e.message.decode() if isinstance(e.message, bytes) else e.message
+
+    def charge_batch(self, user, submissions):
+        """Charge user for all submissions at once, raise a ChargingError and charge nothing if
+        user cannot pay for the whole batch"""
+        if not self.config.billing_feature:
+            for submission in submissions:
+                submission['bill'] = None
+            return
+
+        total_amounts = 0
+        total_submit_sm_count = 0
+        for submission in submissions:
+            bill = submission['route'].getBillFor(user)
+            submission['bill'] = bill
+            total_amounts += bill.getTotalAmounts() * submission['submit_sm_count']
+            total_submit_sm_count += bill.getAction('decrement_submit_sm_count') * submission['submit_sm_count']
+        self.log.debug("SubmitSmBills generated for a batch of %s SubmitSmPDUs [ttlamounts:%s] [submit_sm_count:%s]",
+                       len(submissions), total_amounts, total_submit_sm_count)
+
+        u_balance = user.mt_credential.getQuota('balance')
+        u_subsm_count = user.mt_credential.getQuota('submit_sm_count')
+        if u_balance is not None and total_amounts > u_balance:
+            self.stats.inc('charging_error_count')
+            self.log.error('Charging user %s failed, not enough balance (%s) for charging batch: %s',
+                           user, u_balance, total_amounts)
+            raise ChargingError('Cannot charge submit_sm, check RouterPB log file for details')
+        if u_subsm_count is not None and total_submit_sm_count > u_subsm_count:
+            self.stats.inc('charging_error_count')
+            self.log.error('Charging user %s failed, not enough submit_sm_count (%s) for charging batch: %s',
+                           user, u_subsm_count, total_submit_sm_count)
+            raise ChargingError('Cannot charge submit_sm, check RouterPB log file for details')
+
+        # User can pay for the whole batch, the below charging will not fail
+        for submission in submissions:
+            self.RouterPB.chargeUserForSubmitSms(user, submission['bill'], submission['submit_sm_count'])
+
+    @defer.inlineCallbacks
+    def route_batch(self, request, username, password, messages):
+        results = [None] * len(messages)
+        try:
+            # Authentication
+            user = authenticate_user(username, password, self.RouterPB, self.stats, self.log)
+
+            # Update CnxStatus
+            user.getCnxStatus().httpapi['connects_count'] += 1
+            user.getCnxStatus().httpapi['submit_sm_request_count'] += len(messages)
+            user.getCnxStatus().httpapi['last_activity_at'] = datetime.now()
+
+            # Validate and route every message, failing messages are reported and not sent
+            submissions = []
+            for i, message in enumerate(messages):
+                try:
+                    batch_message = BatchMessage(message)
+                    set_default_args(batch_message.args)
+                    UrlArgsValidator(batch_message, batch_message_fields).validate()
+                    validate_content_args(batch_message.args)
+
+                    short_message = get_short_message(batch_message.args)
+                    submission = yield self.prepare_submit_sm(user, batch_message, short_message)
+                    submission['index'] = i
+                    submission['short_message'] = short_message
+                    submission['to'] = batch_message.args[b'to'][0]
+                    submissions.append(submission)
+                except HttpApiError as e:
+                    self.log.error("Error in batch message #%s: %s", i, e)
+                    results[i] = {'status': e.code, 'return': self.error_to_json(e)}
+                except Exception as e:
+                    self.log.error("Error in batch message #%s: %s", i, e)
+                    results[i] = {'status': 500, 'return': "Unknown error: %s" % e}
+
+            # QoS throttling, the batch takes the delay of all its valid messages
+            if len(submissions) > 0:
+                self.throttle(user, len(submissions))
+
+            # Pre-sending submit_sm: Billing processing
+            self.charge_batch(user, submissions)
+
+            # Send all SubmitSmPDUs through smpp client manager PB server without waiting for
+            # each publish to complete
+            deferreds = []
+            for submission in submissions:
+                self.log.debug("Connector '%s' is set to be a route for this SubmitSmPDU",
+                               submission['connector'].cid)
+                deferreds.append(self.SMPPClientManagerPB.perspective_submit_sm(
+                    uid=user.uid,
+                    cid=submission['connector'].cid,
+                    SubmitSmPDU=submission['routable'].pdu,
+                    submit_sm_bill=submission['bill'],
+                    priority=submission['priority'],
+                    pickled=False,
+                    dlr_url=submission['dlr_url'],
+                    dlr_level=submission['dlr_level'],
+                    dlr_method=submission['dlr_method'],
+                    dlr_connector=submission['connector'].cid))
+            sent = yield defer.DeferredList(deferreds, consumeErrors=True)
+
+            for submission, (success, msgid) in zip(submissions, sent):
+                if not success or not msgid:
+                    self.stats.inc('server_error_count')
+                    self.log.error('Failed to send SubmitSmPDU to [cid:%s]', submission['connector'].cid)
+                    results[submission['index']] = {
+                        'status': 500,
+                        'return': 'Cannot send submit_sm, check SMPPClientManagerPB log file for details'}
+                    continue
+
+                self.stats.inc('success_count')
+                self.stats.set('last_success_at', datetime.now())
+                results[submission['index']] = {'status': 200, 'return': msgid}
+
+                # Do not log text for privacy reasons
+                if self.config.log_privacy:
+                    logged_content = '** %s byte content **' % len(submission['short_message'])
+                else:
+                    short_message = submission['short_message']
+                    if isinstance(short_message, str):
+                        short_message = short_message.encode()
+                    logged_content = '%r' % re.sub(rb'[^\x20-\x7E]+', b'.', short_message)
+
+                self.log.info(
+                    'SMS-MT [uid:%s] [cid:%s] [msgid:%s] [prio:%s] [dlr:%s] [from:%s] [to:%s] [content:%s]',
+                    user.uid,
+                    submission['connector'].cid,
+                    msgid,
+                    submission['priority'],
+                    submission['dlr_level_text'],
+                    submission['routable'].pdu.params['source_addr'],
+                    submission['to'],
+                    logged_content)
+
+            response = {'return': results, 'status': 200}
+        except HttpApiError as e:
+            self.log.error("Error: %s", e)
+            response = {'return': self.error_to_json(e), 'status': e.code}
+        except Exception as e:
+            self.log.error("Error: %s", e)
+            response = {'return': "Unknown error: %s" % e, 'status': 500}
+        finally:
+            self.log.debug("Returning %s to %s.", response, request.getClientIP())
+            request.setResponseCode(response['status'])
+            request.write(json.dumps(response['return']).encode())
+            request.finish()
+
+    def render_POST(self, request):
+        """
+        /send/batch request processing
+
+        Expects a json object with username, password and a list of messages, each message
+        is holding the same arguments as a /send request, except credentials; an optional
+        globals object will provide default arguments to all messages.
+        """
+
+        self.log.debug("Rendering /send/batch response from %s", request.getClientIP())
+        request.responseHeaders.addRawHeader(b"content-type", b"application/json")
+
+        self.stats.inc('request_count')
+        self.stats.set('last_request_at', datetime.now())
+
+        try:
+            # Media type parameters (charset ...) are ignored, json is always utf-8
+            content_type = request.getHeader(b'content-type') or b''
+            if content_type.split(b';')[0].strip().lower() != b'application/json':
+                raise UrlArgsValidationError("Batch must be posted with application/json content-type.")
+
+            try:
+                batch = json.loads(request.content.read())
+            except ValueError as e:
+                raise UrlArgsValidationError("Cannot parse json content.") from e
+
+            if not isinstance(batch, dict):
+                raise UrlArgsValidationError("Batch must be a json object.")
+            if not isinstance(batch.get('messages'), list) or len(batch['messages']) == 0:
+                raise UrlArgsValidationError("Batch must have a non empty list of messages.")
+            if len(batch['messages']) > self.config.batch_max_messages:
+                raise UrlArgsValidationError("Batch cannot have more than %s messages." %
+                                             self.config.batch_max_messages)
+            _globals = batch.get('globals', {})
+            if not isinstance(_globals, dict):
+                raise UrlArgsValidationError("Batch globals must be a json object.")
+
+            messages = []
+            for message in batch['messages']:
+                if not isinstance(message, dict):
+                    raise UrlArgsValidationError("Batch messages must be json objects.")
+                _message = dict(_globals)
+                _message.update(message)
+                messages.append(_message)
+
+            # Validate credentials syntax
+            credentials = BatchMessage({'username': batch.get('username'), 'password': batch.get('password')})
+            for field in [b'username', b'password']:
+                if credentials.args[field][0] is None:
+                    raise UrlArgsValidationError("Mandatory argument [%s] is not found." % field.decode())
+                if send_fields[field]['pattern'].match(credentials.args[field][0]) is None:
+                    raise UrlArgsValidationError("Argument [%s] has an invalid value." % field.decode())
+
+            # Continue routing in a separate thread
+            reactor.callFromThread(self.route_batch, request=request,
+                                   username=credentials.args[b'username'][0],
+                                   password=credentials.args[b'password'][0],
+                                   messages=messages)
+        except HttpApiError as e:
+            self.log.error("Error: %s", e)
+            response = {'return': self.error_to_json(e), 'status': e.code}
+
+            self.log.debug("Returning %s to %s.", response, request.getClientIP())
+            request.setResponseCode(response['status'])
+
+            return json.dumps(response['return']).encode()
+        except Exception as e:
+            self.log.error("Error: %s", e)
+            response = {'return': "Unknown error: %s" % e, 'status': 500}
+
+            self.log.debug("Returning %s to %s.", response, request.getClientIP())
+            request.setResponseCode(response['status'])
+
+            return json.dumps(response['return']).encode()
+
+        return NOT_DONE_YET
+
+    def render_GET(self, request):
+        request.setResponseCode(405)
+        return json.dumps('Batch must be posted').encode()
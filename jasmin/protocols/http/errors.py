@@ -67,6 +67,13 @@ class ThroughputExceededError(HttpApiError):
         HttpApiError.__init__(self, 403, message)
 
 
+class BacklogExceededError(HttpApiError):
+    """Raised when routed connectors backlog would take too long to drain"""
+
+    def __init__(self, message=None):
+        HttpApiError.__init__(self, 429, message)
+
+
 class InterceptorNotSetError(HttpApiError):
     """Raised when message is about to be intercepted and no interceptorpb_client were set"""
 
@@ -7,6 +7,7 @@ from twisted.web.resource import Resource
 
 import jasmin
 from jasmin.protocols.http.endpoints.send import Send
+from jasmin.protocols.http.endpoints.send_batch import SendBatch
 from jasmin.protocols.http.endpoints.rate import Rate
 from jasmin.protocols.http.endpoints.ping import Ping
 from jasmin.protocols.http.endpoints.balance import Balance
@@ -41,7 +42,10 @@ class HTTPApi(Resource):
         self.log = log
         # Set http url routings
         log.debug("Setting http url routing for /send")
-        self.putChild(b'send', Send(config, RouterPB, SMPPClientManagerPB, stats, log, interceptor))
+        send = Send(config, RouterPB, SMPPClientManagerPB, stats, log, interceptor)
+        self.putChild(b'send', send)
+        log.debug("Setting http url routing for /send/batch")
+        send.putChild(b'batch', SendBatch(config, RouterPB, SMPPClientManagerPB, stats, log, interceptor))
         log.debug("Setting http url routing for /rate")
         self.putChild(b'rate', Rate(config, RouterPB, stats, log, interceptor))
         log.debug("Setting http url routing for /balance")
@@ -4,8 +4,9 @@ import json
 import os
 import sys
 
-from .api import PingResource, BalanceResource, RateResource, SendResource, SendBatchResource
+from .api import PingResource, BalanceResource, RateResource, SendResource, SendBatchResource, BatchStatusResource
 from .config import *
+from .store import BatchStore
 
 sys.path.append("%s/vendor" % os.path.dirname(os.path.abspath(jasmin.__file__)))
 from falcon import HTTPUnauthorized, HTTPUnsupportedMediaType, API
@@ -39,6 +40,9 @@ class JsonResponserMiddleware:
         if show_jasmin_version:
             response.set_header('Powered-By', 'Jasmin %s' % jasmin.get_release())
 
+    async def process_response_async(self, request, response, resource, req_succeeded):
+        self.process_response(request, response, resource, req_succeeded)
+
 
 class LoggingMiddleware:
     """Logging api calls"""
@@ -53,6 +57,9 @@ class LoggingMiddleware:
                 response.status[:3], request.context.get('username', '*'), request.remote_addr,
                 request.method, request.relative_uri))
 
+    async def process_response_async(self, request, response, resource, req_succeeded):
+        self.process_response(request, response, resource, req_succeeded)
+
 
 class ContentTypeFilter:
     """Enforces client uses json media type"""
@@ -64,6 +71,9 @@ class ContentTypeFilter:
                 'This API supports JSON media type only.',
                 href='http://docs.jasminsms.com/en/latest/apis/rest/index.html')
 
+    async def process_request_async(self, request, response):
+        self.process_request(request, response)
+
 
 class AuthenticationFilter:
     """Extract username/password from Auth token and make it accessible from context"""
@@ -103,6 +113,9 @@ class AuthenticationFilter:
 
             self._token_decode(request, token)
 
+    async def process_request_async(self, request, response):
+        self.process_request(request, response)
+
 
 # Start the falcon API with some fancy logging
 logger.info('Starting Jasmin Rest API ...')
@@ -122,6 +135,10 @@ api.add_route('/secure/rate', RateResource())
 logger.info('\t[OK] /secure/rate')
 api.add_route('/secure/send', SendResource())
 logger.info('\t[OK] /secure/send')
-api.add_route('/secure/sendbatch', SendBatchResource())
+# Batch descriptors and progression are kept in redis through a single connection pool
+batch_store = BatchStore()
+api.add_route('/secure/sendbatch', SendBatchResource(batch_store))
 logger.info('\t[OK] /secure/sendbatch')
+api.add_route('/secure/batch/{batch_id}', BatchStatusResource(batch_store))
+logger.info('\t[OK] /secure/batch/{batchId}')
 logger.info('API Started.')
@@ -1,3 +1,4 @@
+import hashlib
 import json
 import os
 import sys
@@ -6,10 +7,13 @@ import re
 import requests
 
 import jasmin
+from jasmin.tools.cache import LRUCache
 from .config import *
-from .tasks import httpapi_send
+from .store import BatchStore
+from .tasks import httpapi_send_slice
+from celery import group
 from datetime import datetime
-from falcon import HTTPInternalServerError, HTTPPreconditionFailed
+from falcon import HTTPInternalServerError, HTTPPreconditionFailed, HTTPNotFound
 import falcon
 
 sys.path.append("%s/vendor" % os.path.dirname(os.path.abspath(jasmin.__file__)))
@@ -18,6 +22,29 @@ sys.path.append("%s/vendor" % os.path.dirname(os.path.abspath(jasmin.__file__)))
 class JasminHttpApiProxy:
     """Provides a WS caller for old Jasmin http api"""
 
+    # Successful authentications are cached and shared by all resources
+    auth_cache = LRUCache(auth_cache_max_keys, ttl=auth_cache_seconds)
+
+    def authenticate(self, username, password):
+        """Authenticate user through Jasmin http api, return True if credentials are valid
+
+        Valid credentials are cached for auth_cache_seconds to avoid calling Jasmin http api on
+        every request.
+        """
+        key = self.auth_cache_key(username, password)
+        if self.auth_cache.get(key) is not None:
+            return True
+
+        status, _ = self.call_jasmin('balance', params={'username': username, 'password': password})
+        if status != 200:
+            return False
+
+        self.auth_cache.set(key, True)
+        return True
+
+    def auth_cache_key(self, username, password):
+        return username, hashlib.sha256(('%s' % password).encode()).hexdigest()
+
     def call_jasmin(self, url, params=None):
         try:
             r = requests.get('%s/%s' % (old_api_uri, url), params=params)
@@ -59,6 +86,13 @@ class JasminRestApi:
         else:
             return params
 
+    def convert_keys(self, params):
+        """Convert _ to - in parameter names
+
+        Added for compliance with json encoding/decoding constraints on dev env like .Net
+        """
+        return {re.sub('_', '-', k): v for k, v in params.items()}
+
 
 class PingResource(JasminRestApi, JasminHttpApiProxy):
     def on_get(self, request, response):
@@ -155,6 +189,9 @@ class SendResource(JasminRestApi, JasminHttpApiProxy):
 
 
 class SendBatchResource(JasminRestApi, JasminHttpApiProxy):
+    def __init__(self, batch_store=None):
+        self.batch_store = batch_store or BatchStore()
+
     def parse_schedule_at(self, val):
         """
         Tries to parse the schedule_at parameter and get the datetime value for scheduling
@@ -193,67 +230,102 @@ class SendBatchResource(JasminRestApi, JasminHttpApiProxy):
         """
 
         # Authentify user before proceeding
-        status, _ = self.call_jasmin('balance', params={
-            'username': request.context.get('username'),
-            'password': request.context.get('password')
-        })
-        if status != 200:
+        if not self.authenticate(request.context.get('username'), request.context.get('password')):
             raise HTTPPreconditionFailed('Authentication failed',
                                          "Authentication failed for user: %s" % request.context.get('username'))
 
+        response.body = {
+            'data': self.push_batch(request.context.get('username'), request.context.get('password'),
+                                    self.decode_request_data(request))
+        }
+
+    def push_batch(self, username, password, params):
+        """Store batch and push its slices to workers, return the batch summary"""
         batch_id = uuid.uuid4()
-        params = self.decode_request_data(request)
-        config = {'throughput': http_throughput_per_worker, 'smart_qos': smart_qos}
+        config = {'throughput': http_throughput_per_worker, 'smart_qos': smart_qos,
+                  'global_throughput': global_throughput, 'user_throughput': user_throughput}
+        if global_throughput > 0 or user_throughput > 0:
+            # Cluster-wide throughput control replaces per worker control
+            config['throughput'] = 0
+            config['smart_qos'] = False
 
         # Batch scheduling
         countdown = self.parse_schedule_at(params.get('batch_config', {}).get('schedule_at', None))
 
-        message_count = 0
+        # Batch descriptor is stored once, workers will only get slices of [message index, to]
+        batch = {
+            'credentials': {'username': username, 'password': password},
+            'globals': self.convert_keys(params.get('globals', {})),
+            'batch_config': params.get('batch_config', {}),
+            'messages': [],
+        }
+        recipients = []
         for _message_params in params.get('messages', {}):
-            # Construct message params
-            message_params = {'username': request.context.get('username'),
-                              'password': request.context.get('password')}
-            message_params.update(params.get('globals', {}))
-            message_params.update(_message_params)
-
-            # Convert _ to -
-            # Added for compliance with json encoding/decoding constraints on dev env like .Net
-            _message_params = message_params.copy() # Avoid dictionary key changed error in python 3.8
-            for k, v in _message_params.items():
-                del (message_params[k])
-                message_params[re.sub('_', '-', k)] = v
-
-            del _message_params # Unset the variable
+            message_params = self.convert_keys(_message_params)
 
             # Ignore message if these args are not found
-            if 'to' not in message_params or ('content' not in message_params and 'hex-content' not in message_params):
+            _params = dict(batch['globals'])
+            _params.update(message_params)
+            if 'to' not in _params or ('content' not in _params and 'hex-content' not in _params):
                 continue
 
             # Do we have multiple destinations for this message ?
-            if isinstance(message_params.get('to', ''), list):
-                to_list = message_params.get('to')
-                for _to in to_list:
-                    message_params['to'] = _to
-                    if countdown == 0:
-                        httpapi_send.delay(batch_id, params.get('batch_config', {}), message_params, config)
-                    else:
-                        httpapi_send.apply_async(
-                            args=[batch_id, params.get('batch_config', {}), message_params, config],
-                            countdown=countdown)
-                    message_count += 1
+            to_list = _params['to'] if isinstance(_params['to'], list) else [_params['to']]
+            message_params.pop('to', None)
+            batch['messages'].append(message_params)
+            for _to in to_list:
+                recipients.append([len(batch['messages']) - 1, _to])
+
+        message_count = len(recipients)
+        slices = [recipients[i:i + batch_slice_size] for i in range(0, message_count, batch_slice_size)]
+        if message_count > 0:
+            self.batch_store.set_batch(batch_id, batch, countdown)
+            self.batch_store.init_progress(
+                batch_id, username, message_count, countdown,
+                float(batch['batch_config'].get('callback_interval', batch_callback_interval))
+                if batch['batch_config'].get('callback_mode', 'message') == 'aggregated' else 0)
+
+            # Publish all slices at once
+            job = group(httpapi_send_slice.s('%s' % batch_id, _slice, config) for _slice in slices)
+            if countdown == 0:
+                job.apply_async()
             else:
-                if countdown == 0:
-                    httpapi_send.delay(batch_id, params.get('batch_config', {}), message_params, config)
-                else:
-                    httpapi_send.apply_async(
-                        args=[batch_id, params.get('batch_config', {}), message_params, config], countdown=countdown)
-                message_count += 1
+                job.apply_async(countdown=countdown)
 
-        response.body = {
-            'data': {
-                "batchId": '%s' % batch_id,
-                "messageCount": message_count
-            }
+        data = {
+            "batchId": '%s' % batch_id,
+            "messageCount": message_count,
+            "sliceCount": len(slices)
         }
         if countdown > 0:
-            response.body['data']['scheduled'] = '%ss' % countdown
+            data['scheduled'] = '%ss' % countdown
+
+        return data
+
+
+class BatchStatusResource(JasminRestApi, JasminHttpApiProxy):
+    def __init__(self, batch_store=None):
+        self.batch_store = batch_store or BatchStore()
+
+    def on_get(self, request, response, batch_id):
+        """
+        GET /secure/batch/{batchId} request processing
+
+        Note: Returns batch progression (sent, failed and pending messages) with its last failures
+        """
+
+        # Authentify user before proceeding
+        if not self.authenticate(request.context.get('username'), request.context.get('password')):
+            raise HTTPPreconditionFailed('Authentication failed',
+                                         "Authentication failed for user: %s" % request.context.get('username'))
+
+        response.body = {'data': self.get_progress(request.context.get('username'), batch_id)}
+
+    def get_progress(self, username, batch_id):
+        """Return batch progression if it belongs to username"""
+        progress = self.batch_store.get_progress(batch_id)
+        if progress is None or progress.pop('username') != username:
+            raise HTTPNotFound('Batch not found', 'Batch %s is not found (or expired)' % batch_id)
+
+        progress['batchId'] = batch_id
+        return progress
@@ -0,0 +1,215 @@
+"""Asynchronous (ASGI) variant of jasmin-restapi, calls to Jasmin's http api are made through a pooled
+asynchronous http client, it can be served by any ASGI server:
+
+    uvicorn jasmin.protocols.rest.asgi:app
+"""
+
+import asyncio
+import functools
+import json
+
+import httpx
+from falcon import HTTPInternalServerError, HTTPPreconditionFailed
+import falcon.asgi
+
+from . import ContentTypeFilter, AuthenticationFilter, JsonResponserMiddleware, LoggingMiddleware, logger
+from .api import (JasminRestApi, JasminHttpApiProxy, SendBatchResource as SyncSendBatchResource,
+                  BatchStatusResource as SyncBatchStatusResource)
+from .config import *
+from .store import BatchStore
+
+
+class AsyncJasminHttpApiProxy(JasminHttpApiProxy):
+    """Provides an asynchronous WS caller for old Jasmin http api"""
+
+    # Connections are pooled and kept alive, the client is shared by all resources
+    client = None
+
+    @classmethod
+    def get_client(cls):
+        if cls.client is None:
+            cls.client = httpx.AsyncClient(
+                timeout=http_request_timeout,
+                limits=httpx.Limits(max_connections=async_http_max_connections,
+                                    max_keepalive_connections=async_http_max_keepalive_connections))
+
+        return cls.client
+
+    @classmethod
+    async def close_client(cls):
+        if cls.client is not None:
+            await cls.client.aclose()
+            cls.client = None
+
+    async def call_jasmin(self, url, params=None):
+        try:
+            r = await self.get_client().get('%s/%s' % (old_api_uri, url), params=params)
+        except httpx.ConnectError as e:
+            raise HTTPInternalServerError('Jasmin httpapi connection error',
+                                          'Could not connect to Jasmin http api (%s): %s' % (old_api_uri, e))
+        except Exception as e:
+            raise HTTPInternalServerError('Jasmin httpapi unknown error', str(e))
+        else:
+            return r.status_code, r.content.decode('utf-8').strip('"')
+
+    async def authenticate(self, username, password):
+        """Same as JasminHttpApiProxy.authenticate, sharing the same cache"""
+        key = self.auth_cache_key(username, password)
+        if self.auth_cache.get(key) is not None:
+            return True
+
+        status, _ = await self.call_jasmin('balance', params={'username': username, 'password': password})
+        if status != 200:
+            return False
+
+        self.auth_cache.set(key, True)
+        return True
+
+
+class AsyncJasminRestApi(JasminRestApi):
+    """Parent class for all asynchronous rest api resources"""
+
+    async def decode_request_data(self, request):
+        """Decode the request stream and return a valid json"""
+
+        request_data = await request.stream.read()
+        try:
+            params = json.loads(request_data)
+        except Exception as e:
+            raise HTTPPreconditionFailed('Cannot parse JSON data',
+                                         'Got unparseable json data: %s' % request_data)
+        else:
+            return params
+
+    async def run_blocking(self, func, *args):
+        """Run blocking calls (celery, redis) in the default executor"""
+        return await asyncio.get_running_loop().run_in_executor(None, functools.partial(func, *args))
+
+    def credentials(self, request):
+        return {'username': request.context.get('username'), 'password': request.context.get('password')}
+
+
+class PingResource(AsyncJasminRestApi, AsyncJasminHttpApiProxy):
+    async def on_get(self, request, response):
+        """
+        GET /ping request processing
+
+        Note: Ping is used to check Jasmin's http api
+        """
+
+        self.build_response_from_proxy_result(response, await self.call_jasmin('ping'))
+
+
+class BalanceResource(AsyncJasminRestApi, AsyncJasminHttpApiProxy):
+    async def on_get(self, request, response):
+        """
+        GET /secure/balance request processing
+
+        Note: Balance is used by user to check his balance
+        """
+
+        self.build_response_from_proxy_result(
+            response, await self.call_jasmin('balance', params=self.credentials(request)))
+
+
+class RateResource(AsyncJasminRestApi, AsyncJasminHttpApiProxy):
+    async def on_get(self, request, response):
+        """
+        GET /secure/rate request processing
+
+        Note: This method will indicate the rate of the message once sent
+        """
+
+        request_args = request.params.copy()
+        request_args.update(self.credentials(request))
+
+        self.build_response_from_proxy_result(
+            response, await self.call_jasmin('rate', params=self.convert_keys(request_args)))
+
+
+class SendResource(AsyncJasminRestApi, AsyncJasminHttpApiProxy):
+    async def on_post(self, request, response):
+        """
+        POST /secure/send request processing
+
+        Note: Calls Jasmin http api /send resource
+        """
+
+        request_args = (await self.decode_request_data(request)).copy()
+        request_args.update(self.credentials(request))
+
+        self.build_response_from_proxy_result(
+            response, await self.call_jasmin('send', params=self.convert_keys(request_args)))
+
+
+class SendBatchResource(AsyncJasminRestApi, AsyncJasminHttpApiProxy, SyncSendBatchResource):
+    async def on_post(self, request, response):
+        """
+        POST /secure/sendbatch request processing
+
+        Note: Calls Jasmin http api /send resource
+        """
+
+        # Authentify user before proceeding
+        if not await self.authenticate(request.context.get('username'), request.context.get('password')):
+            raise HTTPPreconditionFailed('Authentication failed',
+                                         "Authentication failed for user: %s" % request.context.get('username'))
+
+        params = await self.decode_request_data(request)
+        response.body = {
+            'data': await self.run_blocking(
+                self.push_batch, request.context.get('username'), request.context.get('password'), params)
+        }
+
+
+class BatchStatusResource(AsyncJasminRestApi, AsyncJasminHttpApiProxy, SyncBatchStatusResource):
+    async def on_get(self, request, response, batch_id):
+        """
+        GET /secure/batch/{batchId} request processing
+
+        Note: Returns batch progression (sent, failed and pending messages) with its last failures
+        """
+
+        # Authentify user before proceeding
+        if not await self.authenticate(request.context.get('username'), request.context.get('password')):
+            raise HTTPPreconditionFailed('Authentication failed',
+                                         "Authentication failed for user: %s" % request.context.get('username'))
+
+        response.body = {
+            'data': await self.run_blocking(self.get_progress, request.context.get('username'), batch_id)
+        }
+
+
+class HttpClientMiddleware:
+    """Closes the pooled http client when the ASGI server shuts down"""
+
+    async def process_shutdown(self, scope, event):
+        await AsyncJasminHttpApiProxy.close_client()
+
+
+# Start the falcon ASGI app with the same middleware chain than the WSGI api
+logger.info('Starting Jasmin Rest API (ASGI) ...')
+app = falcon.asgi.App(
+    middleware=[
+        ContentTypeFilter(),
+        AuthenticationFilter(),
+        JsonResponserMiddleware(),
+        LoggingMiddleware(),
+        HttpClientMiddleware()
+    ]
+)
+app.add_route('/ping', PingResource())
+logger.info('\t[OK] /ping')
+app.add_route('/secure/balance', BalanceResource())
+logger.info('\t[OK] /secure/balance')
+app.add_route('/secure/rate', RateResource())
+logger.info('\t[OK] /secure/rate')
+app.add_route('/secure/send', SendResource())
+logger.info('\t[OK] /secure/send')
+# Batch descriptors and progression are kept in redis through a single connection pool
+batch_store = BatchStore()
+app.add_route('/secure/sendbatch', SendBatchResource(batch_store))
+logger.info('\t[OK] /secure/sendbatch')
+app.add_route('/secure/batch/{batch_id}', BatchStatusResource(batch_store))
+logger.info('\t[OK] /secure/batch/{batchId}')
+logger.info('API Started.')
@@ -7,8 +7,12 @@ import os
 # RESTAPI
 old_api_uri = 'http://127.0.0.1:1401'
 show_jasmin_version = True
+# Successful authentications are cached for auth_cache_seconds (up to auth_cache_max_keys users)
 auth_cache_seconds = 10
 auth_cache_max_keys = 500
+# Asynchronous (ASGI) api connection pool toward Jasmin's http api
+async_http_max_connections = 100
+async_http_max_keepalive_connections = 20
 
 log_level = logging.getLevelName('INFO')
 log_file = '%s/restapi.log' % LOG_PATH
@@ -32,3 +36,37 @@ http_throughput_per_worker = 16
 # control the batch throughput, slower response time will slow down the throughput
 # and vice-versa
 smart_qos = False
+# Cluster-wide throughput (messages per second) shared by all workers, globally and per user,
+# set to zero (0) to disable, when enabled the above per worker throughput control is disabled.
+# Buckets are kept in redis (throughput_limiter = 'redis') or in every worker ('local')
+global_throughput = 0
+user_throughput = 0
+throughput_burst_seconds = 1
+throughput_limiter = 'redis'
+throughput_limiter_url = 'redis://:@127.0.0.1:6379/2'
+# Connections to Jasmin's http api (and callback urls) are kept alive and pooled per worker
+# process, pool_maxsize is the maximum number of connections kept per host
+http_pool_connections = 10
+http_pool_maxsize = 10
+# Timeout (seconds) for http calls made by workers
+http_request_timeout = 30
+# When set to True, every batch slice is sent to Jasmin's http api in one single /send/batch
+# call instead of one /send call per message, per worker QoS control is not applied in this mode
+httpapi_batch_mode = False
+# Batches are pushed to workers in slices of up to batch_slice_size messages, every
+# slice is sent through one pooled connection by one worker
+batch_slice_size = 100
+# Batch descriptors (globals, batch_config and messages) are stored once per batch in redis,
+# they expire batch_store_expiry seconds after the batch scheduled time
+batch_store_url = 'redis://:@127.0.0.1:6379/2'
+batch_store_expiry = 86400
+# Maximum number of failures kept for every batch (c.f. /secure/batch/{batchId})
+batch_failures_max = 1000
+# When batch_config's callback_mode is 'aggregated', one summary is posted to callback_url
+# every batch_callback_every messages and/or every batch_callback_interval seconds (0 to
+# disable), both can be overridden in batch_config (callback_every, callback_interval)
+batch_callback_every = 1000
+batch_callback_interval = 0
+# Workers cache batch descriptors for batch_cache_seconds
+batch_cache_seconds = 60
+batch_cache_max_keys = 100
@@ -0,0 +1,105 @@
+import json
+
+import redis
+
+from .config import *
+
+
+class BatchStore:
+    """Keeps sendbatch descriptors (credentials, globals, batch_config and messages) in redis, they are
+    stored once per batch and fetched by workers when sending batch slices, then deleted once every
+    message of the batch is processed
+
+    Batch progression is kept in a redis hash (sent/failed/pending counters) and a list of the
+    last batch_failures_max failures.
+    """
+
+    def __init__(self, url=None, expiry=None):
+        self.url = url or batch_store_url
+        self.expiry = expiry or batch_store_expiry
+        self._redis = None
+
+    @property
+    def redis(self):
+        # Connect lazily: the store is instanciated before celery forks its workers
+        if self._redis is None:
+            self._redis = redis.Redis.from_url(self.url)
+
+        return self._redis
+
+    def key(self, batch_id):
+        return 'batch:%s' % batch_id
+
+    def progress_key(self, batch_id):
+        return 'batch:%s:progress' % batch_id
+
+    def failures_key(self, batch_id):
+        return 'batch:%s:failures' % batch_id
+
+    def callback_slot_key(self, batch_id):
+        return 'batch:%s:callback-slot' % batch_id
+
+    def set_batch(self, batch_id, batch, countdown=0):
+        """Store batch descriptor, it will expire batch_store_expiry seconds after its scheduled time"""
+        self.redis.set(self.key(batch_id), json.dumps(batch), ex=int(self.expiry + countdown))
+
+    def get_batch(self, batch_id):
+        """Return batch descriptor or None if not found (or expired)"""
+        batch = self.redis.get(self.key(batch_id))
+        if batch is None:
+            return None
+
+        return json.loads(batch)
+
+    def init_progress(self, batch_id, username, message_count, countdown=0, callback_interval=0):
+        """Initiate batch progression counters, all messages are pending"""
+        pipe = self.redis.pipeline()
+        pipe.hset(self.progress_key(batch_id), mapping={
+            'username': username,
+            'messageCount': message_count,
+            'sent': 0,
+            'failed': 0,
+            'pending': message_count,
+        })
+        pipe.expire(self.progress_key(batch_id), int(self.expiry + countdown))
+        if callback_interval > 0:
+            # First aggregated callback is due after callback_interval seconds
+            pipe.set(self.callback_slot_key(batch_id), 1, px=int((countdown + callback_interval) * 1000))
+        pipe.execute()
+
+    def mark_message(self, batch_id, to, status, status_text):
+        """Count a processed message as sent (status=1) or failed (status=0) and return the updated
+        counters"""
+        pipe = self.redis.pipeline()
+        pipe.hincrby(self.progress_key(batch_id), 'sent' if status == 1 else 'failed', 1)
+        pipe.hincrby(self.progress_key(batch_id), 'pending', -1)
+        if status != 1:
+            pipe.rpush(self.failures_key(batch_id), json.dumps({'to': to, 'statusText': status_text}))
+            pipe.ltrim(self.failures_key(batch_id), -batch_failures_max, -1)
+            pipe.expire(self.failures_key(batch_id), self.expiry)
+        pipe.hmget(self.progress_key(batch_id), 'messageCount', 'sent', 'failed', 'pending')
+        message_count, sent, failed, pending = pipe.execute()[-1]
+
+        if int(pending or 0) <= 0:
+            # The descriptor holds user credentials, it is not kept once every message is processed
+            self.redis.delete(self.key(batch_id))
+
+        return {'messageCount': int(message_count or 0), 'sent': int(sent or 0), 'failed': int(failed or 0),
+                'pending': int(pending or 0)}
+
+    def acquire_callback_slot(self, batch_id, callback_interval):
+        """Return True if no aggregated callback were made in the last callback_interval seconds"""
+        return bool(self.redis.set(self.callback_slot_key(batch_id), 1, px=int(callback_interval * 1000), nx=True))
+
+    def get_progress(self, batch_id):
+        """Return batch progression with its last failures or None if not found (or expired)"""
+        progress = self.redis.hgetall(self.progress_key(batch_id))
+        if not progress:
+            return None
+
+        progress = {k.decode(): v.decode() for k, v in progress.items()}
+        for counter in ['messageCount', 'sent', 'failed', 'pending']:
+            progress[counter] = int(progress[counter])
+        progress['failures'] = [json.loads(f) for f in self.redis.lrange(self.failures_key(batch_id), 0, -1)]
+
+        return progress
@@ -1,10 +1,15 @@
+import os
 import time
+from datetime import datetime, timedelta
 
+import redis
 import requests
+import requests.adapters
 from celery import Celery, Task
-from datetime import datetime, timedelta
 
+from jasmin.tools.cache import LRUCache
 from .config import *
+from .store import BatchStore
 
 # @TODO: make configuration loadable from /etc/jasmin/restapi.conf
 logger = logging.getLogger('jasmin-restapi')
@@ -19,103 +24,361 @@ task = app.task
 app.config_from_object('jasmin.protocols.rest.config')
 
 
+class TokenBucket:
+    """Local token bucket rate limiter
+
+    A bucket is given as a (key, rate, burst) tuple: it is refilled with rate tokens per second and
+    holds up to burst tokens. Tokens are taken from all given buckets at once or from none of them.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.buckets = {}
+
+    def acquire(self, buckets):
+        """Take one token from every bucket, return 0 if done or the number of seconds to wait before
+        tokens are available"""
+        now = self.clock()
+        wait = 0
+        states = []
+        for key, rate, burst in buckets:
+            tokens, updated_at = self.buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + max(0, now - updated_at) * rate)
+            if tokens < 1:
+                wait = max(wait, (1 - tokens) / float(rate))
+            states.append((key, tokens))
+
+        for key, tokens in states:
+            self.buckets[key] = (tokens - 1 if wait == 0 else tokens, now)
+
+        return wait
+
+
+class RedisTokenBucket(TokenBucket):
+    """Same as TokenBucket with buckets kept in redis, they are shared by all workers of the cluster"""
+
+    # KEYS are bucket keys, ARGV are rate and burst pairs for every key; redis server time is used
+    # to avoid depending on workers clocks
+    script = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local wait = 0
+local tokens = {}
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 2 - 1])
+    local burst = tonumber(ARGV[i * 2])
+    local state = redis.call('HMGET', key, 'tokens', 'ts')
+    local _tokens = tonumber(state[1]) or burst
+    local ts = tonumber(state[2]) or now
+    _tokens = math.min(burst, _tokens + math.max(0, now - ts) * rate)
+    if _tokens < 1 then
+        wait = math.max(wait, (1 - _tokens) / rate)
+    end
+    tokens[i] = _tokens
+end
+for i, key in ipairs(KEYS) do
+    if wait == 0 then
+        tokens[i] = tokens[i] - 1
+    end
+    redis.call('HSET', key, 'tokens', tostring(tokens[i]), 'ts', tostring(now))
+    redis.call('EXPIRE', key, math.ceil(tonumber(ARGV[i * 2]) / tonumber(ARGV[i * 2 - 1])) + 1)
+end
+return tostring(wait)
+"""
+
+    def __init__(self, url):
+        TokenBucket.__init__(self)
+        self.url = url
+        self._redis = None
+        self._script = None
+
+    def acquire(self, buckets):
+        if self._redis is None:
+            self._redis = redis.Redis.from_url(self.url)
+            self._script = self._redis.register_script(self.script)
+
+        keys = ['throughput:%s' % key for key, _, _ in buckets]
+        args = []
+        for _, rate, burst in buckets:
+            args.extend([rate, burst])
+
+        return float(self._script(keys=keys, args=args))
+
+
 class JasminTask(Task):
     def __init__(self):
         Task.__init__(self)
 
         # Shared namespace
         self.worker_tracker = {'last_req_at': datetime.now(), 'last_req_time': 0, 'throughput': 0}
+        self._session = None
+        self._session_pid = None
+        self.batch_store = BatchStore()
+        self.batches = LRUCache(batch_cache_max_keys, ttl=batch_cache_seconds)
+        if throughput_limiter == 'redis':
+            self.limiter = RedisTokenBucket(throughput_limiter_url)
+        else:
+            self.limiter = TokenBucket()
+
+    @property
+    def session(self):
+        """Per-process requests session keeping connections alive toward Jasmin's http api
+        and callback urls, it is created after fork since connections cannot be shared between
+        worker processes"""
+        if self._session is None or self._session_pid != os.getpid():
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=http_pool_connections, pool_maxsize=http_pool_maxsize)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+
+            self._session = session
+            self._session_pid = os.getpid()
+
+        return self._session
 
     def on_failure(self, exc, task_id, args, kwargs, einfo):
         logger.error('Task [%s] failed: %s', task_id, exc)
 
+    def get_batch(self, batch_id):
+        """Get batch descriptor from BatchStore, it is cached since the same batch is fetched by every slice"""
+        batch = self.batches.get(batch_id)
+        if batch is None:
+            batch = self.batch_store.get_batch(batch_id)
+            if batch is not None:
+                self.batches.set(batch_id, batch)
+
+        return batch
+
+    def throttle(self, username, config):
+        """Take a token for one message from global and user buckets, return 0 if message can be
+        sent or the number of seconds to wait before retrying"""
+        buckets = []
+        if config.get('global_throughput', 0) > 0:
+            buckets.append(('global', config['global_throughput'],
+                            max(1, config['global_throughput'] * throughput_burst_seconds)))
+        if config.get('user_throughput', 0) > 0:
+            buckets.append(('user:%s' % username, config['user_throughput'],
+                            max(1, config['user_throughput'] * throughput_burst_seconds)))
+        if len(buckets) == 0:
+            return 0
+
+        try:
+            return self.limiter.acquire(buckets)
+        except Exception as e:
+            # Do not block sendouts if the limiter is down
+            logger.error('Throughput limiter error (%s): %s', type(e), e)
+            return 0
+
+    def send(self, batch_id, message_params, config):
+        """Calls Jasmin's /send http api for one message and return a (status, status_text) tuple,
+        status is 1 if message were sent, 0 if not"""
+        try:
+            slow_down_seconds = 0
+            # Shall we do QoS control ?
+            if self.worker_tracker['throughput'] > 0:
+                qos_throughput_second = 1 / float(self.worker_tracker['throughput'])
+                qos_throughput_ysecond_td = timedelta(microseconds=qos_throughput_second * 1000000)
+                qos_delay = datetime.now() - self.worker_tracker['last_req_at']
+                if qos_delay < qos_throughput_ysecond_td:
+                    slow_down_seconds = float((qos_throughput_ysecond_td - qos_delay).microseconds) / 1000000
+                    logger.debug('QoS: slowing down request by %s/s to meet configured throughput per worker: %s/s',
+                                 slow_down_seconds, self.worker_tracker['throughput'])
+
+            # Shall we sleep ?
+            if slow_down_seconds > 0:
+                time.sleep(slow_down_seconds)
+
+            r = self.session.get('%s/send' % old_api_uri, params=message_params,
+                                 timeout=http_request_timeout)
+        except requests.exceptions.ConnectionError as e:
+            logger.error('[%s] Jasmin httpapi connection error: %s', batch_id, e)
+            return 0, 'HTTPAPI Connection error: %s' % e
+        except Exception as e:
+            logger.error('[%s] Unknown error (%s): %s', batch_id, type(e), e)
+            return 0, 'Unknown error: %s' % e
+        else:
+            # Useful for QoS control
+            self.worker_tracker['last_req_at'] = datetime.now()
+
+            # Smart throughput calculation
+            if self.worker_tracker['throughput'] == 0 and config['throughput'] > 0:
+                current_throughput = config['throughput']
+            else:
+                current_throughput = self.worker_tracker['throughput']
+            if config['smart_qos'] and self.worker_tracker['last_req_time'] is not None:
+                if r.elapsed.total_seconds() > self.worker_tracker['last_req_time']:
+                    # We have a slower request, we need to slow down the throughput
+                    if current_throughput > 0 and (current_throughput - (current_throughput * 10 / 100.0)) > 0:
+                        logger.debug('Smart QoS: Slowing down throughput %s/s to -10%%', current_throughput)
+                        current_throughput = current_throughput - (current_throughput * 10 / 100.0)
+                    elif current_throughput == 0:
+                        logger.debug('Smart QoS: Slowing down throughput %s/s to fixed 0.5/s', current_throughput)
+                        current_throughput = 0.5
+                        # Else: keep current_throughput as is since it cannot go down to zero
+                elif r.elapsed.total_seconds() < self.worker_tracker['last_req_time']:
+                    # We have a slower request, we need to boost the throughput
+                    if (current_throughput > 0 and config['throughput'] > 0 and (
+                                current_throughput + (current_throughput * 10 / 100.0)) <= config['throughput']):
+                        logger.debug('Smart QoS: Boosting throughput %s/s to +10%%', current_throughput)
+                        current_throughput = current_throughput + (current_throughput * 10 / 100.0)
+                    elif current_throughput > 0 and config['throughput'] == 0:
+                        logger.debug('Smart QoS: Restoring throughput %s/s to unlimited', current_throughput)
+                        current_throughput = 0
+
+            self.worker_tracker['throughput'] = current_throughput
+            self.worker_tracker['last_req_time'] = r.elapsed.total_seconds()
+
+            # Return status back
+            if r.status_code != 200:
+                logger.error('[%s] %s', batch_id, r.text.strip('"'))
+                return 0, 'HTTPAPI error: %s' % r.text.strip('"')
+            else:
+                return 1, r.text
+
+    def send_batch(self, batch_id, credentials, messages_params):
+        """Calls Jasmin's /send/batch http api for many messages at once and return a list of
+        (status, status_text) tuples, the same way send() does for every message"""
+        messages = []
+        for message_params in messages_params:
+            messages.append({k: v for k, v in message_params.items() if k not in ['username', 'password']})
+
+        try:
+            r = self.session.post('%s/send/batch' % old_api_uri, json={
+                'username': credentials['username'],
+                'password': credentials['password'],
+                'messages': messages}, timeout=http_request_timeout)
+        except requests.exceptions.ConnectionError as e:
+            logger.error('[%s] Jasmin httpapi connection error: %s', batch_id, e)
+            return [(0, 'HTTPAPI Connection error: %s' % e)] * len(messages)
+        except Exception as e:
+            logger.error('[%s] Unknown error (%s): %s', batch_id, type(e), e)
+            return [(0, 'Unknown error: %s' % e)] * len(messages)
+
+        if r.status_code != 200:
+            logger.error('[%s] %s', batch_id, r.text.strip('"'))
+            return [(0, 'HTTPAPI error: %s' % r.text.strip('"'))] * len(messages)
+
+        results = []
+        for result in r.json():
+            if result['status'] == 200:
+                # Same status text as /send
+                results.append((1, 'Success "%s"' % result['return']))
+            else:
+                logger.error('[%s] %s', batch_id, result['return'])
+                results.append((0, 'HTTPAPI error: %s' % result['return']))
+
+        return results
+
+    def report(self, batch_id, batch_config, to, status, status_text, tracked=True):
+        """Update batch progression and inform user through errback/callback urls, callbacks are made
+        for every message or aggregated depending on batch_config's callback_mode"""
+        progress = None
+        if tracked:
+            try:
+                progress = self.batch_store.mark_message(batch_id, to, status, status_text)
+            except Exception as e:
+                logger.error('[%s] Cannot update batch progression (%s): %s', batch_id, type(e), e)
+
+        if batch_config.get('callback_mode', 'message') == 'aggregated':
+            url = batch_config.get('callback_url', None) or batch_config.get('errback_url', None)
+            if url and progress is not None and self.summary_due(batch_id, batch_config, progress):
+                progress['batchId'] = '%s' % batch_id
+                progress['final'] = progress['pending'] <= 0
+                batch_summary_callback.delay(url, batch_id, progress)
+        elif status == 0 and batch_config.get('errback_url', None):
+            batch_callback.delay(batch_config.get('errback_url'), batch_id, to, 0, status_text)
+        elif status == 1 and batch_config.get('callback_url', None):
+            batch_callback.delay(batch_config.get('callback_url'), batch_id, to, 1, status_text)
+
+    def summary_due(self, batch_id, batch_config, progress):
+        """Aggregated callbacks are due every callback_every messages, every callback_interval seconds
+        and when the batch is completed"""
+        if progress['pending'] <= 0:
+            return True
+
+        callback_every = int(batch_config.get('callback_every', batch_callback_every))
+        if callback_every > 0 and (progress['sent'] + progress['failed']) % callback_every == 0:
+            return True
+
+        callback_interval = float(batch_config.get('callback_interval', batch_callback_interval))
+        if callback_interval > 0:
+            return self.batch_store.acquire_callback_slot(batch_id, callback_interval)
+
+        return False
+
 
 @task(bind=True, base=JasminTask)
 def httpapi_send(self, batch_id, batch_config, message_params, config):
     """Calls Jasmin's /send http api, if we have errback_url and callback_url in batch_config then
     will callback those urls asynchronously to inform user of batch progression"""
-    try:
-        slow_down_seconds = 0
-        # Shall we do QoS control ?
-        if self.worker_tracker['throughput'] > 0:
-            qos_throughput_second = 1 / float(self.worker_tracker['throughput'])
-            qos_throughput_ysecond_td = timedelta(microseconds=qos_throughput_second * 1000000)
-            qos_delay = datetime.now() - self.worker_tracker['last_req_at']
-            if qos_delay < qos_throughput_ysecond_td:
-                slow_down_seconds = float((qos_throughput_ysecond_td - qos_delay).microseconds) / 1000000
-                logger.debug('QoS: slowing down request by %s/s to meet configured throughput per worker: %s/s',
-                             slow_down_seconds, self.worker_tracker['throughput'])
-
-        # Shall we sleep ?
-        if slow_down_seconds > 0:
-            time.sleep(slow_down_seconds)
-
-        r = requests.get('%s/send' % old_api_uri, params=message_params)
-    except requests.exceptions.ConnectionError as e:
-        logger.error('[%s] Jasmin httpapi connection error: %s' % (batch_id, e))
-        if batch_config.get('errback_url', None):
-            batch_callback.delay(batch_config.get('errback_url'), batch_id, message_params['to'], 0,
-                                 'HTTPAPI Connection error: %s' % e)
-    except Exception as e:
-        logger.error('[%s] Unknown error (%s): %s' % (batch_id, type(e), e))
-        if batch_config.get('errback_url', None):
-            batch_callback.delay(batch_config.get('errback_url'), batch_id, message_params['to'], 0,
-                                 'Unknown error: %s' % e)
-    else:
-        # Useful for QoS control
-        self.worker_tracker['last_req_at'] = datetime.now()
+    wait = self.throttle(message_params.get('username'), config)
+    if wait > 0:
+        self.apply_async(args=[batch_id, batch_config, message_params, config], countdown=wait)
+        return
 
-        # Smart throughput calculation
-        if self.worker_tracker['throughput'] == 0 and config['throughput'] > 0:
-            current_throughput = config['throughput']
-        else:
-            current_throughput = self.worker_tracker['throughput']
-        if config['smart_qos'] and self.worker_tracker['last_req_time'] is not None:
-            if r.elapsed.total_seconds() > self.worker_tracker['last_req_time']:
-                # We have a slower request, we need to slow down the throughput
-                if current_throughput > 0 and (current_throughput - (current_throughput * 10 / 100.0)) > 0:
-                    logger.debug('Smart QoS: Slowing down throughput %s/s to -10%%', current_throughput)
-                    current_throughput = current_throughput - (current_throughput * 10 / 100.0)
-                elif current_throughput == 0:
-                    logger.debug('Smart QoS: Slowing down throughput %s/s to fixed 0.5/s', current_throughput)
-                    current_throughput = 0.5
-                    # Else: keep current_throughput as is since it cannot go down to zero
-            elif r.elapsed.total_seconds() < self.worker_tracker['last_req_time']:
-                # We have a slower request, we need to boost the throughput
-                if (current_throughput > 0 and config['throughput'] > 0 and (
-                            current_throughput + (current_throughput * 10 / 100.0)) <= config['throughput']):
-                    logger.debug('Smart QoS: Boosting throughput %s/s to +10%%', current_throughput)
-                    current_throughput = current_throughput + (current_throughput * 10 / 100.0)
-                elif current_throughput > 0 and config['throughput'] == 0:
-                    logger.debug('Smart QoS: Restoring throughput %s/s to unlimited', current_throughput)
-                    current_throughput = 0
-
-        self.worker_tracker['throughput'] = current_throughput
-        self.worker_tracker['last_req_time'] = r.elapsed.total_seconds()
-
-        # Return status back
-        if r.status_code != 200:
-            logger.error('[%s] %s' % (batch_id, r.text.strip('"')))
-            if batch_config.get('errback_url', None):
-                batch_callback.delay(
-                    batch_config.get('errback_url'), batch_id, message_params['to'], 0,
-                    'HTTPAPI error: %s' % r.text.strip('"'))
+    status, status_text = self.send(batch_id, message_params, config)
+    self.report(batch_id, batch_config, message_params['to'], status, status_text, tracked=False)
+
+
+@task(bind=True, base=JasminTask)
+def httpapi_send_slice(self, batch_id, recipients, config):
+    """Sends a slice of a batch saved in BatchStore, recipients is a list of [message index, to], all
+    messages are sent through the same pooled connection in one task invocation"""
+    batch = self.get_batch(batch_id)
+    if batch is None:
+        logger.error('[%s] Batch not found (or expired), %s messages cannot be sent', batch_id, len(recipients))
+        return
+
+    messages_params = []
+    for i, (message_index, to) in enumerate(recipients):
+        # Reschedule remaining recipients if throughput limit is reached instead of sleeping
+        wait = self.throttle(batch['credentials']['username'], config)
+        if wait > 0:
+            logger.debug('[%s] Throughput limit reached, rescheduling %s messages in %ss',
+                         batch_id, len(recipients) - i, wait)
+            self.apply_async(args=[batch_id, recipients[i:], config], countdown=wait)
+            break
+
+        message_params = dict(batch['credentials'])
+        message_params.update(batch['globals'])
+        message_params.update(batch['messages'][message_index])
+        message_params['to'] = to
+
+        if httpapi_batch_mode:
+            messages_params.append(message_params)
         else:
-            if batch_config.get('callback_url', None):
-                batch_callback.delay(
-                    batch_config.get('callback_url'), batch_id, message_params['to'], 1, r.text)
+            status, status_text = self.send(batch_id, message_params, config)
+            self.report(batch_id, batch['batch_config'], to, status, status_text)
+
+    if len(messages_params) > 0:
+        results = self.send_batch(batch_id, batch['credentials'], messages_params)
+        for message_params, (status, status_text) in zip(messages_params, results):
+            self.report(batch_id, batch['batch_config'], message_params['to'], status, status_text)
 
 
 @task(bind=True, base=JasminTask)
 def batch_callback(self, url, batch_id, to, status, status_text):
+    if status == 0:
+        operation_name = 'Errback'
+    else:
+        operation_name = 'Callback'
+
     try:
-        if status == 0:
-            operation_name = 'Errback'
-        else:
-            operation_name = 'Callback'
+        self.session.get(url, params={'batchId': batch_id, 'to': to, 'status': status, 'statusText': status_text},
+                         timeout=http_request_timeout)
+    except Exception as e:
+        logger.error('(%s) of batch %s to %s failed (%s): %s.', operation_name, batch_id, url, type(e), e)
+    else:
+        logger.info('(%s) of batch %s to %s succeeded.', operation_name, batch_id, url)
 
-        requests.get(url, params={'batchId': batch_id, 'to': to, 'status': status, 'statusText': status_text})
+
+@task(bind=True, base=JasminTask)
+def batch_summary_callback(self, url, batch_id, summary):
+    """Posts an aggregated batch progression summary to url"""
+    try:
+        self.session.post(url, json=summary, timeout=http_request_timeout)
     except Exception as e:
-        logger.error('(%s) of batch %s to %s failed (%s): %s.' % (operation_name, batch_id, url, type(e), e))
+        logger.error('(Summary callback) of batch %s to %s failed (%s): %s.', batch_id, url, type(e), e)
     else:
-        logger.info('(%s) of batch %s to %s succeeded.' % (operation_name, batch_id, url))
+        logger.info('(Summary callback) of batch %s to %s succeeded.', batch_id, url)
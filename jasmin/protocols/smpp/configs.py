@@ -184,6 +184,15 @@ class SMPPClientConfig:
         if (not isinstance(self.submit_sm_throughput, int)
             and not isinstance(self.submit_sm_throughput, float)):
             raise TypeMismatch('submit_sm_throughput must be an integer or float')
+        # Up to submit_sm_burst SubmitSm PDUs can be sent at once when connector was idle, the
+        # submit_sm_throughput is respected over time
+        self.submit_sm_burst = kwargs.get('submit_sm_burst', 1)
+        if not isinstance(self.submit_sm_burst, int) or self.submit_sm_burst < 1:
+            raise TypeMismatch('submit_sm_burst must be a positive integer')
+        # Maximum number of SubmitSm PDUs waiting for a response from the SMSC (window)
+        self.max_pending_submits = kwargs.get('max_pending_submits', 1)
+        if not isinstance(self.max_pending_submits, int) or self.max_pending_submits < 1:
+            raise TypeMismatch('max_pending_submits must be a positive integer')
 
         # DLR Message id bases from submit_sm_resp to deliver_sm, possible values:
         # [0] (default) : submit_sm_resp and deliver_sm messages IDs are on the same base.
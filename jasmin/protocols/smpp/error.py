@@ -85,6 +85,15 @@ class SubmitSmThroughputExceededError(SubmitSmEventHandlerErrorNoShutdown):
         SubmitSmEventHandlerErrorNoShutdown.__init__(self)
 
 
+class SubmitSmBacklogExceededError(SubmitSmEventHandlerErrorNoShutdown):
+    """Raised when routed connectors backlog would take too long to drain
+    """
+
+    def __init__(self):
+        self.status = pdu_types.CommandStatus.ESME_RTHROTTLED
+        SubmitSmEventHandlerErrorNoShutdown.__init__(self)
+
+
 class CredentialValidationError(SubmitSmEventHandlerErrorShutdown):
     """
     Raised when user credential validation fails
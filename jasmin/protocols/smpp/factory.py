@@ -21,8 +21,8 @@ from smpp.pdu.pdu_types import CommandId, CommandStatus, PDURequest
 from jasmin.protocols.smpp.error import (
     SubmitSmInvalidArgsError, SubmitSmWithoutDestinationAddrError, 
     InterceptorRunError, SubmitSmInterceptionError, SubmitSmInterceptionSuccess,
-    SubmitSmThroughputExceededError, SubmitSmRoutingError, SubmitSmRouteNotFoundError,
-    SubmitSmChargingError)
+    SubmitSmThroughputExceededError, SubmitSmBacklogExceededError, SubmitSmRoutingError,
+    SubmitSmRouteNotFoundError, SubmitSmChargingError)
 from jasmin.protocols.smpp.protocol import SMPPClientProtocol, SMPPServerProtocol
 from jasmin.protocols.smpp.stats import SMPPClientStatsCollector, SMPPServerStatsCollector
 from jasmin.protocols.smpp.validation import SmppsCredentialValidator
@@ -338,6 +338,7 @@ class SMPPServerFactory(_SMPPServerFactory):
         else:
             return self.submit_sm_post_interception(routable=routable, system_id=system_id, proto=proto)
 
+    @defer.inlineCallbacks
     def submit_sm_post_interception(self, *args, **kw):
         """This event handler will deliver the submit_sm to the right smppc connector.
         Note that Jasmin deliver submit_sm messages like this:
@@ -399,6 +400,9 @@ class SMPPServerFactory(_SMPPServerFactory):
             # Is it a failover route ? then check for a bound connector, otherwise don't route
             # The failover route requires at least one connector to be up, no message enqueuing will
             # occur otherwise.
+            # Connectors with a backlog taking too long to drain do not admit new messages (c.f.
+            # jasmin.managers.backlog), they are skipped by failover routes
+            saturated = False
             if repr(route) == 'FailoverMTRoute':
                 self.log.debug('Selected route is a failover, will ensure connector is bound:')
                 while True:
@@ -409,13 +413,25 @@ class SMPPServerFactory(_SMPPServerFactory):
                         self.log.debug('Connector [%s] is not found', routedConnector.cid)
 
                     if c and c['session_state'][:6] == 'BOUND_':
-                        # Choose this connector
-                        break
-                    else:
-                        # Check next connector, None if no more connectors are available
-                        routedConnector = route.getConnector()
-                        if routedConnector is None:
+                        if self.SMPPClientManagerPB.perspective_connector_admits(routedConnector.cid):
+                            # Choose this connector
                             break
+                        self.log.debug('Connector [%s] backlog exceeds its max drain time', routedConnector.cid)
+                        saturated = True
+
+                    # Check next connector, None if no more connectors are available
+                    routedConnector = route.getConnector()
+                    if routedConnector is None:
+                        break
+            elif not self.SMPPClientManagerPB.perspective_connector_admits(routedConnector.cid):
+                self.log.debug('Connector [%s] backlog exceeds its max drain time', routedConnector.cid)
+                saturated = True
+                routedConnector = None
+
+            if routedConnector is None and saturated:
+                self.log.error("Route has no connector admitting SubmitSmPDU, backlog is too long: %s",
+                               routable.pdu)
+                raise SubmitSmBacklogExceededError()
 
             if routedConnector is None:
                 self.log.error("Failover route has no bound connector to handle SubmitSmPDU: %s",
@@ -480,29 +496,30 @@ class SMPPServerFactory(_SMPPServerFactory):
             ########################################################
             # Send SubmitSmPDU through smpp client manager PB server
             self.log.debug("Connector '%s' is set to be a route for this SubmitSmPDU", routedConnector.cid)
-            c = self.SMPPClientManagerPB.perspective_submit_sm(
-                uid=routable.user.uid,
-                cid=routedConnector.cid,
-                SubmitSmPDU=routable.pdu,
-                submit_sm_bill=bill,
-                priority=priority,
-                pickled=False,
-                source_connector=proto)
-
-            if not hasattr(c, 'result'):
-                self.log.error('Failed to send SubmitSmPDU to [cid:%s], got: %s', routedConnector.cid, c)
-                raise SubmitSmRoutingError()
+            # Fires once the message is published (and confirmed by the broker)
+            try:
+                result = yield self.SMPPClientManagerPB.perspective_submit_sm(
+                    uid=routable.user.uid,
+                    cid=routedConnector.cid,
+                    SubmitSmPDU=routable.pdu,
+                    submit_sm_bill=bill,
+                    priority=priority,
+                    pickled=False,
+                    source_connector=proto)
+            except Exception as e:
+                self.log.error('Failed to send SubmitSmPDU to [cid:%s], got: %s', routedConnector.cid, e)
+                raise SubmitSmRoutingError() from e
 
             # Build final response
-            if not c.result:
+            if not result:
                 self.log.error('Failed to send SubmitSmPDU to [cid:%s]', routedConnector.cid)
                 raise SubmitSmRoutingError()
 
             # Otherwise, message_id is defined on ESME_ROK
-            message_id = c.result
+            message_id = result
         except (SubmitSmInterceptionError, SubmitSmInterceptionSuccess, InterceptorRunError,
-                SubmitSmRouteNotFoundError, SubmitSmThroughputExceededError, SubmitSmChargingError,
-                SubmitSmRoutingError) as e:
+                SubmitSmRouteNotFoundError, SubmitSmThroughputExceededError, SubmitSmBacklogExceededError,
+                SubmitSmChargingError, SubmitSmRoutingError) as e:
             # Known exception handling
             status = e.status
         except Exception as e:
@@ -0,0 +1,98 @@
+from twisted.internet import defer, reactor
+
+
+class AckBatcher:
+    """Acknowledges consumed messages in batches on a channel
+
+    Acks are held until size acks are pending, a consumer's held acks reach half of its prefetch
+    window or delay seconds passed; the pending acks preceded by no unsettled delivery are then
+    sent in one single basic_ack with multiple=True, the others are acknowledged one by one.
+
+    Deliveries must be tracked (track()) as they are consumed since multiple=True would ack all
+    outstanding deliveries on the channel, whatever consumer got them: consumers acking their
+    messages must all be registered with set_prefetch(); a size of 1 (or lower) will
+    disable batching: every ack is sent right away.
+    """
+
+    def __init__(self, size=1, delay=0, clock=None):
+        self.size = size
+        self.delay = delay
+        self.clock = clock or reactor
+        self.chan = None
+        self.prefetch = {}
+        self.unsettled = {}
+        self.pending = {}
+        self.timer = None
+
+    def reset(self, chan):
+        """Start over with a new channel, delivery tags of the previous one are meaningless"""
+        self.cancel_timer()
+        self.chan = chan
+        self.unsettled.clear()
+        self.pending.clear()
+
+    def set_prefetch(self, consumer_tag, prefetch_count):
+        self.prefetch[consumer_tag] = prefetch_count
+
+    def track(self, delivery_tag, consumer_tag):
+        """Register a consumed message until it gets acked or rejected, only messages of consumers
+        started with a prefetch (see set_prefetch()) are tracked: others may be consumed with no_ack
+        """
+        if consumer_tag in self.prefetch:
+            self.unsettled[delivery_tag] = consumer_tag
+
+    def cancel_timer(self):
+        if self.timer is not None and self.timer.active():
+            self.timer.cancel()
+        self.timer = None
+
+    def limit(self, consumer_tag):
+        """Max held acks for consumer_tag, the broker will not deliver more messages to it if all of
+        its prefetch window is held"""
+        prefetch = self.prefetch.get(consumer_tag, 0)
+        if prefetch > 0:
+            return min(self.size, max(1, prefetch // 2))
+
+        return self.size
+
+    def ack(self, delivery_tag):
+        consumer_tag = self.unsettled.pop(delivery_tag, None)
+        if self.size <= 1:
+            return self.chan.basic_ack(delivery_tag=delivery_tag)
+
+        self.pending[delivery_tag] = consumer_tag
+        held = sum(1 for c in self.pending.values() if c == consumer_tag)
+        if len(self.pending) >= self.size or held >= self.limit(consumer_tag):
+            return self.flush()
+
+        if self.timer is None:
+            self.timer = self.clock.callLater(self.delay, self.flush)
+
+        return defer.succeed(None)
+
+    def reject(self, delivery_tag, requeue=0):
+        self.unsettled.pop(delivery_tag, None)
+
+        return self.chan.basic_reject(delivery_tag=delivery_tag, requeue=requeue)
+
+    def flush(self):
+        """Send all pending acks"""
+        self.cancel_timer()
+        if len(self.pending) == 0:
+            return defer.succeed(None)
+
+        delivery_tags = sorted(self.pending)
+        self.pending.clear()
+
+        # All deliveries up to the first unsettled one can be acked at once
+        first_unsettled = min(self.unsettled) if len(self.unsettled) > 0 else None
+        contiguous = [t for t in delivery_tags if first_unsettled is None or t < first_unsettled]
+        others = delivery_tags[len(contiguous):]
+
+        deferreds = []
+        if len(contiguous) > 0:
+            deferreds.append(self.chan.basic_ack(delivery_tag=contiguous[-1], multiple=len(contiguous) > 1))
+        for delivery_tag in others:
+            deferreds.append(self.chan.basic_ack(delivery_tag=delivery_tag))
+
+        return defer.DeferredList(deferreds, consumeErrors=True)
@@ -35,6 +35,21 @@ class AmqpConfig(ConfigFile):
         self.spec = self._get('amqp-broker', 'spec', '%s/amqp0-9-1.xml' % RESOURCE_PATH)
         self.heartbeat = self._getint('amqp-broker', 'heartbeat', 0)
 
+        # Consumers prefetch (max unacknowledged messages per consumer, 0 for unlimited)
+        self.deliver_sm_prefetch = self._getint('amqp-broker', 'deliver_sm_prefetch', 0)
+        self.dlr_prefetch = self._getint('amqp-broker', 'dlr_prefetch', 0)
+        self.thrower_prefetch = self._getint('amqp-broker', 'thrower_prefetch', 0)
+        self.billing_prefetch = self._getint('amqp-broker', 'billing_prefetch', 0)
+
+        # Acknowledgements batching
+        self.ack_batch_size = self._getint('amqp-broker', 'ack_batch_size', 50)
+        self.ack_batch_delay = self._getfloat('amqp-broker', 'ack_batch_delay', 0.05)
+
+        # Publishing
+        self.publisher_confirms = self._getbool('amqp-broker', 'publisher_confirms', True)
+        self.publish_window = self._getint('amqp-broker', 'publish_window', 1000)
+        self.publish_buffer_size = self._getint('amqp-broker', 'publish_buffer_size', 10000)
+
         # Logging
         self.log_level = logging.getLevelName(self._get('amqp-broker', 'log_level', 'INFO'))
         self.log_file = self._get('amqp-broker', 'log_file', '%s/amqp-client.log' % LOG_PATH)
@@ -1,15 +1,49 @@
 # pylint: disable=E0203
 import sys
 import logging
+from itertools import count
 from logging.handlers import TimedRotatingFileHandler
 from twisted.internet.protocol import ClientFactory
 from twisted.internet import defer, reactor
 from txamqp.client import TwistedDelegate
+from txamqp.queue import TimeoutDeferredQueue
+from jasmin.queues.ack import AckBatcher
 from jasmin.queues.protocol import AmqpProtocol
+from jasmin.queues.publish import Publisher
 
 LOG_CATEGORY = "jasmin-amqp-factory"
 
 
+class AmqpDelegate(TwistedDelegate):
+    def basic_deliver(self, ch, msg):
+        if msg.consumer_tag not in self.client.factory.consumers:
+            # Not consumed through AmqpFactory.consume()
+            return TwistedDelegate.basic_deliver(self, ch, msg)
+
+        self.client.factory.delivered(msg)
+
+    def basic_ack(self, ch, msg):
+        """Publisher confirm"""
+        self.client.factory.publisher.handle_ack(msg.delivery_tag, msg.multiple)
+
+    def basic_nack(self, ch, msg):
+        self.client.factory.publisher.handle_nack(msg.delivery_tag, msg.multiple)
+
+
+class ConsumerChannel:
+    """A consumer and the channel dedicated to it, a slow consumer will only fill its own prefetch
+    window and will not hold other consumers nor publishing
+    """
+
+    def __init__(self, queue, consumer_tag, prefetch_count, acker):
+        self.queue = queue
+        self.consumer_tag = consumer_tag
+        self.prefetch_count = prefetch_count
+        self.acker = acker
+        self.chan = None
+        self.active = False
+
+
 class AmqpFactory(ClientFactory):
     protocol = AmqpProtocol
 
@@ -20,7 +54,18 @@ class AmqpFactory(ClientFactory):
         self.config = config
         self.channelReady = None
 
-        self.delegate = TwistedDelegate()
+        self.delegate = AmqpDelegate()
+        self.publisher = Publisher(self.config.publish_window if self.config.publisher_confirms else 0,
+                                   self.config.publish_buffer_size)
+        # Set once a message is buffered while disconnected, until the channel is ready again
+        self.buffering = False
+
+        # Channel 1 is used for declarations and publishing, every consumer gets its own channel
+        self.channelIds = count(2)
+        self.consumers = {}
+        self.consumerQueues = {}
+        # Delivered messages not settled yet, and the acker of the channel they were delivered on
+        self.deliveries = {}
 
         self.amqp = None  # The protocol instance.
         self.client = None  # Alias for protocol instance
@@ -107,12 +152,20 @@ class AmqpFactory(ClientFactory):
         self.connected = False
 
         self.client = None
+        self.publisher.reset()
+
+        # Messages delivered on lost channels are requeued by the broker
+        self.deliveries.clear()
+        for consumer in self.consumers.values():
+            consumer.chan = None
+            consumer.acker.reset(None)
 
         if self.config.reconnectOnConnectionLoss and self.connectionRetry:
             self.log.info("Reconnecting after %d seconds ...", self.config.reconnectOnConnectionLossDelay)
             self.reconnectTimer = reactor.callLater(self.config.reconnectOnConnectionLossDelay,
                                                     self.reConnect, connector)
         else:
+            self.close_consumers()
             self.exitDeferred.callback(self)
             self.log.info("Exiting.")
 
@@ -167,18 +220,72 @@ class AmqpFactory(ClientFactory):
 
         self.chan = chan
         self.queues = []
+        self.channelIds = count(2)
 
         d = self.chan.channel_open()
         d.addCallback(self._channel_open)
         d.addErrback(self._channel_open_failed)
 
+    @defer.inlineCallbacks
     def _channel_open(self, arg):
         """Called when the channel is open."""
         self.log.info("The channel is open")
 
+        confirms = yield self.select_confirms(self.chan)
+        if self.buffering:
+            self.buffering = False
+            self.log.info("Publishing %s messages buffered while disconnected", len(self.publisher.buffered))
+        self.publisher.reset(self.chan, confirms)
+
+        # Resume consumers on new channels after a reconnection
+        for consumer in list(self.consumers.values()):
+            if consumer.active:
+                try:
+                    yield self.start_consumer(consumer)
+                except Exception as e:
+                    self.log.error("Cannot resume consumer [%s]: %s", consumer.consumer_tag, e)
+
         # Flag that the connection is open.
         self.connected = True
-        self.channelReady.callback(self)
+        if not self.channelReady.called:
+            self.channelReady.callback(self)
+
+    @defer.inlineCallbacks
+    def select_confirms(self, chan):
+        """Put chan in confirm mode if publisher confirms are enabled, return True if done"""
+        if self.publisher.window <= 0:
+            defer.returnValue(False)
+        if not hasattr(chan, 'confirm_select'):
+            self.log.warning("AMQP spec %s has no confirm class, publisher confirms are disabled",
+                             self.config.spec)
+            defer.returnValue(False)
+
+        yield chan.confirm_select()
+        self.log.info("Publisher confirms are enabled")
+        defer.returnValue(True)
+
+    def channel_failed(self, chan, reason):
+        """Called when the broker closed chan while the connection is up (a publish to a missing
+        exchange for example), a new channel replaces the publishing one"""
+        if chan is not self.chan:
+            return
+
+        self.log.error("Channel %s closed by the broker: %s", chan.id, reason.value)
+        self.publisher.closed(chan, reason.value)
+        self.replace_channel()
+
+    @defer.inlineCallbacks
+    def replace_channel(self):
+        try:
+            chan = yield self.open_channel()
+            confirms = yield self.select_confirms(chan)
+        except Exception as e:
+            self.log.error("Cannot replace the closed channel: %s", e)
+            return
+
+        self.log.info("Channel %s replaces the closed channel", chan.id)
+        self.chan = chan
+        self.publisher.reset(chan, confirms)
 
     def _channel_open_failed(self, error):
         self.log.error("Channel open failed: %s", error)
@@ -193,6 +300,10 @@ class AmqpFactory(ClientFactory):
         self.channelReady = False
 
         if self.client is not None:
+            for consumer in self.consumers.values():
+                consumer.acker.flush()
+            self.close_consumers()
+
             return self.client.close(reason)
 
         return None
@@ -218,16 +329,128 @@ class AmqpFactory(ClientFactory):
         self.log.info("A new queue has been successfully declared [%s]", queue.queue)
         self.queues.append(queue.queue)
 
+    def queue(self, consumer_tag):
+        """Return a deferred firing with the queue of messages delivered to consumer_tag, the same
+        queue is fed again once consumers are resumed after a reconnection
+        """
+
+        return defer.succeed(self._queue(consumer_tag))
+
+    def _queue(self, consumer_tag):
+        if consumer_tag not in self.consumerQueues:
+            self.consumerQueues[consumer_tag] = TimeoutDeferredQueue()
+
+        return self.consumerQueues[consumer_tag]
+
+    def close_consumers(self):
+        """Close all consumers queues, their getters will errback with txamqp.queue.Closed"""
+
+        for q in self.consumerQueues.values():
+            q.close()
+        self.consumerQueues = {}
+        self.consumers = {}
+        self.deliveries.clear()
+
+    @defer.inlineCallbacks
+    def consume(self, queue, consumer_tag, prefetch_count=0):
+        """Start consuming from queue on a channel dedicated to consumer_tag with at most
+        prefetch_count unacknowledged messages (0 for unlimited), messages are put in
+        queue(consumer_tag); consuming is resumed after reconnecting until cancel() is called
+        """
+
+        consumer = self.consumers.get(consumer_tag)
+        if consumer is None:
+            consumer = ConsumerChannel(queue, consumer_tag, prefetch_count,
+                                       AckBatcher(self.config.ack_batch_size, self.config.ack_batch_delay))
+            self.consumers[consumer_tag] = consumer
+        else:
+            consumer.queue = queue
+            consumer.prefetch_count = prefetch_count
+
+        consumer.active = True
+        yield self.start_consumer(consumer)
+
+    @defer.inlineCallbacks
+    def start_consumer(self, consumer):
+        if consumer.chan is None:
+            chan = yield self.open_channel()
+            consumer.chan = chan
+            consumer.acker.reset(chan)
+            self.log.debug("Opened channel %s for consumer [%s]", chan.id, consumer.consumer_tag)
+
+        consumer.acker.set_prefetch(consumer.consumer_tag, consumer.prefetch_count)
+        yield consumer.chan.basic_qos(prefetch_count=consumer.prefetch_count)
+        yield consumer.chan.basic_consume(queue=consumer.queue, no_ack=False,
+                                          consumer_tag=consumer.consumer_tag)
+
+    @defer.inlineCallbacks
+    def open_channel(self):
+        """Open a new channel, errors raised on it by the broker (e.g. passive declaration of a
+        missing queue) will only close this channel
+        """
+
+        chan = yield self.client.channel(next(self.channelIds))
+        yield chan.channel_open()
+        defer.returnValue(chan)
+
+    @defer.inlineCallbacks
+    def cancel(self, consumer_tag):
+        """Stop consuming, the consumer channel is kept open for messages already delivered to
+        be settled and to be reused by a later consume()
+        """
+
+        consumer = self.consumers.get(consumer_tag)
+        if consumer is None or not consumer.active:
+            return
+
+        consumer.active = False
+        if consumer.chan is not None:
+            yield consumer.acker.flush()
+            yield consumer.chan.basic_cancel(consumer_tag=consumer_tag)
+
+    def delivered(self, message):
+        consumer = self.consumers[message.consumer_tag]
+
+        # Track the delivery before it is consumed, it will be settled when acked or rejected
+        consumer.acker.track(message.delivery_tag, message.consumer_tag)
+        self.deliveries[message] = consumer.acker
+
+        self._queue(message.consumer_tag).put(message)
+
+    def ack(self, message):
+        """Acknowledge a consumed message on the channel it was delivered on, acks are batched
+        (c.f. jasmin.queues.ack.AckBatcher); messages delivered before a reconnection are ignored
+        since the broker requeued them already
+        """
+
+        acker = self.deliveries.pop(message, None)
+        if acker is None:
+            self.log.debug("Ignoring ack of a message delivered on a lost channel: %s", message.delivery_tag)
+            return defer.succeed(None)
+
+        return acker.ack(message.delivery_tag)
+
+    def reject(self, message, requeue=0):
+        acker = self.deliveries.pop(message, None)
+        if acker is None:
+            self.log.debug("Ignoring reject of a message delivered on a lost channel: %s", message.delivery_tag)
+            return defer.succeed(None)
+
+        return acker.reject(message.delivery_tag, requeue)
+
     def publish(self, **args):
-        """This is a wrapper to channel's publish method
-        it is intended for connection checking before publishing
+        """This is a wrapper to channel's publish method, the returned deferred is fired once
+        the broker confirms the message (c.f. jasmin.queues.publish.Publisher)
+        messages published while disconnected are buffered until the channel is ready again
         """
 
         if not self.connected:
-            self.log.error("AMQP Client is not connected, cannot publish: %s", args)
-            return None
+            if not self.buffering:
+                self.buffering = True
+                self.log.warning("AMQP Client is not connected, buffering messages until the channel is ready")
+            self.log.debug("Buffering message with routing_key=%s", args.get('routing_key'))
 
-        return self.chan.basic_publish(**args)
+        return self.publisher.publish(**args)
 
     def stopConnectionRetrying(self):
         """This will stop the factory from reconnecting
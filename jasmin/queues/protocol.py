@@ -8,3 +8,7 @@ class AmqpProtocol(AMQClient):
         AMQClient.connectionMade(self)
 
         self.factory.connectDeferred.callback(self)
+
+    def channel_failed(self, channel, reason):
+        """Called when the broker closes a channel while the connection is up"""
+        self.factory.channel_failed(channel, reason)
@@ -0,0 +1,115 @@
+from collections import OrderedDict, deque
+
+from twisted.internet import defer
+
+
+class PublishError(Exception):
+    """Raised when a message is nacked by the broker or cannot be buffered"""
+
+
+class Publisher:
+    """Publishes messages on a channel in confirm mode
+
+    Every publish() returns a deferred fired once the broker confirmed the message (Basic.Ack), at
+    most window messages are waiting for a confirmation: the next ones are buffered and published
+    in order as confirmations are received.
+
+    Messages published while no channel is ready are buffered as well, up to spill_size messages
+    (publish() fails with PublishError when the buffer is full); unconfirmed messages of a lost
+    channel are published again (before buffered ones) once a new channel is ready, they may then
+    be delivered twice. A channel closed by the broker while the connection is up fails its
+    unconfirmed messages instead, since they may be the reason it was closed.
+
+    A window of 0 (or a channel where confirms are not selected) disables confirms: the deferred
+    fires as soon as the message is written.
+    """
+
+    def __init__(self, window=0, spill_size=0):
+        self.window = window
+        self.spill_size = spill_size
+        self.chan = None
+        self.confirms = False
+        self.seq = 0
+        self.unconfirmed = OrderedDict()
+        self.buffered = deque()
+
+    def reset(self, chan=None, confirms=False):
+        """Start over with a new channel (None when disconnected), confirms must be True if the
+        channel is in confirm mode
+        """
+        self.chan = chan
+        self.confirms = confirms and self.window > 0
+        self.seq = 0
+
+        # Unconfirmed messages are published again first
+        self.buffered.extendleft(reversed(self.unconfirmed.values()))
+        self.unconfirmed.clear()
+
+        self.drain()
+
+    def ready(self):
+        return self.chan is not None and (not self.confirms or len(self.unconfirmed) < self.window)
+
+    def publish(self, **args):
+        d = defer.Deferred()
+        if len(self.buffered) == 0 and self.ready():
+            self.send(args, d)
+        elif len(self.buffered) < self.spill_size:
+            self.buffered.append((args, d))
+        else:
+            d.errback(PublishError('Publish buffer is full (%s messages)' % len(self.buffered)))
+
+        return d
+
+    def send(self, args, d):
+        if not self.confirms:
+            self.chan.basic_publish(**args).chainDeferred(d)
+            return
+
+        self.seq += 1
+        self.unconfirmed[self.seq] = (args, d)
+        # Publishing fails if the channel is closed, the message will never be confirmed
+        self.chan.basic_publish(**args).addErrback(lambda failure, chan: self.closed(chan, failure.value),
+                                                   self.chan)
+
+    def closed(self, chan, reason):
+        """chan was closed by the broker: its unconfirmed messages are failed, next messages are
+        buffered until a new channel is set with reset()
+        """
+        if chan is not self.chan:
+            return
+
+        self.chan = None
+        unconfirmed = list(self.unconfirmed.values())
+        self.unconfirmed.clear()
+        for _, d in unconfirmed:
+            d.errback(PublishError('Channel closed before the message was confirmed: %s' % reason))
+
+    def drain(self):
+        while len(self.buffered) > 0 and self.ready():
+            args, d = self.buffered.popleft()
+            self.send(args, d)
+
+    def settle(self, delivery_tag, multiple):
+        if multiple:
+            seqs = [seq for seq in self.unconfirmed if seq <= delivery_tag]
+        else:
+            seqs = [delivery_tag] if delivery_tag in self.unconfirmed else []
+
+        return [self.unconfirmed.pop(seq)[1] for seq in seqs]
+
+    def handle_ack(self, delivery_tag, multiple=False):
+        for d in self.settle(delivery_tag, multiple):
+            d.callback(None)
+
+        self.drain()
+
+    def handle_nack(self, delivery_tag, multiple=False):
+        for d in self.settle(delivery_tag, multiple):
+            d.errback(PublishError('Message nacked by the broker'))
+
+        self.drain()
+
+    def pending(self):
+        """Number of messages not confirmed yet"""
+        return len(self.unconfirmed) + len(self.buffered)
@@ -0,0 +1,106 @@
+"""
+Delayed retries through TTL queues
+
+A message to retry is published again, with its retry count incremented in the x-retries header,
+to the <queue>.retry.<delay> queue where it waits for delay seconds (x-message-ttl) before being
+dead-lettered to the <queue>.requeue exchange which routes it back to <queue> with its original
+routing key; the consumed message is then acked.
+Nothing is held by consumers while waiting: pending retries survive restarts of jasmin.
+"""
+
+from twisted.internet import defer
+from txamqp.content import Content
+
+RETRIES_HEADER = 'x-retries'
+
+
+def retries(message):
+    """Return how many times message was retried"""
+    headers = message.content.properties.get('headers') or {}
+    return headers.get(RETRIES_HEADER, 0)
+
+
+class RetryScheduler:
+    """Retries messages consumed from queue through amqpBroker (an AmqpFactory)"""
+
+    def __init__(self, amqpBroker, queue, log=None):
+        self.amqpBroker = amqpBroker
+        self.queue = queue
+        self.log = log
+        self.chan = None
+        self.declared = set()
+
+    def requeue_exchange(self):
+        return '%s.requeue' % self.queue
+
+    def retry_queue(self, delay):
+        return '%s.retry.%s' % (self.queue, delay)
+
+    def retry_queues(self):
+        """Return the names of declared retry queues"""
+        return sorted(name for name in self.declared if name != self.requeue_exchange())
+
+    @defer.inlineCallbacks
+    def declare(self, delay):
+        """Declare exchanges and queues needed to retry messages after delay seconds (0 for no
+        delay), return the exchange to publish them to
+        """
+        # Declarations are lost with the channel if the broker was restarted
+        if self.chan is not self.amqpBroker.chan:
+            self.chan = self.amqpBroker.chan
+            self.declared.clear()
+
+        requeue_exchange = self.requeue_exchange()
+        if requeue_exchange not in self.declared:
+            yield self.chan.exchange_declare(exchange=requeue_exchange, type='fanout')
+            yield self.chan.queue_bind(queue=self.queue, exchange=requeue_exchange)
+            self.declared.add(requeue_exchange)
+
+        if delay <= 0:
+            defer.returnValue(requeue_exchange)
+
+        retry_queue = self.retry_queue(delay)
+        if retry_queue not in self.declared:
+            yield self.chan.exchange_declare(exchange=retry_queue, type='fanout')
+            yield self.chan.queue_declare(queue=retry_queue,
+                                          arguments={'x-message-ttl': int(delay * 1000),
+                                                     'x-dead-letter-exchange': requeue_exchange})
+            yield self.chan.queue_bind(queue=retry_queue, exchange=retry_queue)
+            self.declared.add(retry_queue)
+
+        defer.returnValue(retry_queue)
+
+    @defer.inlineCallbacks
+    def retry(self, message, delay=0):
+        """Deliver message again after delay seconds and ack it, the message is rejected and
+        requeued right away if it cannot be published
+        """
+        properties = dict(message.content.properties)
+        properties['headers'] = dict(properties.get('headers') or {})
+        properties['headers'][RETRIES_HEADER] = retries(message) + 1
+
+        try:
+            exchange = yield self.declare(delay)
+            yield self.amqpBroker.publish(exchange=exchange, routing_key=message.routing_key,
+                                          content=Content(message.content.body, properties=properties))
+        except Exception as e:
+            if self.log is not None:
+                self.log.error('Cannot schedule retry of message [msgid:%s], requeuing it: %s',
+                               properties.get('message-id'), e)
+            yield self.amqpBroker.reject(message, 1)
+            defer.returnValue(False)
+
+        yield self.amqpBroker.ack(message)
+        defer.returnValue(True)
+
+    @defer.inlineCallbacks
+    def delete(self):
+        """Delete declared retry queues and exchanges, messages waiting in them are lost"""
+        if self.chan is not self.amqpBroker.chan:
+            return
+
+        for name in list(self.declared):
+            if name != self.requeue_exchange():
+                yield self.chan.queue_delete(queue=name)
+            yield self.chan.exchange_delete(exchange=name)
+            self.declared.discard(name)
@@ -5,6 +5,7 @@ import txredisapi as redis
 from twisted.internet import reactor
 from twisted.internet import defer
 from jasmin.redis.configs import RedisForJasminConfig
+from jasmin.tools.cache import LRUCache
 
 LOG_CATEGORY = "jasmin-redis-client"
 
@@ -22,6 +23,106 @@ class RedisForJasminProtocol(redis.RedisProtocol):
         return redis.RedisProtocol.execute_command(self, *args, **kwargs)
 
 
+class RedisWriteBatcher:
+    """Coalesces redis writes of many messages in one single pipeline
+
+    Writes are queued and flushed every flush_window seconds (or whenever max_writes are queued),
+    each write returns a deferred firing when its pipeline is executed; a flush_window of 0 (or
+    lower) will flush every write right away, still in one round-trip.
+    """
+
+    def __init__(self, client, flush_window=0, max_writes=500, clock=None):
+        self.client = client
+        self.flush_window = flush_window
+        self.max_writes = max_writes
+        self.clock = clock or reactor
+        self.writes = []
+        self.timer = None
+
+    def set_expire(self, key, value, expiry):
+        """Set key's value and expire it after expiry seconds, atomically"""
+        return self.queue([('set', (key, value, expiry))])
+
+    def delete(self, key):
+        return self.queue([('delete', (key,))])
+
+    def queue(self, commands):
+        d = defer.Deferred()
+        self.writes.append((commands, d))
+
+        if self.flush_window <= 0 or len(self.writes) >= self.max_writes:
+            self.flush()
+        elif self.timer is None:
+            self.timer = self.clock.callLater(self.flush_window, self.flush)
+
+        return d
+
+    @defer.inlineCallbacks
+    def flush(self):
+        """Execute all queued writes in one pipeline"""
+        if self.timer is not None and self.timer.active():
+            self.timer.cancel()
+        self.timer = None
+
+        writes, self.writes = self.writes, []
+        if len(writes) == 0:
+            return
+
+        try:
+            pipeline = yield self.client.pipeline()
+            for commands, _ in writes:
+                for command, args in commands:
+                    getattr(pipeline, command)(*args)
+            replies = yield pipeline.execute_pipeline()
+        except Exception as e:
+            if isinstance(e, defer.FirstError):
+                e = e.subFailure.value
+            for _, d in writes:
+                d.errback(e)
+        else:
+            # Every write gets the replies of its own commands
+            replies = iter(replies)
+            for commands, d in writes:
+                d.callback([next(replies) for _ in commands])
+
+
+class RedisForJasminConnectionHandler(redis.ConnectionHandler):
+    """Adds batched writes and a process-local write-through cache to the pooled connections handler
+
+    Values set with set_expire() are kept in the local cache (if enabled) and served by cached_get()
+    without querying redis.
+    """
+
+    def __init__(self, factory):
+        redis.ConnectionHandler.__init__(self, factory)
+
+        config = getattr(factory, 'config', None)
+        if isinstance(config, RedisForJasminConfig):
+            self.writes = RedisWriteBatcher(self, config.write_flush_window, config.write_batch_size)
+            self.cache = LRUCache(config.local_cache_max_keys, ttl=config.local_cache_seconds)
+        else:
+            self.writes = RedisWriteBatcher(self)
+            self.cache = LRUCache(0)
+
+    def set_expire(self, key, value, expiry):
+        self.cache.set(key, value, ttl=min(expiry, self.cache.ttl or expiry))
+
+        return self.writes.set_expire(key, value, expiry)
+
+    def cached_get(self, key):
+        """Return key's value from the local cache or from redis"""
+        value = self.cache.get(key)
+        if value is not None:
+            return defer.succeed(value)
+
+        return self.get(key)
+
+    def batched_delete(self, key):
+        self.cache.pop(key)
+
+        return self.writes.delete(key)
+
+
 class RedisForJasminFactory(redis.RedisFactory):
     protocol = RedisForJasminProtocol
 
@@ -38,7 +139,8 @@ class RedisForJasminFactory(redis.RedisFactory):
         self.log.info('Connection failed. Reason: %s', reason)
 
     def __init__(self, uuid, dbid, poolsize, isLazy=True,
-                 handler=redis.ConnectionHandler, config=None):
+                 handler=RedisForJasminConnectionHandler, config=None):
+        self.config = config
         if isinstance(config, RedisForJasminConfig) and config.password is not None:
             redis.RedisFactory.__init__(self, uuid, dbid, poolsize, isLazy, handler, password=config.password)
         else:
@@ -65,7 +167,8 @@ class RedisForJasminFactory(redis.RedisFactory):
 
 def makeConnection(host, port, dbid, poolsize, reconnect, isLazy, _RedisForJasminConfig=None):
     uuid = "%s:%s" % (host, port)
-    factory = RedisForJasminFactory(uuid, None, poolsize, isLazy, redis.ConnectionHandler, _RedisForJasminConfig)
+    factory = RedisForJasminFactory(uuid, None, poolsize, isLazy, RedisForJasminConnectionHandler,
+                                    _RedisForJasminConfig)
     factory.continueTrying = reconnect
     for _ in range(poolsize):
         reactor.connectTCP(host, int(port), factory)
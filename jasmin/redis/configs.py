@@ -29,6 +29,14 @@ class RedisForJasminConfig(ConfigFile):
         self.dbid = self._getint('redis-client', 'dbid', '0')
         self.poolsize = self._getint('redis-client', 'poolsize', 10)
 
+        # Batched writes (DLR mappings)
+        self.write_flush_window = self._getfloat('redis-client', 'write_flush_window', 0.005)
+        self.write_batch_size = self._getint('redis-client', 'write_batch_size', 500)
+
+        # Process-local cache of recently set DLR mappings
+        self.local_cache_max_keys = self._getint('redis-client', 'local_cache_max_keys', 0)
+        self.local_cache_seconds = self._getint('redis-client', 'local_cache_seconds', 60)
+
         self.log_level = logging.getLevelName(self._get('redis-client', 'log_level', 'INFO'))
         self.log_file = self._get('redis-client',
                                   'log_file', '%s/redis-client.log' % LOG_PATH)
@@ -2,9 +2,16 @@
 More info: http://docs.jasminsms.com/en/latest/routing/index.html
 """
 
+import heapq
+
+from jasmin.routing.Filters import (UserFilter, GroupFilter, ConnectorFilter, TagFilter,
+                                    DestinationAddrFilter, EvalPyFilter)
 from jasmin.routing.Routables import Routable
 from jasmin.routing.Routes import Route
 
+# Regex characters that can be taken literally when extracting a destination prefix
+PREFIX_LITERAL_CHARS = '0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
 
 class InvalidRoutingTableParameterError(Exception):
     """Raised when a parameter is not an instance of a desired class (used for
@@ -12,6 +19,186 @@ class InvalidRoutingTableParameterError(Exception):
     """
 
 
+def getDestinationPrefix(pattern):
+    """Return the literal prefix any destination_addr must start with to match pattern, or None
+    if the pattern cannot be safely reduced to a prefix (alternations, optional leading chars ...)
+    """
+    if '|' in pattern:
+        return None
+
+    # re.match() is always anchored to the beginning of the string
+    if pattern.startswith('^'):
+        pattern = pattern[1:]
+
+    prefix = ''
+    i = 0
+    while i < len(pattern):
+        if pattern[i] in PREFIX_LITERAL_CHARS:
+            prefix += pattern[i]
+            i += 1
+        elif pattern[i:i + 2] == '\\+':
+            prefix += '+'
+            i += 2
+        else:
+            break
+
+    # Last literal is not mandatory if it's followed by an optional quantifier
+    if prefix != '' and i < len(pattern) and pattern[i] in '?*{':
+        prefix = prefix[:-1]
+
+    return prefix if prefix != '' else None
+
+
+class PrefixTrie:
+    """A character trie holding route orders under destination prefixes"""
+
+    def __init__(self):
+        self.root = {'orders': [], 'children': {}}
+
+    def add(self, prefix, order):
+        node = self.root
+        for c in prefix:
+            node = node['children'].setdefault(c, {'orders': [], 'children': {}})
+        node['orders'].append(order)
+
+    def sort(self):
+        nodes = [self.root]
+        while len(nodes) > 0:
+            node = nodes.pop()
+            node['orders'].sort(reverse=True)
+            nodes.extend(node['children'].values())
+
+    def lookup(self, string):
+        """Return the order lists of every prefix of string (including the empty one)"""
+        node = self.root
+        found = [node['orders']] if len(node['orders']) > 0 else []
+        for c in string:
+            node = node['children'].get(c)
+            if node is None:
+                break
+            if len(node['orders']) > 0:
+                found.append(node['orders'])
+
+        return found
+
+
+class RoutingIndex:
+    """Compiled lookup index of a RoutingTable
+
+    Every route is filed under exactly one bucket, selected from the most selective filter it has:
+    user uid, connector cid, destination prefix, group gid or tag; routes having no indexable
+    filter (or having an EvalPyFilter) are kept in an unindexed list.
+
+    getRouteFor() is only walking the buckets relevant to the routable and is still calling
+    route.matchFilters() on these candidates in descending order, this is giving the same result
+    as the linear scan of the table.
+
+    EvalPy filters can change the routable (add a tag for example) and make later routes
+    eligible, candidates can not be selected beforehand: the whole table is scanned when it has
+    such a route.
+    """
+
+    def __init__(self, table):
+        self.routes = {}
+        self.uids = {}
+        self.cids = {}
+        self.gids = {}
+        self.tags = {}
+        self.destinations = PrefixTrie()
+        self.unindexed = []
+        self.linear = False
+
+        for r in table:
+            order, route = list(r.items())[0]
+            self.routes[order] = route
+            self._fileRoute(order, route)
+
+        for bucket in [self.uids, self.cids, self.gids, self.tags]:
+            for orders in bucket.values():
+                orders.sort(reverse=True)
+        self.destinations.sort()
+        self.unindexed.sort(reverse=True)
+        self.orders = sorted(self.routes, reverse=True)
+
+    def _fileRoute(self, order, route):
+        filters = getattr(route, 'filters', None)
+        if not isinstance(filters, list) or len(filters) == 0:
+            self.unindexed.append(order)
+            return
+
+        # EvalPy filters may have side effects on the routable, they must be
+        # evaluated exactly as done in a linear scan
+        if len([f for f in filters if isinstance(f, EvalPyFilter)]) > 0:
+            self.unindexed.append(order)
+            self.linear = True
+            return
+
+        for _filter in filters:
+            if isinstance(_filter, UserFilter):
+                self.uids.setdefault(_filter.user.uid, []).append(order)
+                return
+        for _filter in filters:
+            if isinstance(_filter, ConnectorFilter):
+                self.cids.setdefault(_filter.connector.cid, []).append(order)
+                return
+        for _filter in filters:
+            if isinstance(_filter, DestinationAddrFilter):
+                prefix = getDestinationPrefix(_filter.destination_addr.pattern)
+                if prefix is not None:
+                    self.destinations.add(prefix, order)
+                    return
+        for _filter in filters:
+            if isinstance(_filter, GroupFilter):
+                self.gids.setdefault(_filter.group.gid, []).append(order)
+                return
+        for _filter in filters:
+            if isinstance(_filter, TagFilter):
+                self.tags.setdefault(_filter.tag, []).append(order)
+                return
+
+        self.unindexed.append(order)
+
+    def getCandidates(self, routable):
+        """Return the orders of routes that may match routable, in descending order"""
+        if self.linear:
+            return self.orders
+
+        buckets = [self.unindexed]
+
+        user = getattr(routable, 'user', None)
+        if user is not None:
+            if user.uid in self.uids:
+                buckets.append(self.uids[user.uid])
+            if user.group.gid in self.gids:
+                buckets.append(self.gids[user.group.gid])
+
+        connector = getattr(routable, 'connector', None)
+        if connector is not None and connector.cid in self.cids:
+            buckets.append(self.cids[connector.cid])
+
+        if len(self.tags) > 0:
+            for tag in set(routable.getTags()):
+                if tag in self.tags:
+                    buckets.append(self.tags[tag])
+
+        pdu = getattr(routable, 'pdu', None)
+        if pdu is not None and isinstance(pdu.params.get('destination_addr'), bytes):
+            buckets.extend(self.destinations.lookup(
+                pdu.params['destination_addr'].decode('utf-8', 'replace')))
+
+        if len(buckets) == 1:
+            return buckets[0]
+        return heapq.merge(*buckets, reverse=True)
+
+    def getRouteFor(self, routable):
+        for order in self.getCandidates(routable):
+            route = self.routes[order]
+            if route.matchFilters(routable):
+                return route
+
+        return None
+
+
 class RoutingTable:
     """Generic Routing table
     """
@@ -19,6 +206,17 @@ class RoutingTable:
 
     def __init__(self):
         self.table = []
+        self._index = None
+
+    def __getstate__(self):
+        """The compiled index is not persisted, it will be rebuilt on first lookup"""
+        state = self.__dict__.copy()
+        state.pop('_index', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._index = None
 
     def add(self, route, order):
         if not isinstance(route, Route):
@@ -61,11 +259,13 @@ class RoutingTable:
 
         self.table.append({order: route})
         self.table = sorted(self.table, key=lambda x: sorted(x.keys()), reverse=True)
+        self._index = None
 
     def remove(self, order):
         for r in self.table:
             if list(r)[0] == order:
                 self.table.remove(r)
+                self._index = None
                 return True
 
         return False
@@ -75,6 +275,14 @@ class RoutingTable:
 
     def flush(self):
         self.table = []
+        self._index = None
+
+    def getIndex(self):
+        """Return the compiled RoutingIndex, (re)building it if the table were updated"""
+        if self._index is None:
+            self._index = RoutingIndex(self.table)
+
+        return self._index
 
     def getRouteFor(self, routable):
         """This will return the right route to send the routable to, None returned otherwise
@@ -83,12 +291,7 @@ class RoutingTable:
         if not isinstance(routable, Routable):
             raise InvalidRoutingTableParameterError("routable is not an instance of Routable")
 
-        for r in self.table:
-            route = list(r.values())[0]
-            if route.matchFilters(routable):
-                return route
-
-        return None
+        return self.getIndex().getRouteFor(routable)
 
 
 class MTRoutingTable(RoutingTable):
@@ -31,6 +31,12 @@ class RouterPBConfig(ConfigFile):
 
         self.pickle_protocol = self._getint('router', 'pickle_protocol', 2)
 
+        # Encoding of PDUs published on AMQP: pickle or smpp (c.f. jasmin.managers.pducodec)
+        self.pdu_encoding = self._get('router', 'pdu_encoding', 'pickle')
+
+        # Maximum number of recently authenticated credentials kept in memory, 0 to disable
+        self.authentication_cache_max_keys = self._getint('router', 'authentication_cache_max_keys', 1000)
+
         # Logging
         self.log_level = logging.getLevelName(self._get('router', 'log_level', 'INFO'))
         self.log_rotate = self._get('router', 'log_rotate', 'W6')
@@ -50,6 +56,11 @@ class deliverSmThrowerConfig(ConfigFile):
         self.retry_delay = self._getint('deliversm-thrower', 'retry_delay', 30)
         self.max_retries = self._getint('deliversm-thrower', 'max_retries', 3)
 
+        # Throwing concurrency and http connections pooling
+        self.concurrency = self._getint('deliversm-thrower', 'concurrency', 100)
+        self.http_concurrency_per_host = self._getint('deliversm-thrower', 'http_concurrency_per_host', 10)
+        self.http_keepalive_timeout = self._getint('deliversm-thrower', 'http_keepalive_timeout', 60)
+
         # Logging
         self.log_level = logging.getLevelName(self._get('deliversm-thrower', 'log_level', 'INFO'))
         self.log_file = self._get(
@@ -70,6 +81,15 @@ class DLRThrowerConfig(ConfigFile):
         self.retry_delay = self._getint('dlr-thrower', 'retry_delay', 30)
         self.max_retries = self._getint('dlr-thrower', 'max_retries', 3)
 
+        # Throwing concurrency and http connections pooling
+        self.concurrency = self._getint('dlr-thrower', 'concurrency', 100)
+        self.http_concurrency_per_host = self._getint('dlr-thrower', 'http_concurrency_per_host', 10)
+        self.http_keepalive_timeout = self._getint('dlr-thrower', 'http_keepalive_timeout', 60)
+
+        # DLRs requested with the BATCH dlr-method are thrown in batches
+        self.http_batch_size = self._getint('dlr-thrower', 'http_batch_size', 100)
+        self.http_batch_delay = self._getfloat('dlr-thrower', 'http_batch_delay', 1.0)
+
         # #139: need configuration to send deliver_sm instead of data_sm for SMPP delivery receipt
         # 20150521: it seems better to get deliver_sm the default pdu for receipts
         self.dlr_pdu = self._get('dlr-thrower', 'dlr_pdu', 'deliver_sm')
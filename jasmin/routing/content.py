@@ -2,6 +2,8 @@ import pickle as _pickle
 
 from txamqp.content import Content
 
+from jasmin.managers import pducodec
+
 
 class PDU(Content):
     pickleProtocol = _pickle.HIGHEST_PROTOCOL
@@ -9,16 +11,26 @@ class PDU(Content):
     def pickle(self, data):
         return _pickle.dumps(data, self.pickleProtocol)
 
-    def __init__(self, body="", children=None, properties=None, pickleProtocol=_pickle.HIGHEST_PROTOCOL):
+    def __init__(self, body="", children=None, properties=None, pickleProtocol=_pickle.HIGHEST_PROTOCOL,
+                 encoding='pickle'):
         self.pickleProtocol = pickleProtocol
 
-        body = self.pickle(body)
+        if encoding == 'smpp':
+            try:
+                body = pducodec.encode(body)
+                properties['content-type'] = pducodec.CONTENT_TYPE
+            except ValueError:
+                # Not representable as SMPP binary PDUs
+                body = self.pickle(body)
+        else:
+            body = self.pickle(body)
 
         Content.__init__(self, body, children, properties)
 
 
 class RoutedDeliverSmContent(PDU):
-    def __init__(self, deliver_sm, msgid, scid, dcs, route_type='simple', trycount=0, pickleProtocol=_pickle.HIGHEST_PROTOCOL):
+    def __init__(self, deliver_sm, msgid, scid, dcs, route_type='simple', trycount=0, pickleProtocol=_pickle.HIGHEST_PROTOCOL,
+                 encoding='pickle'):
         props = {}
 
         if type(dcs) != list:
@@ -33,4 +45,4 @@ class RoutedDeliverSmContent(PDU):
             'dst-connectors': self.pickle(dcs),
             'try-count': trycount}
 
-        PDU.__init__(self, deliver_sm, properties=props, pickleProtocol=pickleProtocol)
+        PDU.__init__(self, deliver_sm, properties=props, pickleProtocol=pickleProtocol, encoding=encoding)
@@ -11,11 +11,13 @@ from twisted.spread import pb
 from txamqp.queue import Closed
 
 import jasmin
+from jasmin.managers.content import decode_body
 from jasmin.routing.InterceptionTables import (MOInterceptionTable,
                                                MTInterceptionTable,
                                                InvalidInterceptionTableParameterError)
 from jasmin.routing.RoutingTables import MORoutingTable, MTRoutingTable, InvalidRoutingTableParameterError
 from jasmin.routing.content import RoutedDeliverSmContent
+from jasmin.tools.cache import LRUCache
 from jasmin.tools.migrations.configuration import ConfigurationMigrator
 
 LOG_CATEGORY = "jasmin-router"
@@ -50,6 +52,16 @@ class RouterPB(pb.Avatar):
         self.users = []
         self.groups = []
 
+        # Lookup indexes for users and groups, they are rebuilt with reindexUsers() and
+        # reindexGroups() whenever self.users or self.groups are updated
+        self.users_by_username = {}
+        self.users_by_uid = {}
+        self.groups_by_gid = {}
+
+        # Recently authenticated (username, password) credentials with the password digest
+        # they were verified against
+        self.authentication_cache = LRUCache(self.config.authentication_cache_max_keys)
+
         # Init interception-related objects
         self.mo_interception_table = MOInterceptionTable()
         self.mt_interception_table = MTInterceptionTable()
@@ -89,8 +101,8 @@ class RouterPB(pb.Avatar):
         queueName = 'RouterPB_deliver_sm_all'  # A local queue to RouterPB
         yield self.amqpBroker.named_queue_declare(queue=queueName)
         yield self.amqpBroker.chan.queue_bind(queue=queueName, exchange="messaging", routing_key=routingKey)
-        yield self.amqpBroker.chan.basic_consume(queue=queueName, no_ack=False, consumer_tag=consumerTag)
-        self.deliver_sm_q = yield self.amqpBroker.client.queue(consumerTag)
+        yield self.amqpBroker.consume(queueName, consumerTag, self.amqpBroker.config.deliver_sm_prefetch)
+        self.deliver_sm_q = yield self.amqpBroker.queue(consumerTag)
         self.deliver_sm_q.get().addCallback(self.deliver_sm_callback).addErrback(self.deliver_sm_errback)
         self.log.info('RouterPB is consuming from routing key: %s', routingKey)
 
@@ -101,8 +113,8 @@ class RouterPB(pb.Avatar):
         queueName = 'RouterPB_bill_request_submit_sm_resp_all'  # A local queue to RouterPB
         yield self.amqpBroker.named_queue_declare(queue=queueName)
         yield self.amqpBroker.chan.queue_bind(queue=queueName, exchange="billing", routing_key=routingKey)
-        yield self.amqpBroker.chan.basic_consume(queue=queueName, no_ack=False, consumer_tag=consumerTag)
-        self.bill_request_submit_sm_resp_q = yield self.amqpBroker.client.queue(consumerTag)
+        yield self.amqpBroker.consume(queueName, consumerTag, self.amqpBroker.config.billing_prefetch)
+        self.bill_request_submit_sm_resp_q = yield self.amqpBroker.queue(consumerTag)
         self.bill_request_submit_sm_resp_q.get().addCallback(
             self.bill_request_submit_sm_resp_callback).addErrback(
             self.bill_request_submit_sm_resp_errback)
@@ -110,11 +122,11 @@ class RouterPB(pb.Avatar):
 
     @defer.inlineCallbacks
     def rejectMessage(self, message):
-        yield self.amqpBroker.chan.basic_reject(delivery_tag=message.delivery_tag, requeue=0)
+        yield self.amqpBroker.reject(message)
 
     @defer.inlineCallbacks
     def ackMessage(self, message):
-        yield self.amqpBroker.chan.basic_ack(message.delivery_tag)
+        yield self.amqpBroker.ack(message)
 
     def activatePersistenceTimer(self):
         if self.persistenceTimer and self.persistenceTimer.active():
@@ -161,7 +173,7 @@ class RouterPB(pb.Avatar):
         scid = message.content.properties['headers']['connector-id']
         concatenated = message.content.properties['headers']['concatenated']
         will_be_concatenated = message.content.properties['headers']['will_be_concatenated']
-        routable = pickle.loads(message.content.body)
+        routable = decode_body(message.content)
         self.log.debug("Callbacked a deliver_sm with a DeliverSmPDU[%s] (?): %s", msgid, routable.pdu)
 
         # @todo: Implement MO throttling here, same as in
@@ -213,7 +225,8 @@ class RouterPB(pb.Avatar):
                 yield self.ackMessage(message)
 
                 # Enqueue DeliverSm for delivery through publishing it to deliver_sm_thrower.(type)
-                content = RoutedDeliverSmContent(routable.pdu, msgid, scid, routedConnectors, route_type)
+                content = RoutedDeliverSmContent(routable.pdu, msgid, scid, routedConnectors, route_type,
+                                                 encoding=self.config.pdu_encoding)
                 self.log.debug("Publishing RoutedDeliverSmContent [msgid:%s] in deliver_sm_thrower.%s",
                                msgid, routedConnectors[0]._type)
                 yield self.amqpBroker.publish(exchange='messaging', routing_key='deliver_sm_thrower.%s' %
@@ -286,12 +299,43 @@ class RouterPB(pb.Avatar):
     def getMTRoutingTable(self):
         return self.mt_routing_table
 
+    def reindexUsers(self):
+        """Rebuild users lookup indexes, must be called whenever self.users is updated"""
+        self.users_by_username = {}
+        self.users_by_uid = {}
+        for _user in self.users:
+            self.users_by_username.setdefault(_user.username, _user)
+            self.users_by_uid.setdefault(str(_user.uid), _user)
+
+        # Cached credentials may belong to removed or replaced users
+        self.authentication_cache.clear()
+
+    def reindexGroups(self):
+        """Rebuild groups lookup index, must be called whenever self.groups is updated"""
+        self.groups_by_gid = {}
+        for _group in self.groups:
+            self.groups_by_gid.setdefault(str(_group.gid), _group)
+
+    def getUserByUsername(self, username):
+        return self.users_by_username.get(username)
+
     def authenticateUser(self, username, password, return_pickled=False):
         """Authenticate a user agains username and password and return user object or None
         """
         # Find user having correct username/password
-        for _user in self.users:
-            if _user.username == username and _user.password == md5(password.encode('ascii')).digest():
+        _user = self.getUserByUsername(username)
+        if _user is not None:
+            # Credentials are considered valid if they were recently verified against the
+            # same password digest, the user password digest is compared otherwise
+            if self.authentication_cache.get((username, password)) == _user.password:
+                authenticated = True
+            elif _user.password == md5(password.encode('ascii')).digest():
+                self.authentication_cache.set((username, password), _user.password)
+                authenticated = True
+            else:
+                authenticated = False
+
+            if authenticated:
                 self.log.debug('authenticateUser [username:%s] returned a User', username)
 
                 # Check if user's group is enabled
@@ -363,19 +407,19 @@ class RouterPB(pb.Avatar):
         return True
 
     def getUser(self, uid):
-        for _user in self.users:
-            if str(_user.uid) == str(uid):
-                self.log.debug('getUser [uid:%s] returned a User', uid)
-                return _user
+        _user = self.users_by_uid.get(str(uid))
+        if _user is not None:
+            self.log.debug('getUser [uid:%s] returned a User', uid)
+            return _user
 
         self.log.debug('getUser [uid:%s] returned None', uid)
         return None
 
     def getGroup(self, gid):
-        for _group in self.groups:
-            if str(_group.gid) == str(gid):
-                self.log.debug('getGroup [gid:%s] returned a Group', gid)
-                return _group
+        _group = self.groups_by_gid.get(str(gid))
+        if _group is not None:
+            self.log.debug('getGroup [gid:%s] returned a Group', gid)
+            return _group
 
         self.log.debug('getGroup [gid:%s] returned None', gid)
         return None
@@ -559,6 +603,7 @@ class RouterPB(pb.Avatar):
 
                 # Adding new groups
                 self.groups = cf.getMigratedData()
+                self.reindexGroups()
                 self.log.info('Added new Groups (%d)', len(self.groups))
 
                 # Set persistance state to True
@@ -584,6 +629,7 @@ class RouterPB(pb.Avatar):
 
                 # Adding new users
                 self.users = cf.getMigratedData()
+                self.reindexUsers()
                 self.log.info('Added new Users (%d)', len(self.users))
 
                 # Set persistance state to True
@@ -724,6 +770,7 @@ class RouterPB(pb.Avatar):
                 break
 
         self.users.append(user)
+        self.reindexUsers()
 
         # Set persistance state to False (pending for persistance)
         self.persistenceState['users'] = False
@@ -773,6 +820,7 @@ class RouterPB(pb.Avatar):
         for _user in self.users:
             if uid == _user.uid:
                 self.users.remove(_user)
+                self.reindexUsers()
 
                 # Set persistance state to False (pending for persistance)
                 self.persistenceState['users'] = False
@@ -785,6 +833,7 @@ class RouterPB(pb.Avatar):
         self.log.info('Removing all users')
 
         self.users = []
+        self.reindexUsers()
 
         # Set persistance state to False (pending for persistance)
         self.persistenceState['users'] = False
@@ -878,6 +927,7 @@ class RouterPB(pb.Avatar):
                 break
 
         self.groups.append(group)
+        self.reindexGroups()
 
         # Set persistance state to False (pending for persistance)
         self.persistenceState['groups'] = False
@@ -929,6 +979,8 @@ class RouterPB(pb.Avatar):
 
                 # Safely remove this group
                 self.groups.remove(_group)
+                self.reindexUsers()
+                self.reindexGroups()
                 return True
 
         self.log.error("Group with id:%s not found, not removing it.", gid)
@@ -955,6 +1007,8 @@ class RouterPB(pb.Avatar):
                     self.users.remove(_user)
 
         self.groups = []
+        self.reindexUsers()
+        self.reindexGroups()
 
         # Set persistance state to False (pending for persistance)
         self.persistenceState['groups'] = False
@@ -1,23 +1,27 @@
 import binascii
+import json
 import pickle
 import sys
 import logging
 from logging.handlers import TimedRotatingFileHandler
+from urllib.parse import urlparse
 
 from twisted.application.service import Service
 from twisted.internet import defer
 from twisted.internet import reactor
-from twisted.web.client import Agent
+from twisted.web.client import Agent, HTTPConnectionPool
 from txamqp.queue import Closed
 from treq.client import HTTPClient
 from treq import text_content
 from smpp.pdu.constants import priority_flag_name_map
 from smpp.pdu.pdu_encoding import DataCodingEncoder
 
+from jasmin.managers.content import decode_body
 from jasmin.protocols.smpp.factory import SMPPServerFactory
 from jasmin.protocols.smpp.operations import SMPPOperationFactory
 from jasmin.protocols.smpp.proxies import SMPPServerPBProxy
 from jasmin.protocols.http.errors import HttpApiError
+from jasmin.queues.retry import RetryScheduler, retries
 
 
 
@@ -55,8 +59,6 @@ class Thrower(Service):
     queueName = 'abstract_thrower'
     callback = None
     errback = None
-    requeueTimers = {}
-    throwing_retrials = {}
 
     def __init__(self, config):
         self.config = config
@@ -71,6 +73,18 @@ class Thrower(Service):
         self.smpps = None
         self.smpps_access = None
 
+        # Up to concurrency messages are thrown at once
+        self.throwing = 0
+        self.paused = False
+
+        # Http connections are kept alive and shared by all throws, at most
+        # http_concurrency_per_host requests are sent to the same host at once
+        self.pool = HTTPConnectionPool(reactor, persistent=True)
+        self.pool.maxPersistentPerHost = self.config.http_concurrency_per_host
+        self.pool.cachedConnectionTimeout = self.config.http_keepalive_timeout
+        self.http_client = HTTPClient(Agent(reactor, pool=self.pool))
+        self.hostSemaphores = {}
+
         # Set up a dedicated logger
         self.log = logging.getLogger(self.log_category)
         if len(self.log.handlers) != 1:
@@ -98,26 +112,49 @@ class Thrower(Service):
         self.log.info('Added a %s access to SMPPServerFactory', self.smpps_access)
 
     def getThrowingRetrials(self, message):
-        return self.throwing_retrials.get(message.content.properties['message-id'], 0)
+        """Return the current throwing try of message, retries are counted in its headers"""
+        return retries(message) + 1
 
-    def delThrowingRetrials(self, message):
-        if message.content.properties['message-id'] in self.throwing_retrials:
-            del self.throwing_retrials[message.content.properties['message-id']]
-            return True
-        else:
-            return False
+    def consume(self):
+        self.thrower_q.get().addCallback(self.throw).addErrback(self.errback)
 
-    def incThrowingRetrials(self, message):
-        if message.content.properties['message-id'] in self.throwing_retrials:
-            self.throwing_retrials[message.content.properties['message-id']] += 1
-        else:
-            self.throwing_retrials[message.content.properties['message-id']] = 1
+    def throw(self, message):
+        self.throwing += 1
+        return defer.maybeDeferred(self.callback, message).addBoth(self.thrown)
+
+    def thrown(self, result):
+        self.throwing -= 1
+
+        # Resume consuming if the concurrency limit was reached
+        if self.paused:
+            self.paused = False
+            self.consume()
+
+        return result
 
     def throwing_callback(self, message):
-        # Init retrial mechanism
-        self.incThrowingRetrials(message)
+        if self.throwing < self.config.concurrency:
+            self.consume()
+        else:
+            self.paused = True
 
-        self.thrower_q.get().addCallback(self.callback).addErrback(self.errback)
+    @defer.inlineCallbacks
+    def http_request(self, method, url, **kwargs):
+        """Send an http request through the connection pool and read its response, return a
+        (response, content) tuple
+        """
+        host = urlparse(url.decode() if isinstance(url, bytes) else url).netloc
+        if host not in self.hostSemaphores:
+            self.hostSemaphores[host] = defer.DeferredSemaphore(self.config.http_concurrency_per_host)
+
+        yield self.hostSemaphores[host].acquire()
+        try:
+            response = yield self.http_client.request(method, url, **kwargs)
+            content = yield text_content(response)
+        finally:
+            self.hostSemaphores[host].release()
+
+        defer.returnValue((response, content))
 
     def throwing_errback(self, error):
         """It appears that when closing a queue with the close() method it errbacks with
@@ -131,29 +168,13 @@ class Thrower(Service):
             # - an error has occured inside throwing_callback
             self.log.error("Error in throwing_errback_errback: %s", error)
 
-    def clearRequeueTimer(self, msgid):
-        if msgid in self.requeueTimers:
-            timer = self.requeueTimers[msgid]
-            if timer.active():
-                timer.cancel()
-            del self.requeueTimers[msgid]
-
-    def clearRequeueTimers(self):
-        for msgid, timer in list(self.requeueTimers.items()):
-            if timer.active():
-                timer.cancel()
-            del self.requeueTimers[msgid]
-
-    def clearAllTimers(self):
-        self.clearRequeueTimers()
-
     def startService(self):
         Service.startService(self)
 
     def stopService(self):
         Service.stopService(self)
 
-        self.clearAllTimers()
+        return self.pool.closeCachedConnections()
 
     @defer.inlineCallbacks
     def addAmqpBroker(self, amqpBroker):
@@ -172,11 +193,11 @@ class Thrower(Service):
         yield self.amqpBroker.chan.queue_bind(queue=self.queueName,
                                               exchange=self.exchangeName,
                                               routing_key=self.routingKey)
-        yield self.amqpBroker.chan.basic_consume(queue=self.queueName,
-                                                 no_ack=False,
-                                                 consumer_tag=self.consumerTag)
-        self.thrower_q = yield self.amqpBroker.client.queue(self.consumerTag)
-        self.thrower_q.get().addCallback(self.callback).addErrback(self.errback)
+        yield self.amqpBroker.consume(self.queueName, self.consumerTag,
+                                      self.amqpBroker.config.thrower_prefetch)
+        self.thrower_q = yield self.amqpBroker.queue(self.consumerTag)
+        self.retries = RetryScheduler(self.amqpBroker, self.queueName, self.log)
+        self.consume()
         self.log.info('Consuming from routing key: %s', self.routingKey)
 
     @defer.inlineCallbacks
@@ -186,36 +207,18 @@ class Thrower(Service):
         if delay:
             self.log.debug("Requeuing Content[%s] with delay: %s seconds",
                            msgid, self.config.retry_delay)
-
-            # Requeue the message with a delay
-            timer = reactor.callLater(self.config.retry_delay,
-                                      self.rejectMessage,
-                                      message=message,
-                                      requeue=1)
-
-            # If any, clear timer before setting a new one
-            self.clearRequeueTimer(msgid)
-
-            self.requeueTimers[msgid] = timer
-            defer.returnValue(timer)
+            yield self.retries.retry(message, self.config.retry_delay)
         else:
             self.log.debug("Requeuing Content[%s] without delay", msgid)
-            yield self.rejectMessage(message, requeue=1)
+            yield self.retries.retry(message)
 
     @defer.inlineCallbacks
     def rejectMessage(self, message, requeue=0):
-        if requeue == 0:
-            # Remove retrial tracker
-            self.delThrowingRetrials(message)
-
-        yield self.amqpBroker.chan.basic_reject(delivery_tag=message.delivery_tag, requeue=requeue)
+        yield self.amqpBroker.reject(message, requeue)
 
     @defer.inlineCallbacks
     def ackMessage(self, message):
-        # Remove retrial tracker
-        self.delThrowingRetrials(message)
-
-        yield self.amqpBroker.chan.basic_ack(message.delivery_tag)
+        yield self.amqpBroker.ack(message)
 
 
 class deliverSmThrower(Thrower):
@@ -236,12 +239,9 @@ class deliverSmThrower(Thrower):
         msgid = message.content.properties['message-id']
         route_type = message.content.properties['headers']['route-type']
         dcs = pickle.loads(message.content.properties['headers']['dst-connectors'])
-        RoutedDeliverSmContent = pickle.loads(message.content.body)
+        RoutedDeliverSmContent = decode_body(message.content)
         self.log.debug('Got one message (msgid:%s) to throw: %s', msgid, RoutedDeliverSmContent)
 
-        # If any, clear requeuing timer
-        self.clearRequeueTimer(msgid)
-
         if dcs[0]._type != 'http':
             self.log.error(
                 'Rejecting message [msgid:%s] because destination connector is not http (type were %s)',
@@ -311,9 +311,7 @@ class deliverSmThrower(Thrower):
                     postdata = args
 
                 self.log.debug('Calling %s with args %s using %s method.', dc.baseurl, args, _method)
-                agent = Agent(reactor)
-                client = HTTPClient(agent)
-                response = yield client.request(
+                response, content = yield self.http_request(
                     _method,
                     baseurl,
                     params=params,
@@ -324,9 +322,7 @@ class deliverSmThrower(Thrower):
                              'User-Agent': 'Jasmin gateway/1.0 deliverSmHttpThrower'})
                 self.log.info('Throwed message [msgid:%s] to connector (%s %s/%s)[cid:%s] using http to %s.',
                               msgid, route_type, counter, len(dcs), dc.cid, dc.baseurl)
-                
-                content = yield text_content(response)
-                
+
                 if response.code >= 400:
                     raise HttpApiError(response.code, content)
 
@@ -388,12 +384,9 @@ class deliverSmThrower(Thrower):
         route_type = message.content.properties['headers']['route-type']
         dcs = pickle.loads(message.content.properties['headers']['dst-connectors'])
         pdu = pickle.loads(message.content.body)
-        RoutedDeliverSmContent = pickle.loads(message.content.body)
+        RoutedDeliverSmContent = decode_body(message.content)
         self.log.debug('Got one message (msgid:%s) to throw: %s', msgid, RoutedDeliverSmContent)
 
-        # If any, clear requeuing timer
-        self.clearRequeueTimer(msgid)
-
         if dcs[0]._type != 'smpps':
             self.log.error(
                 'Rejecting message [msgid:%s] because destination connector is not smpps (type were %s)',
@@ -515,6 +508,15 @@ class DLRThrower(Thrower):
 
         Thrower.__init__(self, config)
 
+        # DLRs held for batching, per url
+        self.dlrBatches = {}
+        self.dlrBatchTimers = {}
+
+    def stopService(self):
+        self.clearDLRBatchTimers()
+
+        return Thrower.stopService(self)
+
     @defer.inlineCallbacks
     def http_dlr_callback(self, message):
         msgid = message.content.properties['message-id']
@@ -523,9 +525,6 @@ class DLRThrower(Thrower):
         level = message.content.properties['headers']['level']
         self.log.debug('Got one message (msgid:%s) to throw', msgid)
 
-        # If any, clear requeuing timer
-        self.clearRequeueTimer(msgid)
-
         # Build mandatory arguments
         args = {
             'id': msgid,
@@ -544,6 +543,10 @@ class DLRThrower(Thrower):
             args['err'] = message.content.properties['headers']['err']
             args['text'] = message.content.properties['headers']['text']
 
+        if method == 'BATCH':
+            self.batchDLR(message, url, args)
+            defer.returnValue(None)
+
         try:
             # Throw the message to http endpoint
             postdata = None
@@ -555,9 +558,7 @@ class DLRThrower(Thrower):
                 postdata = args
 
             self.log.debug('Calling %s with args %s using %s method.', baseurl, args, method)
-            agent = Agent(reactor)
-            client = HTTPClient(agent)
-            response = yield client.request(
+            response, content = yield self.http_request(
                 method,
                 baseurl,
                 params=params,
@@ -568,8 +569,6 @@ class DLRThrower(Thrower):
                          'User-Agent': 'Jasmin gateway/1.0 %s' % self.name})
             self.log.info('Throwed DLR [msgid:%s] to %s.', msgid, baseurl)
 
-            content = yield text_content(response)
-            
             if response.code >= 400:
                 raise HttpApiError(response.code, content)
 
@@ -583,23 +582,100 @@ class DLRThrower(Thrower):
             yield self.ackMessage(message)
         except Exception as e:
             self.log.error('Throwing HTTP/DLR [msgid:%s] to (%s): %r.', msgid, baseurl, e)
+            yield self.http_dlr_failed(message, e)
 
-            # List of errors after which, no further retrying shall be made
-            noRetryErrors = ['404']
+    @defer.inlineCallbacks
+    def http_dlr_failed(self, message, e):
+        msgid = message.content.properties['message-id']
 
-            # Requeue message for later retry
-            if (str(e) not in noRetryErrors
-                and self.getThrowingRetrials(message) <= self.config.max_retries):
-                self.log.debug('Message try-count is %s [msgid:%s]: requeuing',
-                               self.getThrowingRetrials(message), msgid)
-                yield self.rejectAndRequeueMessage(message)
-            elif str(e) in noRetryErrors:
-                self.log.warning('Message is no more processed after receiving "%s" error', str(e))
-                yield self.rejectMessage(message)
+        # List of errors after which, no further retrying shall be made
+        noRetryErrors = ['404']
+
+        # Requeue message for later retry
+        if (str(e) not in noRetryErrors
+            and self.getThrowingRetrials(message) <= self.config.max_retries):
+            self.log.debug('Message try-count is %s [msgid:%s]: requeuing',
+                           self.getThrowingRetrials(message), msgid)
+            yield self.rejectAndRequeueMessage(message)
+        elif str(e) in noRetryErrors:
+            self.log.warning('Message is no more processed after receiving "%s" error', str(e))
+            yield self.rejectMessage(message)
+        else:
+            self.log.warning('Message try-count is %s [msgid:%s]: purged from queue',
+                          self.getThrowingRetrials(message), msgid)
+            yield self.rejectMessage(message)
+
+    def batchDLR(self, message, url, args):
+        """Hold a DLR until http_batch_size DLRs are held for url or http_batch_delay seconds passed,
+        they are then thrown at once (c.f. flushDLRBatch())
+        """
+        if url not in self.dlrBatches:
+            self.dlrBatches[url] = []
+            self.dlrBatchTimers[url] = reactor.callLater(self.config.http_batch_delay, self.flushDLRBatch, url)
+
+        self.dlrBatches[url].append((message, args))
+        if len(self.dlrBatches[url]) >= self.config.http_batch_size:
+            self.flushDLRBatch(url)
+
+    def clearDLRBatchTimers(self):
+        for url, timer in list(self.dlrBatchTimers.items()):
+            if timer.active():
+                timer.cancel()
+            del self.dlrBatchTimers[url]
+
+        # Held DLRs are not acked, they will be delivered again by the broker
+        self.dlrBatches = {}
+
+    @defer.inlineCallbacks
+    def flushDLRBatch(self, url):
+        """Throw the DLRs held for url as one json array POST
+
+        The destination end acknowledges all DLRs by replying 'ACK/Jasmin' or only some of them by
+        replying a json array of their ids, other DLRs are retried.
+        """
+        timer = self.dlrBatchTimers.pop(url, None)
+        if timer is not None and timer.active():
+            timer.cancel()
+        batch = self.dlrBatches.pop(url, [])
+        if len(batch) == 0:
+            return
+
+        try:
+            self.log.debug('Calling %s with a batch of %s DLRs.', url, len(batch))
+            response, content = yield self.http_request(
+                'POST',
+                url,
+                data=json.dumps([args for _, args in batch], default=str),
+                timeout=self.config.timeout,
+                headers={'Content-Type': 'application/json',
+                         'Accept': 'text/plain, application/json',
+                         'User-Agent': 'Jasmin gateway/1.0 %s' % self.name})
+            self.log.info('Throwed a batch of %s DLRs to %s.', len(batch), url)
+
+            if response.code >= 400:
+                raise HttpApiError(response.code, content)
+
+            self.log.debug('Destination end replied to DLR batch: %r', content)
+            if content.strip() == 'ACK/Jasmin':
+                acked = set(args['id'] for _, args in batch)
             else:
-                self.log.warning('Message try-count is %s [msgid:%s]: purged from queue',
-                              self.getThrowingRetrials(message), msgid)
-                yield self.rejectMessage(message)
+                try:
+                    acked = set(json.loads(content))
+                except (ValueError, TypeError):
+                    acked = set()
+        except Exception as e:
+            self.log.error('Throwing HTTP/DLR batch of %s DLRs to (%s): %r.', len(batch), url, e)
+            for message, _ in batch:
+                yield self.http_dlr_failed(message, e)
+            return
+
+        for message, args in batch:
+            if args['id'] in acked:
+                yield self.ackMessage(message)
+            else:
+                self.log.error('Destination end did not acknowledge receipt of the DLR [msgid:%s]', args['id'])
+                yield self.http_dlr_failed(message, MessageAcknowledgementError(
+                    'Destination end did not acknowledge receipt of the DLR message.'))
 
     @defer.inlineCallbacks
     def smpp_dlr_callback(self, message):
@@ -620,9 +696,6 @@ class DLRThrower(Thrower):
             # If err is string then encode it to ascii
             err = err.encode('ascii')
 
-        # If any, clear requeuing timer
-        self.clearRequeueTimer(msgid)
-
         try:
             if self.smpps is None or self.smpps_access is None:
                 raise SmppsNotSetError()
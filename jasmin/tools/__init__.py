@@ -9,6 +9,10 @@ enum_mapping = dict([(str(value), value) for value in list(RegisteredDeliveryRec
 enum_name_mapping = dict([(value.name, value) for value in list(RegisteredDeliveryReceipt) + list(AddrNpi) + list(AddrTon)])
 
 def to_enum(str_val):
+    if not isinstance(str_val, str):
+        # Already decoded
+        return str_val
+
     try:
         return enum_mapping[str_val]
     except NameError:
@@ -0,0 +1,61 @@
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """A bounded key/value cache evicting least recently used keys first
+
+    Keys can optionally expire after ttl seconds, a max_keys of 0 (or lower) will
+    disable caching: nothing will be stored.
+    """
+
+    def __init__(self, max_keys, ttl=None):
+        self.max_keys = max_keys
+        self.ttl = ttl
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def get(self, key, default=None):
+        """Return key's value and mark it as recently used, default is returned if the key
+        is not found or expired
+        """
+        try:
+            value, expires_at = self._data[key]
+        except KeyError:
+            return default
+
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._data[key]
+            return default
+
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value, ttl=None):
+        """Store key's value, ttl will override the cache's default ttl for this key"""
+        if self.max_keys <= 0:
+            return
+
+        if ttl is None:
+            ttl = self.ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+
+        self._data[key] = (value, expires_at)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_keys:
+            self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        """Remove key and return its value"""
+        value = self.get(key, default)
+        self._data.pop(key, None)
+
+        return value
+
+    def clear(self):
+        self._data.clear()
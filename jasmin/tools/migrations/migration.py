@@ -129,6 +129,18 @@ def fix_user_filters_0109(data, context=None):
     return new_data
 
 
+def smppccs_submit_window_0110(data, context=None):
+    """Adding submit_sm_burst and max_pending_submits to smppccs, with defaults keeping the previous
+    behaviour"""
+    for smppcc in data:
+        if not hasattr(smppcc['config'], 'submit_sm_burst'):
+            smppcc['config'].submit_sm_burst = 1
+        if not hasattr(smppcc['config'], 'max_pending_submits'):
+            smppcc['config'].max_pending_submits = 1
+
+    return data
+
+
 """This is the main map for orchestrating config migrations.
 
 The map is based on 3 elements:
@@ -156,4 +168,7 @@ MAP = [
     {'conditions': ['<=0.10008'],
      'contexts': {'users'},
      'operations': [fix_user_filters_0109]},
+    {'conditions': ['<=0.11000'],
+     'contexts': {'smppccs'},
+     'operations': [smppccs_submit_window_0110]},
 ]
@@ -1,3 +1,5 @@
+from collections import deque
+
 from twisted.internet import defer, reactor
 
 
@@ -7,3 +9,103 @@ def slow_down(seconds):
     waitDeferred = defer.Deferred()
     reactor.callLater(seconds, waitDeferred.callback, None)
     yield waitDeferred
+
+
+class TokenBucket:
+    """Paces consumers to rate tokens per second, allowing bursts of up to burst tokens
+
+    consume() returns a deferred firing when a token is taken, waiting consumers are served in
+    order; a rate of 0 (or lower) means unlimited.
+    """
+
+    def __init__(self, rate, burst=1, clock=None):
+        self.clock = clock or reactor
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = self.clock.seconds()
+        self.waiting = deque()
+        self.timer = None
+
+    def set(self, rate, burst=1):
+        """Update rate and burst, applied to waiting consumers as well"""
+        if rate == self.rate and burst == self.burst:
+            return
+
+        self._refill()
+        self.rate = rate
+        self.burst = burst
+        self.tokens = min(self.tokens, burst)
+        if self.timer is not None and self.timer.active():
+            self.timer.cancel()
+        self.timer = None
+        self._serve()
+
+    def _refill(self):
+        now = self.clock.seconds()
+        if self.rate > 0:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def _serve(self):
+        self.timer = None
+        self._refill()
+
+        while len(self.waiting) > 0 and (self.rate <= 0 or self.tokens >= 1):
+            if self.rate > 0:
+                self.tokens -= 1
+            self.waiting.popleft().callback(None)
+
+        if len(self.waiting) > 0:
+            self.timer = self.clock.callLater((1 - self.tokens) / float(self.rate), self._serve)
+
+    def consume(self):
+        d = defer.Deferred()
+        self.waiting.append(d)
+        # When a timer is set, waiting consumers will be served when it fires
+        if self.timer is None:
+            self._serve()
+
+        return d
+
+    def flush(self):
+        """Cancel the timer and fire all waiting consumers"""
+        if self.timer is not None and self.timer.active():
+            self.timer.cancel()
+        self.timer = None
+
+        while len(self.waiting) > 0:
+            self.waiting.popleft().callback(None)
+
+
+class SendWindow:
+    """Limits the number of outstanding transactions to size
+
+    acquire() returns a deferred firing when a slot is free, every acquired slot must be
+    released.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.pending = 0
+        self.waiting = deque()
+
+    def _serve(self):
+        while len(self.waiting) > 0 and self.pending < self.size:
+            self.pending += 1
+            self.waiting.popleft().callback(None)
+
+    def resize(self, size):
+        self.size = size
+        self._serve()
+
+    def acquire(self):
+        d = defer.Deferred()
+        self.waiting.append(d)
+        self._serve()
+
+        return d
+
+    def release(self):
+        self.pending -= 1
+        self._serve()
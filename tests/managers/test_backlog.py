@@ -0,0 +1,104 @@
+import logging
+
+from twisted.internet import defer
+from twisted.trial.unittest import TestCase
+
+from jasmin.managers.backlog import BacklogMonitor
+
+
+class DeclareOk:
+    def __init__(self, message_count, consumer_count):
+        self.message_count = message_count
+        self.consumer_count = consumer_count
+
+
+class DummyChannel:
+    def __init__(self, depths):
+        self.depths = depths
+
+    def queue_declare(self, queue, passive):
+        if queue not in self.depths:
+            return defer.fail(Exception('NOT_FOUND - no queue %s' % queue))
+        return defer.succeed(DeclareOk(self.depths[queue], 1))
+
+
+class DummyBroker:
+    def __init__(self):
+        self.connected = True
+        self.chan = object()
+        self.depths = {}
+        self.opened = 0
+
+    def open_channel(self):
+        self.opened += 1
+        return defer.succeed(DummyChannel(self.depths))
+
+
+class BacklogMonitorTestCase(TestCase):
+    def setUp(self):
+        self.broker = DummyBroker()
+        self.queues = {'smppc_01': ['submit.sm.smppc_01']}
+        self.now = 0
+        self.monitor = BacklogMonitor(self.broker, lambda: self.queues, 5, logging.getLogger(),
+                                      clock=lambda: self.now)
+
+    @defer.inlineCallbacks
+    def poll(self, depth, at):
+        self.broker.depths['submit.sm.smppc_01'] = depth
+        self.now = at
+        yield self.monitor.poll()
+
+    @defer.inlineCallbacks
+    def test_drain_time(self):
+        yield self.poll(1000, 0)
+        # Drain rate is unknown yet
+        self.assertEqual(self.monitor.drain_time('smppc_01'), 0)
+
+        # 500 messages published, 1000 drained in 10 seconds
+        for _ in range(500):
+            self.monitor.published('smppc_01')
+        yield self.poll(500, 10)
+        self.assertEqual(self.monitor.drain_time('smppc_01'), 5)
+
+        yield self.poll(0, 20)
+        self.assertEqual(self.monitor.drain_time('smppc_01'), 0)
+
+    @defer.inlineCallbacks
+    def test_not_draining(self):
+        yield self.poll(10, 0)
+        yield self.poll(20, 5)
+        self.assertEqual(self.monitor.drain_time('smppc_01'), float('inf'))
+
+    @defer.inlineCallbacks
+    def test_retry_queues(self):
+        self.queues['smppc_01'].append('submit.sm.smppc_01.retry.10')
+        self.broker.depths['submit.sm.smppc_01.retry.10'] = 5
+        yield self.poll(10, 0)
+        self.assertEqual(self.monitor.backlogs['smppc_01'].depth, 15)
+
+    @defer.inlineCallbacks
+    def test_missing_queue(self):
+        self.queues['smppc_02'] = ['submit.sm.smppc_02']
+        yield self.poll(10, 0)
+        self.assertNotIn('smppc_02', self.monitor.backlogs)
+        self.assertEqual(self.monitor.backlogs['smppc_01'].depth, 10)
+        self.assertEqual(self.broker.opened, 1)
+
+        # The channel closed by the failed declaration is replaced
+        yield self.poll(10, 5)
+        self.assertEqual(self.broker.opened, 2)
+
+    @defer.inlineCallbacks
+    def test_removed_connector(self):
+        yield self.poll(10, 0)
+        del self.queues['smppc_01']
+        yield self.monitor.poll()
+        self.assertEqual(self.monitor.backlogs, {})
+        self.assertEqual(self.monitor.drain_time('smppc_01'), 0)
+
+    @defer.inlineCallbacks
+    def test_reconnected(self):
+        yield self.poll(10, 0)
+        self.broker.chan = object()
+        yield self.poll(10, 5)
+        self.assertEqual(self.broker.opened, 2)
@@ -7,11 +7,14 @@ from datetime import datetime
 
 from twisted.trial.unittest import TestCase
 
+from jasmin.managers import pducodec
 from jasmin.managers.content import (SubmitSmContent, SubmitSmRespContent,
                                      DeliverSmContent, SubmitSmRespBillContent,
                                      DLRContentForHttpapi, DLRContentForSmpps,
-                                     DLR, InvalidParameterError)
+                                     DLR, InvalidParameterError, decode_body)
+from jasmin.routing.Routables import RoutableDeliverSm
 from jasmin.routing.jasminApi import *
+from smpp.pdu.operations import DeliverSM, SubmitSMResp
 from smpp.pdu.pdu_types import AddrTon, AddrNpi, CommandId, CommandStatus
 
 
@@ -94,6 +97,13 @@ class SubmitSmRespContentTestCase(ContentTestCase):
         self.assertEqual(c['message-id'], 1)
         self.assertTrue('created_at' in c['headers'])
 
+    def test_smpp_encoding(self):
+        pdu = SubmitSMResp(seqNum=1, message_id='abc')
+        c = SubmitSmRespContent(pdu, 1, encoding='smpp')
+
+        self.assertEqual(c['content-type'], pducodec.CONTENT_TYPE)
+        self.assertEqual(decode_body(c), pdu)
+
 
 class DLRTestCase(ContentTestCase):
     def test_deliversm_and_datasm(self):
@@ -343,6 +353,21 @@ class DeliverSmContentTestCase(ContentTestCase):
         self.assertFalse(c['message-id'] == None)
         self.assertTrue('created_at' in c['headers'])
 
+    def test_smpp_encoding(self):
+        routable = RoutableDeliverSm(DeliverSM(seqNum=1, source_addr=b'123', destination_addr=b'456',
+                                               short_message=b'hello'), Connector('connector1'))
+        c = DeliverSmContent(routable, 'connector1', encoding='smpp')
+
+        self.assertEqual(c['content-type'], pducodec.CONTENT_TYPE)
+        self.assertEqual(decode_body(c).pdu, routable.pdu)
+
+    def test_smpp_encoding_fallback(self):
+        """Bodies that cannot be encoded as SMPP binary PDUs are pickled"""
+        c = DeliverSmContent(self.body, 'connector1', encoding='smpp')
+
+        self.assertNotIn('content-type', c.properties)
+        self.assertEqual(decode_body(c), self.body)
+
     def test_headers_concatenated(self):
         c = DeliverSmContent(self.body, 'connector1', prePickle=False, concatenated=True)
 
@@ -0,0 +1,163 @@
+from twisted.internet import defer
+from twisted.trial.unittest import TestCase
+from smpp.pdu.pdu_types import CommandId, CommandStatus
+
+from jasmin.managers.configs import DLRLookupConfig
+from jasmin.managers.content import DLR
+from jasmin.managers.dlr import DLRLookup, dlr_routing_key
+
+
+class DummyContent:
+    def __init__(self, msgid):
+        self.properties = {'message-id': msgid, 'headers': {}}
+
+
+class DummyMessage:
+    def __init__(self, msgid, routing_key='dlr.submit_sm_resp', content=None):
+        self.content = content or DummyContent(msgid)
+        self.routing_key = routing_key
+
+
+def submit_sm_resp_dlr(msgid, smpp_msgid):
+    return DLR(pdu_type=CommandId.submit_sm_resp, msgid=msgid, status=CommandStatus.ESME_ROK,
+               smpp_msgid=smpp_msgid)
+
+
+def deliver_sm_dlr(smpp_msgid):
+    # As coded by SMPPClientSMListener.code_dlr_msgid()
+    return DLR(pdu_type=CommandId.deliver_sm, msgid=smpp_msgid, status='DELIVRD', cid='abc',
+               dlr_details={'id': smpp_msgid, 'stat': 'DELIVRD'})
+
+
+class DummyQueue:
+    def __init__(self):
+        self.gets = 0
+
+    def get(self):
+        self.gets += 1
+        return defer.Deferred()
+
+
+class DLRRoutingKeyTestCase(TestCase):
+    def test_unsharded(self):
+        self.assertEqual(dlr_routing_key('submit_sm_resp', submit_sm_resp_dlr('abc', b'1')),
+                         'dlr.submit_sm_resp')
+
+    def test_sharded(self):
+        routing_key = dlr_routing_key('deliver_sm', deliver_sm_dlr('1F'), 4)
+        self.assertRegex(routing_key, r'^dlr\.[0-3]\.deliver_sm$')
+
+    def test_same_shard_for_one_message(self):
+        shards = set()
+        for i in range(32):
+            queue_msgid = 'queue-msgid-%s' % i
+            smpp_msgid = '%X' % (i + 1000)
+
+            submit_sm_resp_shard = dlr_routing_key(
+                'submit_sm_resp', submit_sm_resp_dlr(queue_msgid, b'00' + smpp_msgid.encode()), 4).split('.')[1]
+            deliver_sm_shard = dlr_routing_key('deliver_sm', deliver_sm_dlr(smpp_msgid), 4).split('.')[1]
+            self.assertEqual(submit_sm_resp_shard, deliver_sm_shard)
+            shards.add(deliver_sm_shard)
+
+        # Messages are still spread over the shards
+        self.assertGreater(len(shards), 1)
+
+    def test_failed_submit_sm_resp(self):
+        dlr = DLR(pdu_type=CommandId.submit_sm_resp, msgid='abc', status=CommandStatus.ESME_RSUBMITFAIL)
+        self.assertRegex(dlr_routing_key('submit_sm_resp', dlr, 4), r'^dlr\.[0-3]\.submit_sm_resp$')
+
+
+class DummyChannel:
+    def __init__(self):
+        self.bindings = []
+
+    def exchange_declare(self, **kwargs):
+        return defer.succeed(None)
+
+    def queue_bind(self, queue, exchange, routing_key):
+        self.bindings.append(routing_key)
+        return defer.succeed(None)
+
+
+class DummyBroker:
+    def __init__(self):
+        self.chan = DummyChannel()
+        self.config = DLRLookupConfig()
+        self.config.dlr_prefetch = 1
+
+    def named_queue_declare(self, queue):
+        return defer.succeed(None)
+
+    def consume(self, queue, consumerTag, prefetch):
+        return defer.succeed(None)
+
+    def queue(self, consumerTag):
+        return defer.Deferred()
+
+
+class DLRLookupSubscribeTestCase(TestCase):
+    def subscribe(self, shards):
+        config = DLRLookupConfig()
+        config.shards = shards
+        broker = DummyBroker()
+        self.successResultOf(DLRLookup(config, broker, None).subscribe())
+
+        return broker.chan.bindings
+
+    def test_all_shards(self):
+        self.assertEqual(self.subscribe([]), ['dlr.*', 'dlr.*.*'])
+
+    def test_some_shards(self):
+        self.assertEqual(self.subscribe([0, 2]), ['dlr.0.*', 'dlr.2.*'])
+
+
+class DLRLookupDispatchTestCase(TestCase):
+    def setUp(self):
+        config = DLRLookupConfig()
+        config.dlr_lookup_concurrency = 2
+        self.dlrlookup = DLRLookup(config, None, None)
+        self.dlrlookup.q = DummyQueue()
+
+        self.lookups = {}
+        self.dlrlookup.submit_sm_resp_dlr_callback = self.lookup
+        self.dlrlookup.deliver_sm_dlr_callback = self.lookup
+
+    def lookup(self, message):
+        d = defer.Deferred()
+        self.lookups.setdefault(message.content.properties['message-id'], []).append(d)
+        return d
+
+    def test_concurrency(self):
+        self.dlrlookup.dlr_callback_dispatcher(DummyMessage('a'))
+        self.dlrlookup.dlr_callback_dispatcher(DummyMessage('b'))
+        self.dlrlookup.dlr_callback_dispatcher(DummyMessage('c'))
+
+        # Third message waits for a free slot, no more messages are taken from the queue
+        self.assertEqual(sorted(self.lookups), ['a', 'b'])
+        self.assertEqual(self.dlrlookup.q.gets, 2)
+
+        self.lookups['a'][0].callback(None)
+        self.assertEqual(sorted(self.lookups), ['a', 'b', 'c'])
+        self.assertEqual(self.dlrlookup.q.gets, 3)
+
+    def test_same_msgid_in_order(self):
+        self.dlrlookup.dlr_callback_dispatcher(DummyMessage('a', 'dlr.0.deliver_sm'))
+        self.dlrlookup.dlr_callback_dispatcher(DummyMessage('a', 'dlr.0.deliver_sm'))
+        self.assertEqual(len(self.lookups['a']), 1)
+
+        self.lookups['a'][0].callback(None)
+        self.assertEqual(len(self.lookups['a']), 2)
+
+        self.lookups['a'][1].callback(None)
+        self.assertEqual(self.dlrlookup.lookups_by_msgid, {})
+        self.assertEqual(self.dlrlookup.lookups.pending, 0)
+
+    def test_same_message_dlrs_in_order(self):
+        # The receipt is looked up once the submit_sm_resp mapping its SMPP message id is done
+        self.dlrlookup.dlr_callback_dispatcher(DummyMessage(
+            None, 'dlr.0.submit_sm_resp', submit_sm_resp_dlr('a', b'1F')))
+        self.dlrlookup.dlr_callback_dispatcher(DummyMessage(None, 'dlr.0.deliver_sm', deliver_sm_dlr('1F')))
+        self.assertEqual(list(self.lookups), ['a'])
+
+        self.lookups['a'][0].callback(None)
+        self.assertEqual(list(self.lookups), ['a', '1F'])
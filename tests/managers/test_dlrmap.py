@@ -0,0 +1,58 @@
+from datetime import datetime
+
+from twisted.trial.unittest import TestCase
+from smpp.pdu.pdu_types import RegisteredDeliveryReceipt, AddrNpi, AddrTon
+
+from jasmin.managers import dlrmap
+
+
+class DLRMapEncodingTestCase(TestCase):
+    def test_httpapi(self):
+        _map = {'sc': 'httpapi', 'url': 'http://127.0.0.1/dlr', 'level': 3, 'method': 'POST',
+                'connector': 'smppc_01', 'expiry': 86400}
+
+        self.assertEqual(dlrmap.decode(dlrmap.encode(_map)), _map)
+
+    def test_smppsapi(self):
+        _map = {'sc': 'smppsapi', 'system_id': 'user_01',
+                'source_addr_ton': AddrTon.NATIONAL, 'source_addr_npi': AddrNpi.ISDN, 'source_addr': '4567',
+                'dest_addr_ton': AddrTon.INTERNATIONAL, 'dest_addr_npi': AddrNpi.ISDN,
+                'destination_addr': '0012345678', 'sub_date': datetime(2024, 5, 1, 10, 30, 5, 1234),
+                'rd_receipt': RegisteredDeliveryReceipt.SMSC_DELIVERY_RECEIPT_REQUESTED, 'expiry': 3600}
+
+        self.assertEqual(dlrmap.decode(dlrmap.encode(_map)), _map)
+
+    def test_bytes_and_none_strings(self):
+        _map = {'sc': 'smppsapi', 'system_id': 'user_01',
+                'source_addr_ton': AddrTon.UNKNOWN, 'source_addr_npi': AddrNpi.UNKNOWN, 'source_addr': None,
+                'dest_addr_ton': AddrTon.UNKNOWN, 'dest_addr_npi': AddrNpi.UNKNOWN,
+                'destination_addr': b'0012345678', 'sub_date': datetime.now(),
+                'rd_receipt': RegisteredDeliveryReceipt.SMSC_DELIVERY_RECEIPT_REQUESTED, 'expiry': 3600}
+        decoded = dlrmap.decode(dlrmap.encode(_map))
+
+        self.assertEqual(decoded['source_addr'], None)
+        self.assertEqual(decoded['destination_addr'], '0012345678')
+
+    def test_queue_msgid(self):
+        _map = {'msgid': '6e7f8a4d-1b3c-4f5e-9a0b-0123456789ab', 'connector_type': 'smppsapi'}
+
+        self.assertEqual(dlrmap.decode(dlrmap.encode(_map)), _map)
+
+    def test_decode_utf8_string(self):
+        """Redis client may return the encoded map as a string"""
+        _map = {'msgid': 'abc', 'connector_type': 'httpapi'}
+
+        self.assertEqual(dlrmap.decode(dlrmap.encode(_map).decode()), _map)
+
+    def test_compact(self):
+        _map = {'sc': 'httpapi', 'url': 'http://127.0.0.1/dlr', 'level': 1, 'method': 'GET',
+                'connector': 'smppc_01', 'expiry': 86400}
+
+        self.assertLess(len(dlrmap.encode(_map)), 50)
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, dlrmap.encode, {'sc': 'unknown'})
+        self.assertRaises(ValueError, dlrmap.decode, b'')
+        self.assertRaises(ValueError, dlrmap.decode, b'\x09\x01')
+        self.assertRaises(ValueError, dlrmap.decode, b'\x01\x09')
+        self.assertRaises(ValueError, dlrmap.decode, b'\x01\x01\x03')
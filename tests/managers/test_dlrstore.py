@@ -0,0 +1,106 @@
+import sqlite3
+
+from twisted.internet import defer, task
+from twisted.trial.unittest import TestCase
+from txredisapi import ResponseError
+
+from jasmin.managers import dlrmap
+from jasmin.managers.dlrstore import RedisDLRStore, SQLiteDLRStore
+
+HTTP_MAP = {'sc': 'httpapi', 'url': 'http://127.0.0.1/dlr', 'level': 3, 'method': 'POST',
+            'connector': 'smppc_01', 'expiry': 86400}
+
+
+class DummyRedisClient:
+    def __init__(self):
+        self.strings = {}
+        self.hashes = {}
+
+    def set_expire(self, key, value, expiry):
+        self.strings[key] = value
+        return defer.succeed(None)
+
+    def cached_get(self, key):
+        if key in self.hashes:
+            return defer.fail(ResponseError('WRONGTYPE Operation against a key holding the wrong kind of value'))
+        return defer.succeed(self.strings.get(key))
+
+    def hgetall(self, key):
+        return defer.succeed(self.hashes[key])
+
+    def batched_delete(self, key):
+        self.strings.pop(key, None)
+        return defer.succeed(None)
+
+
+class RedisDLRStoreTestCase(TestCase):
+    def setUp(self):
+        self.client = DummyRedisClient()
+        self.store = RedisDLRStore(self.client)
+
+    @defer.inlineCallbacks
+    def test_set_get_delete(self):
+        yield self.store.set('dlr:1', HTTP_MAP, 60)
+        self.assertEqual(self.client.strings['dlr:1'], dlrmap.encode(HTTP_MAP))
+
+        _map = yield self.store.get('dlr:1')
+        self.assertEqual(_map, HTTP_MAP)
+
+        yield self.store.delete('dlr:1')
+        _map = yield self.store.get('dlr:1')
+        self.assertEqual(_map, {})
+
+    @defer.inlineCallbacks
+    def test_legacy_hash(self):
+        self.client.hashes['dlr:1'] = {'sc': 'httpapi', 'url': 'http://127.0.0.1/dlr', 'level': 1}
+
+        _map = yield self.store.get('dlr:1')
+        self.assertEqual(_map['level'], 1)
+
+    def test_available(self):
+        self.assertTrue(self.store.available())
+        self.assertFalse(RedisDLRStore(None).available())
+
+
+class SQLiteDLRStoreTestCase(TestCase):
+    def setUp(self):
+        self.store = SQLiteDLRStore(self.mktemp())
+
+    def tearDown(self):
+        self.store.close()
+
+    @defer.inlineCallbacks
+    def test_set_get_delete(self):
+        yield self.store.set('dlr:1', HTTP_MAP, 60)
+        _map = yield self.store.get('dlr:1')
+        self.assertEqual(_map, HTTP_MAP)
+
+        yield self.store.set('queue-msgid:abc', {'msgid': '1', 'connector_type': 'httpapi'}, 60)
+        _map = yield self.store.get('queue-msgid:abc')
+        self.assertEqual(_map, {'msgid': '1', 'connector_type': 'httpapi'})
+
+        yield self.store.delete('dlr:1')
+        _map = yield self.store.get('dlr:1')
+        self.assertEqual(_map, {})
+
+    @defer.inlineCallbacks
+    def test_expiry(self):
+        yield self.store.set('dlr:1', HTTP_MAP, -1)
+        _map = yield self.store.get('dlr:1')
+        self.assertEqual(_map, {})
+
+        yield self.store.sweep()
+        rows = yield self.store.dbpool.runQuery('SELECT COUNT(*) FROM dlr_maps')
+        self.assertEqual(rows[0][0], 0)
+
+    def test_sweep_failure(self):
+        self.store.dbpool.runOperation = lambda *args: defer.fail(sqlite3.OperationalError('database is locked'))
+        clock = task.Clock()
+        sweeper = task.LoopingCall(self.store.sweep)
+        sweeper.clock = clock
+        sweeper.start(60, now=False)
+
+        with self.assertLogs('dlr', level='ERROR'):
+            clock.advance(60)
+        self.assertTrue(sweeper.running)
+        sweeper.stop()
@@ -0,0 +1,74 @@
+import pickle
+from datetime import datetime
+
+from twisted.trial.unittest import TestCase
+from smpp.pdu.operations import DeliverSM, SubmitSMResp
+
+from jasmin.managers import pducodec
+from jasmin.protocols.smpp.configs import SMPPClientConfig
+from jasmin.protocols.smpp.operations import SMPPOperationFactory
+from jasmin.routing.Routables import RoutableDeliverSm
+from jasmin.routing.jasminApi import Connector
+
+
+class PDUEncodingTestCase(TestCase):
+    def setUp(self):
+        self.opFactory = SMPPOperationFactory(SMPPClientConfig(id='test-id', long_content_split='udh'))
+
+    def assertSamePDUs(self, pdu, decoded):
+        while True:
+            self.assertEqual(decoded.commandId, pdu.commandId)
+            self.assertEqual(decoded.seqNum, pdu.seqNum)
+            self.assertEqual(decoded.params, pdu.params)
+            if not hasattr(pdu, 'nextPdu'):
+                self.assertFalse(hasattr(decoded, 'nextPdu'))
+                break
+            pdu, decoded = pdu.nextPdu, decoded.nextPdu
+
+    def test_submit_sm(self):
+        """Unset params, int data_coding and sequence number are restored"""
+        pdu = self.opFactory.SubmitSM(source_addr=None, destination_addr=b'0012345678',
+                                      short_message=b'hello world', data_coding=8)
+        self.assertEqual(pdu.seqNum, None)
+
+        self.assertSamePDUs(pdu, pducodec.decode(pducodec.encode(pdu)))
+
+    def test_long_submit_sm(self):
+        pdu = self.opFactory.SubmitSM(source_addr=b'4567', destination_addr=b'0012345678',
+                                      short_message=b'hello world' * 40)
+        self.assertTrue(hasattr(pdu, 'nextPdu'))
+
+        self.assertSamePDUs(pdu, pducodec.decode(pducodec.encode(pdu)))
+
+    def test_response(self):
+        pdu = SubmitSMResp(seqNum=10, message_id='abc')
+
+        self.assertSamePDUs(pdu, pducodec.decode(pducodec.encode(pdu)))
+
+    def test_routable(self):
+        routable = RoutableDeliverSm(DeliverSM(seqNum=5, source_addr=b'4567', destination_addr=b'0012345678',
+                                               short_message=b'hello'),
+                                     Connector('smppc_01'), datetime(2024, 5, 1, 10, 30, 5))
+        routable.addTag(10)
+        routable.addTag('vip')
+        decoded = pducodec.decode(pducodec.encode(routable))
+
+        self.assertIsInstance(decoded, RoutableDeliverSm)
+        self.assertSamePDUs(routable.pdu, decoded.pdu)
+        self.assertEqual(decoded.connector.cid, 'smppc_01')
+        self.assertEqual(decoded.datetime, routable.datetime)
+        self.assertEqual(decoded.getTags(), ['10', 'vip'])
+
+    def test_compact(self):
+        pdu = self.opFactory.SubmitSM(source_addr=b'4567', destination_addr=b'0012345678',
+                                      short_message=b'hello world')
+
+        self.assertLess(len(pducodec.encode(pdu)), len(pickle.dumps(pdu, 2)) / 4)
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, pducodec.encode, 'not a pdu')
+        self.assertRaises(ValueError, pducodec.encode, DeliverSM(seqNum=1, short_message=b'x' * 300))
+        self.assertRaises(ValueError, pducodec.decode, b'')
+        self.assertRaises(ValueError, pducodec.decode, b'\x09\x00\x00')
+        self.assertRaises(ValueError, pducodec.decode, b'\x01\x00\x00')
+        self.assertRaises(ValueError, pducodec.decode, b'\x01\x00\x00\x00\x00\x00\x20\x00')
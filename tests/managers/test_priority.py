@@ -0,0 +1,110 @@
+from twisted.internet import defer
+from twisted.trial.unittest import TestCase
+from smpp.pdu.operations import SubmitSM
+
+from jasmin.managers.clients import SMPPClientManagerPB
+from jasmin.managers.configs import SMPPClientPBConfig
+from jasmin.protocols.smpp.configs import SMPPClientConfig
+
+
+class DummyChannel:
+    def __init__(self, existing):
+        self.existing = existing
+        self.declared = []
+        self.closed = False
+
+    def queue_declare(self, queue, arguments):
+        if queue in self.existing and self.existing[queue] != arguments:
+            self.closed = True
+            return defer.fail(Exception('PRECONDITION_FAILED - inequivalent arg \'x-max-priority\''))
+
+        self.declared.append((queue, arguments))
+        return defer.succeed(None)
+
+    def channel_close(self):
+        self.closed = True
+        return defer.succeed(None)
+
+
+class DummyBroker:
+    connected = True
+
+    def __init__(self, existing=None):
+        self.existing = existing or {}
+        self.channels = []
+        self.declared = []
+        self.published = []
+
+    def open_channel(self):
+        self.channels.append(DummyChannel(self.existing))
+        return defer.succeed(self.channels[-1])
+
+    def named_queue_declare(self, **kwargs):
+        self.declared.append(kwargs)
+        return defer.succeed(None)
+
+    def publish(self, exchange, routing_key, content):
+        self.published.append(content)
+        return defer.succeed(None)
+
+
+class SubmitSmPriorityTestCase(TestCase):
+    def setUp(self):
+        config = SMPPClientPBConfig()
+        config.submit_sm_max_priority = 2
+        self.manager = SMPPClientManagerPB(config)
+
+    @defer.inlineCallbacks
+    def test_declare_arguments(self):
+        broker = DummyBroker()
+        self.manager.addAmqpBroker(broker)
+        yield self.manager.declareSubmitSmQueue('submit.sm.abc')
+
+        self.assertEqual(broker.channels[0].declared, [('submit.sm.abc', {'x-max-priority': 2})])
+        self.assertTrue(broker.channels[0].closed)
+        self.assertEqual(broker.declared, [{'queue': 'submit.sm.abc', 'arguments': {'x-max-priority': 2}}])
+
+    @defer.inlineCallbacks
+    def test_declare_no_priority(self):
+        self.manager.config.submit_sm_max_priority = 0
+        broker = DummyBroker()
+        self.manager.addAmqpBroker(broker)
+        yield self.manager.declareSubmitSmQueue('submit.sm.abc')
+
+        self.assertEqual(broker.declared, [{'queue': 'submit.sm.abc', 'arguments': {}}])
+
+    @defer.inlineCallbacks
+    def test_existing_queue_without_priority(self):
+        # Declared by a release (or a configuration) with no priority support
+        broker = DummyBroker({'submit.sm.abc': {}})
+        self.manager.addAmqpBroker(broker)
+        with self.assertLogs(self.manager.log.name, level='WARNING'):
+            yield self.manager.declareSubmitSmQueue('submit.sm.abc')
+
+        # Only the dedicated channel was closed by the broker, the queue is used as is
+        self.assertTrue(broker.channels[0].closed)
+        self.assertEqual(broker.declared, [{'queue': 'submit.sm.abc', 'passive': True}])
+
+    @defer.inlineCallbacks
+    def test_published_priority_range(self):
+        broker = DummyBroker()
+        self.manager.addAmqpBroker(broker)
+        self.manager.connectors.append({'id': 'abc', 'config': SMPPClientConfig(id='abc')})
+
+        for priority in [0, 1, 2, 3]:
+            yield self.manager.perspective_submit_sm(
+                uid=1, cid='abc', SubmitSmPDU=SubmitSM(source_addr=b'x', destination_addr=b'1',
+                                                       short_message=b'hello'),
+                submit_sm_bill=None, priority=priority, pickled=False)
+
+        self.assertEqual([c.properties['priority'] for c in broker.published], [0, 1, 2, 2])
+
+    def test_max_priority_config(self):
+        self.assertEqual(SMPPClientPBConfig().submit_sm_max_priority, 0)
+
+        # RabbitMQ supports priorities up to 255
+        for value, expected in [('10', 10), ('300', 255), ('-1', 0)]:
+            path = self.mktemp()
+            with open(path, 'w') as f:
+                f.write('[client-management]\nsubmit_sm_max_priority = %s\n' % value)
+            self.assertEqual(SMPPClientPBConfig(path).submit_sm_max_priority, expected)
@@ -177,6 +177,8 @@ class BasicTestCases(HappySMSCTestCase):
             r'dst_npi 1',
             r'trx_to 300',
             r'ssl no',
+            r'submit_burst 1',
+            r'max_pending 1',
         ]
         commands = [{'command': 'smppccm -s %s' % cid, 'expect': expectedList}]
         yield self._test(r'jcli : ', commands)
@@ -262,6 +264,8 @@ class BasicTestCases(HappySMSCTestCase):
             r'dst_npi 1',
             r'trx_to 300',
             r'ssl no',
+            r'submit_burst 1',
+            r'max_pending 1',
         ]
         commands = [{'command': 'smppccm -s %s' % cid, 'expect': expectedList}]
         yield self._test(r'jcli : ', commands)
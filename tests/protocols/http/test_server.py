@@ -1,16 +1,20 @@
 import json
-from datetime import datetime
+import logging
+from datetime import datetime, timedelta
 
-from twisted.internet import defer
+from twisted.internet import defer, reactor, task
 from twisted.trial.unittest import TestCase
 
+from jasmin.managers.backlog import Backlog, BacklogMonitor
 from jasmin.managers.clients import SMPPClientManagerPB
 from jasmin.managers.configs import SMPPClientPBConfig
 from jasmin.protocols.http.configs import HTTPApiConfig
 from jasmin.protocols.http.server import HTTPApi
 from jasmin.protocols.http.stats import HttpAPIStatsCollector
-from jasmin.routing.Filters import GroupFilter
-from jasmin.routing.Routes import DefaultRoute, StaticMTRoute
+from jasmin.protocols.smpp.configs import SMPPClientConfig
+from jasmin.queues.publish import PublishError
+from jasmin.routing.Filters import GroupFilter, DestinationAddrFilter
+from jasmin.routing.Routes import DefaultRoute, StaticMTRoute, FailoverMTRoute
 from jasmin.routing.router import RouterPB
 from jasmin.routing.configs import RouterPBConfig
 from jasmin.routing.jasminApi import User, Group, SmppClientConnector
@@ -28,15 +32,17 @@ class HTTPApiTestCases(TestCase):
         self.u1 = User(1, self.g1, 'nathalie', 'correct')
         self.RouterPB_f.groups.append(self.g1)
         self.RouterPB_f.users.append(self.u1)
+        self.RouterPB_f.reindexGroups()
+        self.RouterPB_f.reindexUsers()
         self.RouterPB_f.mt_routing_table.add(DefaultRoute(SmppClientConnector('abc')), 0)
 
         # Instanciate a SMPPClientManagerPB (a requirement for HTTPApi)
         SMPPClientPBConfigInstance = SMPPClientPBConfig()
         SMPPClientPBConfigInstance.authentication = False
-        clientManager_f = SMPPClientManagerPB(SMPPClientPBConfigInstance)
+        self.clientManager_f = SMPPClientManagerPB(SMPPClientPBConfigInstance)
 
         httpApiConfigInstance = HTTPApiConfig()
-        self.web = DummySite(HTTPApi(self.RouterPB_f, clientManager_f, httpApiConfigInstance))
+        self.web = DummySite(HTTPApi(self.RouterPB_f, self.clientManager_f, httpApiConfigInstance))
 
     def tearDown(self):
         self.RouterPB_f.cancelPersistenceTimer()
@@ -413,6 +419,278 @@ class SendTestCases(HTTPApiTestCases):
             self.assertEqual(response.value()[:22], b"Error \"Argument [sdt] ")
 
 
+class SendBatchTestCases(HTTPApiTestCases):
+    def setUp(self):
+        HTTPApiTestCases.setUp(self)
+
+        # Provision Router with a user having a limited balance and a rated route
+        u2 = User(2, self.g1, 'user2', 'correct')
+        u2.mt_credential.setQuota('balance', 2.0)
+        self.RouterPB_f.users.append(u2)
+        self.RouterPB_f.reindexUsers()
+        route = StaticMTRoute([DestinationAddrFilter(r'^99')], SmppClientConnector('abc'), 1.0)
+        self.RouterPB_f.mt_routing_table.add(route, 2)
+
+    def post_batch(self, batch):
+        return self.web.post(b'send/batch', json_data=batch, headers={b'Content-type': [b'application/json']})
+
+    @defer.inlineCallbacks
+    def test_get_not_allowed(self):
+        response = yield self.web.get(b'send/batch')
+        self.assertEqual(response.responseCode, 405)
+
+    @defer.inlineCallbacks
+    def test_authentication_failure(self):
+        response = yield self.post_batch({'username': 'nathalie', 'password': 'incorrec',
+                                          'messages': [{'to': '06155423', 'content': 'hello'}]})
+        self.assertEqual(response.responseCode, 403)
+        self.assertEqual(json.loads(response.value()), 'Authentication failure for username:nathalie')
+
+    @defer.inlineCallbacks
+    def test_missing_credentials(self):
+        response = yield self.post_batch({'username': 'nathalie',
+                                          'messages': [{'to': '06155423', 'content': 'hello'}]})
+        self.assertEqual(response.responseCode, 400)
+        self.assertEqual(json.loads(response.value()), 'Mandatory argument [password] is not found.')
+
+    @defer.inlineCallbacks
+    def test_empty_batch(self):
+        response = yield self.post_batch({'username': 'nathalie', 'password': 'correct', 'messages': []})
+        self.assertEqual(response.responseCode, 400)
+        self.assertEqual(json.loads(response.value()), 'Batch must have a non empty list of messages.')
+
+    @defer.inlineCallbacks
+    def test_batch_too_large(self):
+        messages = [{'to': '06155423', 'content': 'hello'}] * (self.web.resource.children[b'send'].children[
+            b'batch'].config.batch_max_messages + 1)
+        response = yield self.post_batch({'username': 'nathalie', 'password': 'correct', 'messages': messages})
+        self.assertEqual(response.responseCode, 400)
+
+    @defer.inlineCallbacks
+    def test_per_message_results(self):
+        cnx_status = self.RouterPB_f.getUser(1).getCnxStatus()
+        request_count = cnx_status.httpapi['submit_sm_request_count']
+        response = yield self.post_batch({'username': 'nathalie', 'password': 'correct',
+                                          'globals': {'content': 'hello'},
+                                          'messages': [{'to': '06155423'},
+                                                       {'to': 'abc'},
+                                                       {'to': '06155424', 'hex-content': '00', 'content': None}]})
+        self.assertEqual(response.responseCode, 200)
+        results = json.loads(response.value())
+        self.assertEqual(len(results), 3)
+        # This is a normal error since SMPPClientManagerPB is not really running
+        self.assertEqual(results[0], {'status': 500,
+                                      'return': 'Cannot send submit_sm, check SMPPClientManagerPB log file for details'})
+        self.assertEqual(results[1], {'status': 400, 'return': 'Argument [to] has an invalid value: [abc].'})
+        self.assertEqual(results[2]['status'], 400)
+        self.assertEqual(cnx_status.httpapi['submit_sm_request_count'], request_count + 3)
+
+    @defer.inlineCallbacks
+    def test_content_type_parameters(self):
+        response = yield self.web.post(b'send/batch', json_data={'username': 'nathalie', 'password': 'incorrec',
+                                                                 'messages': [{'to': '06155423', 'content': 'hello'}]},
+                                       headers={b'Content-type': [b'application/json; charset=utf-8']})
+        self.assertEqual(response.responseCode, 403)
+
+        response = yield self.web.post(b'send/batch', json_data={'username': 'nathalie', 'password': 'incorrec',
+                                                                 'messages': [{'to': '06155423', 'content': 'hello'}]},
+                                       headers={b'Content-type': [b'text/plain']})
+        self.assertEqual(response.responseCode, 400)
+
+    @defer.inlineCallbacks
+    def test_invalid_value_types(self):
+        response = yield self.post_batch({'username': 'nathalie', 'password': 'correct',
+                                          'messages': [{'to': '06155423', 'content': True},
+                                                       {'to': ['06155423'], 'content': 'hello'}]})
+        self.assertEqual(response.responseCode, 200)
+        results = json.loads(response.value())
+        self.assertEqual(results[0], {'status': 400, 'return': 'Argument [content] has an invalid value: [true].'})
+        self.assertEqual(results[1], {'status': 400, 'return': 'Argument [to] has an invalid value: [["06155423"]].'})
+
+    @defer.inlineCallbacks
+    def test_batch_charged_atomically(self):
+        # Three rated messages cannot be paid with a balance of 2: nothing is charged
+        response = yield self.post_batch({'username': 'user2', 'password': 'correct',
+                                          'messages': [{'to': '9911', 'content': 'hello'}] * 3})
+        self.assertEqual(response.responseCode, 403)
+        self.assertEqual(json.loads(response.value()), 'Cannot charge submit_sm, check RouterPB log file for details')
+        self.assertEqual(self.RouterPB_f.getUser(2).mt_credential.getQuota('balance'), 2)
+
+        # Two rated messages are charged together
+        response = yield self.post_batch({'username': 'user2', 'password': 'correct',
+                                          'messages': [{'to': '9911', 'content': 'hello'}] * 2})
+        self.assertEqual(response.responseCode, 200)
+        self.assertEqual(self.RouterPB_f.getUser(2).mt_credential.getQuota('balance'), 0)
+
+    @defer.inlineCallbacks
+    def test_batch_throttled_per_message(self):
+        # 1 message per second: a batch of 3 messages delays the next request by 3 seconds
+        self.RouterPB_f.getUser(1).mt_credential.setQuota('http_throughput', 1)
+        self.RouterPB_f.getUser(1).getCnxStatus().httpapi['qos_last_submit_sm_at'] = 0
+        batch = {'username': 'nathalie', 'password': 'correct',
+                 'messages': [{'to': '06155423', 'content': 'hello'}] * 3}
+
+        response = yield self.post_batch(batch)
+        self.assertEqual(response.responseCode, 200)
+        last_submit_sm_at = self.RouterPB_f.getUser(1).getCnxStatus().httpapi['qos_last_submit_sm_at']
+        self.assertGreater(last_submit_sm_at, datetime.now() + timedelta(seconds=1))
+
+        response = yield self.post_batch(batch)
+        self.assertEqual(response.responseCode, 403)
+        self.assertEqual(json.loads(response.value()), 'User throughput exceeded')
+
+    @defer.inlineCallbacks
+    def test_invalid_messages_not_throttled(self):
+        # Only the valid message is accounted: the next request is accepted one second later
+        self.RouterPB_f.getUser(1).mt_credential.setQuota('http_throughput', 1)
+        self.RouterPB_f.getUser(1).getCnxStatus().httpapi['qos_last_submit_sm_at'] = 0
+        response = yield self.post_batch({'username': 'nathalie', 'password': 'correct',
+                                          'messages': [{'to': '06155423', 'content': 'hello'}] +
+                                                      [{'to': 'abc', 'content': 'hello'}] * 5})
+        self.assertEqual(response.responseCode, 200)
+        last_submit_sm_at = self.RouterPB_f.getUser(1).getCnxStatus().httpapi['qos_last_submit_sm_at']
+        self.assertLess(last_submit_sm_at, datetime.now() + timedelta(seconds=1))
+
+        # A batch without any valid message is not throttled
+        self.RouterPB_f.getUser(1).getCnxStatus().httpapi['qos_last_submit_sm_at'] = 0
+        response = yield self.post_batch({'username': 'nathalie', 'password': 'correct',
+                                          'messages': [{'to': 'abc', 'content': 'hello'}]})
+        self.assertEqual(response.responseCode, 200)
+        self.assertEqual(self.RouterPB_f.getUser(1).getCnxStatus().httpapi['qos_last_submit_sm_at'], 0)
+
+
+class ConfirmingBroker:
+    """Holds published messages until the test confirms them"""
+
+    connected = True
+
+    def __init__(self):
+        self.confirms = []
+
+    def publish(self, exchange, routing_key, content):
+        d = defer.Deferred()
+        self.confirms.append(d)
+        return d
+
+
+class PublishConfirmTestCases(HTTPApiTestCases):
+    username = 'nathalie'
+
+    def setUp(self):
+        HTTPApiTestCases.setUp(self)
+
+        self.broker = ConfirmingBroker()
+        self.clientManager_f.addAmqpBroker(self.broker)
+        self.clientManager_f.connectors.append({'id': 'abc', 'config': SMPPClientConfig(id='abc')})
+
+    def send(self):
+        return self.web.post(b'send', {b'username': self.username,
+                                       b'password': b'correct',
+                                       b'to': b'06155423',
+                                       b'content': 'anycontent'})
+
+    def routed(self):
+        """Routing is continued in the next reactor iteration"""
+        return task.deferLater(reactor, 0, lambda: None)
+
+    @defer.inlineCallbacks
+    def test_confirmed(self):
+        d = self.send()
+        yield self.routed()
+        # The response waits for the broker confirmation
+        self.assertNoResult(d)
+        self.assertEqual(len(self.broker.confirms), 1)
+
+        self.broker.confirms[0].callback(None)
+        response = yield d
+        self.assertEqual(response.responseCode, 200)
+        self.assertTrue(response.value().startswith(b'Success "'))
+
+    @defer.inlineCallbacks
+    def test_nacked(self):
+        d = self.send()
+        yield self.routed()
+        self.assertNoResult(d)
+
+        self.broker.confirms[0].errback(PublishError('Message nacked by the broker'))
+        response = yield d
+        self.assertEqual(response.responseCode, 500)
+        self.assertEqual(response.value(),
+                         b"Error \"Cannot send submit_sm, check SMPPClientManagerPB log file for details\"")
+
+
+class BacklogTestCases(HTTPApiTestCases):
+    username = 'nathalie'
+
+    def setUp(self):
+        HTTPApiTestCases.setUp(self)
+
+        # Admission control without polling: backlogs are set by the tests
+        self.clientManager_f.config.submit_sm_max_drain_time = 60
+        self.clientManager_f.backlog = BacklogMonitor(None, lambda: {}, 5, logging.getLogger())
+
+        HttpAPIStatsCollector().get().init()
+
+    def set_backlog(self, cid, *depths):
+        """Set the backlog of cid as if its depths were polled every 10 seconds"""
+        backlog = Backlog()
+        for i, depth in enumerate(depths):
+            backlog.update(depth, 1, i * 10)
+        self.clientManager_f.backlog.backlogs[cid] = backlog
+
+    def send(self, to=b'06155423'):
+        return self.web.post(b'send', {b'username': self.username,
+                                       b'password': b'correct',
+                                       b'to': to,
+                                       b'content': 'anycontent'})
+
+    @defer.inlineCallbacks
+    def test_drain_time_exceeded(self):
+        # 10 messages drained per second, 90 seconds to drain 900 messages
+        self.set_backlog('abc', 1000, 900)
+
+        response = yield self.send()
+        self.assertEqual(response.responseCode, 429)
+        self.assertEqual(response.value(), b'Error "Connector backlog exceeded"')
+        self.assertEqual(HttpAPIStatsCollector().get().get('throughput_error_count'), 1)
+
+    @defer.inlineCallbacks
+    def test_not_draining(self):
+        # A connector that does not drain its queue is refused whatever its depth is
+        self.set_backlog('abc', 1, 1)
+
+        response = yield self.send()
+        self.assertEqual(response.responseCode, 429)
+
+    @defer.inlineCallbacks
+    def test_drain_time_below_limit(self):
+        # 50 messages drained per second, 10 seconds to drain 500 messages
+        self.set_backlog('abc', 1000, 500)
+
+        response = yield self.send()
+        # This is a normal error since SMPPClientManagerPB is not really running
+        self.assertEqual(response.responseCode, 500)
+
+    @defer.inlineCallbacks
+    def test_failover(self):
+        route = FailoverMTRoute([DestinationAddrFilter(r'^99')],
+                                [SmppClientConnector('abc'), SmppClientConnector('def')], 0.0)
+        self.RouterPB_f.mt_routing_table.add(route, 2)
+        self.clientManager_f.perspective_connector_details = lambda cid: {'session_state': 'BOUND_TRX'}
+        self.clientManager_f.perspective_submit_sm = lambda cid, **kw: defer.succeed('%s-msgid' % cid)
+        self.set_backlog('abc', 1, 1)
+
+        # abc is skipped
+        response = yield self.send(b'9911')
+        self.assertEqual(response.responseCode, 200)
+        self.assertEqual(response.value(), b'Success "def-msgid"')
+
+        # No connector is left
+        self.set_backlog('def', 1, 1)
+        response = yield self.send(b'9911')
+        self.assertEqual(response.responseCode, 429)
+
+
 class RateTestCases(HTTPApiTestCases):
     def setUp(self):
         HTTPApiTestCases.setUp(self)
@@ -423,6 +701,7 @@ class RateTestCases(HTTPApiTestCases):
         u3.mt_credential.setQuota('balance', 10)
         self.RouterPB_f.users.append(u2)
         self.RouterPB_f.users.append(u3)
+        self.RouterPB_f.reindexUsers()
         filters = [GroupFilter(Group(2))]
         route = StaticMTRoute(filters, SmppClientConnector('abc'), 1.5)
         self.RouterPB_f.mt_routing_table.add(route, 2)
@@ -522,6 +801,7 @@ class BalanceTestCases(HTTPApiTestCases):
         u3.mt_credential.setQuota('balance', 10)
         self.RouterPB_f.users.append(u2)
         self.RouterPB_f.users.append(u3)
+        self.RouterPB_f.reindexUsers()
 
     @defer.inlineCallbacks
     def test_balance_with_correct_args(self):
@@ -0,0 +1,46 @@
+from twisted.trial.unittest import TestCase
+
+from jasmin.protocols.rest.api import JasminHttpApiProxy
+from jasmin.tools.cache import LRUCache
+
+
+class CountingProxy(JasminHttpApiProxy):
+    """Counts calls to Jasmin http api instead of calling it"""
+
+    def __init__(self):
+        self.calls = []
+        self.auth_cache = LRUCache(10, ttl=10)
+
+    def call_jasmin(self, url, params=None):
+        self.calls.append((url, params))
+        if params['password'] == 'correct':
+            return 200, '{"balance": 10}'
+        else:
+            return 403, 'Authentication failure'
+
+
+class AuthenticationCacheTestCase(TestCase):
+    def setUp(self):
+        self.proxy = CountingProxy()
+
+    def test_cached_authentication(self):
+        self.assertTrue(self.proxy.authenticate('foo', 'correct'))
+        self.assertTrue(self.proxy.authenticate('foo', 'correct'))
+        self.assertEqual(len(self.proxy.calls), 1)
+
+    def test_failed_authentication_not_cached(self):
+        self.assertFalse(self.proxy.authenticate('foo', 'incorrect'))
+        self.assertFalse(self.proxy.authenticate('foo', 'incorrect'))
+        self.assertEqual(len(self.proxy.calls), 2)
+
+    def test_password_is_part_of_key(self):
+        self.assertTrue(self.proxy.authenticate('foo', 'correct'))
+        self.assertFalse(self.proxy.authenticate('foo', 'incorrect'))
+        self.assertEqual(len(self.proxy.calls), 2)
+
+    def test_expiry(self):
+        self.proxy.auth_cache = LRUCache(10, ttl=0)
+
+        self.assertTrue(self.proxy.authenticate('foo', 'correct'))
+        self.assertTrue(self.proxy.authenticate('foo', 'correct'))
+        self.assertEqual(len(self.proxy.calls), 2)
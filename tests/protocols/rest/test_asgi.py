@@ -0,0 +1,74 @@
+import base64
+import json
+
+import httpx
+from falcon import testing
+from twisted.trial.unittest import TestCase
+
+from jasmin.protocols.rest.asgi import app, AsyncJasminHttpApiProxy
+from jasmin.tools.cache import LRUCache
+
+
+class AsgiTestCase(TestCase):
+    def setUp(self):
+        self.calls = []
+        AsyncJasminHttpApiProxy.client = httpx.AsyncClient(transport=httpx.MockTransport(self.jasmin_httpapi))
+        AsyncJasminHttpApiProxy.auth_cache = LRUCache(10, ttl=10)
+        self.client = testing.TestClient(app)
+
+    def tearDown(self):
+        AsyncJasminHttpApiProxy.client = None
+
+    def jasmin_httpapi(self, request):
+        """Replies the way Jasmin's http api does"""
+        self.calls.append(request)
+        if request.url.path == '/ping':
+            return httpx.Response(200, text='Jasmin/PONG')
+        elif request.url.params.get('password') != 'bar':
+            return httpx.Response(403, text='"Authentication failure for username:foo"')
+        elif request.url.path == '/balance':
+            return httpx.Response(200, text='{"balance": 10, "sms_count": "ND"}')
+        elif request.url.path == '/send':
+            return httpx.Response(200, text='Success "%s"' % request.url.params.get('to'))
+
+    def headers(self, password='bar'):
+        return {'Authorization': 'Basic %s' % base64.b64encode(('foo:%s' % password).encode()).decode()}
+
+    def test_ping(self):
+        response = self.client.simulate_get('/ping')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json, {'data': 'Jasmin/PONG'})
+        self.assertEqual(response.headers['content-type'], 'application/json')
+
+    def test_authentication_required(self):
+        response = self.client.simulate_get('/secure/balance')
+
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(len(self.calls), 0)
+
+    def test_balance(self):
+        response = self.client.simulate_get('/secure/balance', headers=self.headers())
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json, {'data': {'balance': 10, 'sms_count': 'ND'}})
+
+    def test_balance_authentication_failure(self):
+        response = self.client.simulate_get('/secure/balance', headers=self.headers('wrong'))
+
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(json.loads(response.text), {'message': 'Authentication failure for username:foo'})
+
+    def test_send(self):
+        response = self.client.simulate_post('/secure/send', headers=self.headers(),
+                                             body=json.dumps({'to': '06155423', 'content': 'hello',
+                                                              'dlr_level': 3}))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json, {'data': 'Success "06155423'})
+        self.assertEqual(self.calls[0].url.params.get('dlr-level'), '3')
+
+    def test_send_unparseable(self):
+        response = self.client.simulate_post('/secure/send', headers=self.headers(), body='{')
+
+        self.assertEqual(response.status_code, 412)
@@ -0,0 +1,127 @@
+import json
+import os
+
+from twisted.trial.unittest import TestCase
+
+from jasmin.protocols.rest.tasks import TokenBucket, JasminTask
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class TokenBucketTestCase(TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.limiter = TokenBucket(clock=self.clock)
+
+    def test_burst(self):
+        for i in range(5):
+            self.assertEqual(self.limiter.acquire([('global', 5, 5)]), 0)
+
+        self.assertAlmostEqual(self.limiter.acquire([('global', 5, 5)]), 0.2)
+
+    def test_refill(self):
+        for i in range(2):
+            self.limiter.acquire([('global', 2, 2)])
+        self.assertAlmostEqual(self.limiter.acquire([('global', 2, 2)]), 0.5)
+
+        self.clock.now = 0.5
+        self.assertEqual(self.limiter.acquire([('global', 2, 2)]), 0)
+        self.assertGreater(self.limiter.acquire([('global', 2, 2)]), 0)
+
+        # Bucket cannot hold more than burst tokens
+        self.clock.now = 100
+        for i in range(2):
+            self.assertEqual(self.limiter.acquire([('global', 2, 2)]), 0)
+        self.assertGreater(self.limiter.acquire([('global', 2, 2)]), 0)
+
+    def test_all_or_nothing(self):
+        """No token is taken from any bucket if one of them is empty"""
+        self.assertEqual(self.limiter.acquire([('user:foo', 1, 1)]), 0)
+
+        self.assertGreater(self.limiter.acquire([('global', 10, 10), ('user:foo', 1, 1)]), 0)
+        self.assertEqual(self.limiter.buckets['global'][0], 10)
+
+        self.assertEqual(self.limiter.acquire([('global', 10, 10), ('user:bar', 1, 1)]), 0)
+        self.assertEqual(self.limiter.buckets['global'][0], 9)
+
+
+class ThrottleTestCase(TestCase):
+    def setUp(self):
+        self.task = JasminTask()
+        self.task.limiter = TokenBucket(clock=Clock())
+
+    def test_disabled(self):
+        config = {'throughput': 0, 'smart_qos': False}
+        for i in range(100):
+            self.assertEqual(self.task.throttle('foo', config), 0)
+
+    def test_per_user(self):
+        config = {'throughput': 0, 'smart_qos': False, 'global_throughput': 0, 'user_throughput': 1}
+
+        self.assertEqual(self.task.throttle('foo', config), 0)
+        self.assertGreater(self.task.throttle('foo', config), 0)
+        self.assertEqual(self.task.throttle('bar', config), 0)
+
+    def test_global(self):
+        config = {'throughput': 0, 'smart_qos': False, 'global_throughput': 1, 'user_throughput': 10}
+
+        self.assertEqual(self.task.throttle('foo', config), 0)
+        self.assertGreater(self.task.throttle('bar', config), 0)
+
+
+class HttpApiResponse:
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.text = json.dumps(body)
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class HttpApiSession:
+    """Replies to /send/batch calls the way Jasmin's http api does"""
+
+    def __init__(self, response):
+        self.response = response
+        self.posts = []
+
+    def post(self, url, json=None, timeout=None):
+        self.posts.append((url, json))
+        return self.response
+
+
+class SendBatchTestCase(TestCase):
+    def setUp(self):
+        self.task = JasminTask()
+        self.credentials = {'username': 'foo', 'password': 'bar'}
+        self.messages = [{'username': 'foo', 'password': 'bar', 'to': '1', 'content': 'hello'},
+                         {'username': 'foo', 'password': 'bar', 'to': '2', 'content': 'hello'}]
+
+    def test_send_batch(self):
+        self.task._session = HttpApiSession(HttpApiResponse(200, [
+            {'status': 200, 'return': 'd5c3c1a4'},
+            {'status': 400, 'return': 'Argument [to] has an invalid value: [2].'}]))
+        self.task._session_pid = os.getpid()
+
+        results = self.task.send_batch('b1', self.credentials, self.messages)
+
+        self.assertEqual(results, [(1, 'Success "d5c3c1a4"'),
+                                   (0, 'HTTPAPI error: Argument [to] has an invalid value: [2].')])
+        url, body = self.task._session.posts[0]
+        self.assertTrue(url.endswith('/send/batch'))
+        self.assertEqual(body, {'username': 'foo', 'password': 'bar',
+                                'messages': [{'to': '1', 'content': 'hello'}, {'to': '2', 'content': 'hello'}]})
+
+    def test_send_batch_rejected(self):
+        self.task._session = HttpApiSession(HttpApiResponse(403, 'Authentication failure for username:foo'))
+        self.task._session_pid = os.getpid()
+
+        results = self.task.send_batch('b1', self.credentials, self.messages)
+
+        self.assertEqual(results, [(0, 'HTTPAPI error: Authentication failure for username:foo')] * 2)
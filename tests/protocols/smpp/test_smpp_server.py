@@ -10,10 +10,15 @@ from unittest.mock import Mock
 from twisted.cred import portal
 from twisted.trial.unittest import TestCase
 
+from jasmin.managers.backlog import Backlog, BacklogMonitor
+from jasmin.managers.clients import SMPPClientManagerPB
+from jasmin.managers.configs import SMPPClientPBConfig
 from jasmin.protocols.smpp.configs import SMPPServerConfig, SMPPClientConfig
 from jasmin.protocols.smpp.factory import SMPPServerFactory, SMPPClientFactory
 from jasmin.protocols.smpp.protocol import *
 from jasmin.protocols.smpp.stats import SMPPServerStatsCollector
+from jasmin.queues.publish import PublishError
+from jasmin.routing.Routables import RoutableSubmitSm
 from jasmin.routing.Routes import DefaultRoute
 from jasmin.routing.configs import RouterPBConfig
 from jasmin.routing.jasminApi import User, Group, SmppClientConnector
@@ -78,6 +83,107 @@ class RouterPBTestCases(TestCase):
             self.routerpb_factory.perspective_mtroute_add(pickle.dumps(defaultroute, pickle.HIGHEST_PROTOCOL), 0)
 
 
+class BacklogTestCases(RouterPBTestCases):
+    def setUp(self):
+        RouterPBTestCases.setUp(self)
+
+        # Admission control without polling: backlogs are set by the tests
+        SMPPClientPBConfigInstance = SMPPClientPBConfig()
+        SMPPClientPBConfigInstance.submit_sm_max_drain_time = 60
+        self.clientManager_f = SMPPClientManagerPB(SMPPClientPBConfigInstance)
+        self.clientManager_f.backlog = BacklogMonitor(None, lambda: {}, 5, logging.getLogger())
+
+        self.smpps_factory = SMPPServerFactory(config=SMPPServerConfig(),
+                                               auth_portal=None,
+                                               RouterPB=self.routerpb_factory,
+                                               SMPPClientManagerPB=self.clientManager_f)
+
+    def set_backlog(self, cid, *depths):
+        """Set the backlog of cid as if its depths were polled every 10 seconds"""
+        backlog = Backlog()
+        for i, depth in enumerate(depths):
+            backlog.update(depth, 1, i * 10)
+        self.clientManager_f.backlog.backlogs[cid] = backlog
+
+    def submit_sm(self):
+        routable = RoutableSubmitSm(SubmitSM(source_addr='1234', destination_addr='4567',
+                                             short_message='hello !', seqNum=1),
+                                    self.routerpb_factory.getUser('u1'))
+        d = self.smpps_factory.submit_sm_post_interception(routable=routable, system_id='username', proto=None)
+        return self.successResultOf(d)
+
+    def test_drain_time_exceeded(self):
+        # 10 messages drained per second, 90 seconds to drain 900 messages
+        self.set_backlog(self.c1.cid, 1000, 900)
+
+        self.assertEqual(self.submit_sm().status, CommandStatus.ESME_RTHROTTLED)
+
+    def test_not_draining(self):
+        # A connector that does not drain its queue is refused whatever its depth is
+        self.set_backlog(self.c1.cid, 1, 1)
+
+        self.assertEqual(self.submit_sm().status, CommandStatus.ESME_RTHROTTLED)
+
+    def test_drain_time_below_limit(self):
+        # 50 messages drained per second, 10 seconds to drain 500 messages
+        self.set_backlog(self.c1.cid, 1000, 500)
+
+        # This is a normal error since the connector is not provisioned in SMPPClientManagerPB
+        self.assertEqual(self.submit_sm().status, CommandStatus.ESME_RSUBMITFAIL)
+
+
+class ConfirmingBroker:
+    """Holds published messages until the test confirms them"""
+
+    connected = True
+
+    def __init__(self):
+        self.confirms = []
+
+    def publish(self, exchange, routing_key, content):
+        d = defer.Deferred()
+        self.confirms.append(d)
+        return d
+
+
+class PublishConfirmTestCases(RouterPBTestCases):
+    def setUp(self):
+        RouterPBTestCases.setUp(self)
+
+        self.broker = ConfirmingBroker()
+        self.clientManager_f = SMPPClientManagerPB(SMPPClientPBConfig())
+        self.clientManager_f.addAmqpBroker(self.broker)
+        self.clientManager_f.connectors.append({'id': self.c1.cid, 'config': SMPPClientConfig(id=self.c1.cid)})
+
+        self.smpps_factory = SMPPServerFactory(config=SMPPServerConfig(),
+                                               auth_portal=None,
+                                               RouterPB=self.routerpb_factory,
+                                               SMPPClientManagerPB=self.clientManager_f)
+
+    def submit_sm(self):
+        routable = RoutableSubmitSm(SubmitSM(source_addr='1234', destination_addr='4567',
+                                             short_message='hello !', seqNum=1),
+                                    self.routerpb_factory.getUser('u1'))
+        return self.smpps_factory.submit_sm_post_interception(routable=routable, system_id='username', proto=None)
+
+    def test_confirmed(self):
+        d = self.submit_sm()
+        # submit_sm_resp waits for the broker confirmation
+        self.assertNoResult(d)
+
+        self.broker.confirms[0].callback(None)
+        response = self.successResultOf(d)
+        self.assertEqual(response.status, CommandStatus.ESME_ROK)
+        self.assertIsNotNone(response.params['message_id'])
+
+    def test_nacked(self):
+        d = self.submit_sm()
+        self.assertNoResult(d)
+
+        self.broker.confirms[0].errback(PublishError('Message nacked by the broker'))
+        self.assertEqual(self.successResultOf(d).status, CommandStatus.ESME_RSUBMITFAIL)
+
+
 class SMPPServerTestCases(RouterPBTestCases):
     def setUp(self):
         RouterPBTestCases.setUp(self)
@@ -0,0 +1,95 @@
+from twisted.internet import defer, task
+from twisted.trial.unittest import TestCase
+
+from jasmin.queues.ack import AckBatcher
+
+
+class DummyChannel:
+    def __init__(self):
+        self.acks = []
+        self.rejects = []
+
+    def basic_ack(self, delivery_tag, multiple=False):
+        self.acks.append((delivery_tag, multiple))
+        return defer.succeed(None)
+
+    def basic_reject(self, delivery_tag, requeue=0):
+        self.rejects.append((delivery_tag, requeue))
+        return defer.succeed(None)
+
+
+class AckBatcherTestCase(TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.chan = DummyChannel()
+
+    def get_batcher(self, size, delay=1, prefetch=0):
+        batcher = AckBatcher(size, delay, clock=self.clock)
+        batcher.reset(self.chan)
+        batcher.set_prefetch('ctag', prefetch)
+        for delivery_tag in range(1, 11):
+            batcher.track(delivery_tag, 'ctag')
+
+        return batcher
+
+    def test_no_batching(self):
+        batcher = self.get_batcher(1)
+        batcher.ack(1)
+        batcher.ack(2)
+
+        self.assertEqual(self.chan.acks, [(1, False), (2, False)])
+
+    def test_batch_size(self):
+        batcher = self.get_batcher(3)
+        batcher.ack(2)
+        batcher.ack(1)
+        self.assertEqual(self.chan.acks, [])
+
+        batcher.ack(3)
+        self.assertEqual(self.chan.acks, [(3, True)])
+
+    def test_flush_delay(self):
+        batcher = self.get_batcher(5)
+        batcher.ack(1)
+        batcher.ack(2)
+        self.assertEqual(self.chan.acks, [])
+
+        self.clock.advance(1)
+        self.assertEqual(self.chan.acks, [(2, True)])
+
+    def test_unsettled_delivery(self):
+        """Deliveries after an unsettled one are acked one by one"""
+        batcher = self.get_batcher(4)
+        batcher.ack(1)
+        batcher.ack(2)
+        batcher.ack(4)
+        batcher.ack(5)
+
+        self.assertEqual(self.chan.acks, [(2, True), (4, False), (5, False)])
+
+    def test_rejected_delivery(self):
+        batcher = self.get_batcher(3)
+        batcher.ack(1)
+        batcher.reject(2, requeue=1)
+        batcher.ack(3)
+        batcher.ack(4)
+
+        self.assertEqual(self.chan.rejects, [(2, 1)])
+        self.assertEqual(self.chan.acks, [(4, True)])
+
+    def test_prefetch_limit(self):
+        """Acks are not held beyond half of the consumer's prefetch window"""
+        batcher = self.get_batcher(50, prefetch=4)
+        batcher.ack(1)
+        self.assertEqual(self.chan.acks, [])
+
+        batcher.ack(2)
+        self.assertEqual(self.chan.acks, [(2, True)])
+
+    def test_reset(self):
+        batcher = self.get_batcher(5)
+        batcher.ack(1)
+        batcher.reset(DummyChannel())
+        self.clock.advance(1)
+
+        self.assertEqual(self.chan.acks, [])
@@ -0,0 +1,152 @@
+from twisted.internet import defer
+from twisted.trial.unittest import TestCase
+from twisted.python.failure import Failure
+from txamqp.queue import Closed
+
+from jasmin.queues.configs import AmqpConfig
+from jasmin.queues.factory import AmqpFactory
+from jasmin.queues.publish import PublishError
+
+
+class DummyMessage:
+    def __init__(self, consumer_tag, delivery_tag):
+        self.consumer_tag = consumer_tag
+        self.delivery_tag = delivery_tag
+
+
+class DummyChannel:
+    def __init__(self, id):
+        self.id = id
+        self.qos = None
+        self.consumers = []
+        self.acks = []
+        self.published = []
+
+    def channel_open(self):
+        return defer.succeed(None)
+
+    def basic_qos(self, prefetch_count):
+        self.qos = prefetch_count
+        return defer.succeed(None)
+
+    def basic_consume(self, queue, no_ack, consumer_tag):
+        self.consumers.append(consumer_tag)
+        return defer.succeed(None)
+
+    def basic_cancel(self, consumer_tag):
+        self.consumers.remove(consumer_tag)
+        return defer.succeed(None)
+
+    def basic_ack(self, delivery_tag, multiple=False):
+        self.acks.append(delivery_tag)
+        return defer.succeed(None)
+
+    def confirm_select(self):
+        return defer.succeed(None)
+
+    def basic_publish(self, **args):
+        self.published.append(args['routing_key'])
+        return defer.succeed(None)
+
+
+class DummyClient:
+    def __init__(self):
+        self.channels = {}
+
+    def channel(self, id):
+        self.channels[id] = DummyChannel(id)
+        return defer.succeed(self.channels[id])
+
+
+class ConsumerChannelsTestCase(TestCase):
+    def setUp(self):
+        config = AmqpConfig()
+        config.log_file = 'stdout'
+        config.ack_batch_size = 1
+        config.reconnectOnConnectionLoss = False
+
+        self.factory = AmqpFactory(config)
+        self.factory.client = DummyClient()
+
+    @defer.inlineCallbacks
+    def test_channel_per_consumer(self):
+        yield self.factory.consume('submit.sm.abc', 'abc', 10)
+        yield self.factory.consume('deliver.sm.*', 'deliver', 0)
+        channels = self.factory.client.channels
+
+        self.assertEqual(sorted(channels), [2, 3])
+        self.assertEqual(channels[2].consumers, ['abc'])
+        self.assertEqual(channels[2].qos, 10)
+        self.assertEqual(channels[3].consumers, ['deliver'])
+
+        # Messages are acked on the channel they were delivered on
+        message = DummyMessage('deliver', 1)
+        self.factory.delivered(message)
+        q = yield self.factory.queue('deliver')
+        consumed = yield q.get()
+        yield self.factory.ack(consumed)
+        self.assertEqual(channels[3].acks, [1])
+        self.assertEqual(channels[2].acks, [])
+
+    @defer.inlineCallbacks
+    def test_cancel_reuses_channel(self):
+        yield self.factory.consume('submit.sm.abc', 'abc', 10)
+        yield self.factory.cancel('abc')
+        self.assertEqual(self.factory.client.channels[2].consumers, [])
+
+        yield self.factory.consume('submit.sm.abc', 'abc', 5)
+        self.assertEqual(sorted(self.factory.client.channels), [2])
+        self.assertEqual(self.factory.client.channels[2].qos, 5)
+
+    @defer.inlineCallbacks
+    def test_stale_ack_ignored(self):
+        yield self.factory.consume('submit.sm.abc', 'abc', 10)
+        message = DummyMessage('abc', 1)
+        self.factory.delivered(message)
+        chan = self.factory.client.channels[2]
+
+        # Connection lost without reconnecting: consumers are closed
+        q = yield self.factory.queue('abc')
+        yield q.get()
+        self.factory.preConnect()
+        self.factory.clientConnectionLost(None, 'Connection was closed cleanly.')
+
+        yield self.factory.ack(message)
+        self.assertEqual(chan.acks, [])
+        self.failureResultOf(q.get(), Closed)
+
+
+class PublishingChannelTestCase(TestCase):
+    def setUp(self):
+        config = AmqpConfig()
+        config.log_file = 'stdout'
+        config.publisher_confirms = True
+        config.publish_window = 10
+        config.reconnectOnConnectionLoss = False
+
+        self.factory = AmqpFactory(config)
+        self.factory.client = DummyClient()
+        self.factory.chan = DummyChannel(1)
+        self.factory.connected = True
+        self.factory.publisher.reset(self.factory.chan, confirms=True)
+
+    def test_channel_closed_by_broker(self):
+        d = self.factory.publish(exchange='messaging', routing_key='a', content=None)
+        closed = self.factory.chan
+
+        self.factory.channel_failed(closed, Failure(Exception('NOT_FOUND - no exchange')))
+        self.failureResultOf(d, PublishError)
+
+        # Publishing goes on through a new channel
+        self.assertIsNot(self.factory.chan, closed)
+        d = self.factory.publish(exchange='messaging', routing_key='b', content=None)
+        self.assertEqual(self.factory.chan.published, ['b'])
+        self.factory.publisher.handle_ack(1)
+        self.successResultOf(d)
+
+    def test_other_channel_closed(self):
+        d = self.factory.publish(exchange='messaging', routing_key='a', content=None)
+        self.factory.channel_failed(DummyChannel(2), Failure(Exception('NOT_FOUND - no queue')))
+
+        self.assertNoResult(d)
+        self.assertEqual(self.factory.chan.id, 1)
@@ -0,0 +1,110 @@
+from twisted.internet import defer
+from twisted.trial.unittest import TestCase
+from txamqp.client import Closed
+
+from jasmin.queues.publish import Publisher, PublishError
+
+
+class DummyChannel:
+    def __init__(self):
+        self.published = []
+        self.closed = False
+
+    def basic_publish(self, **args):
+        if self.closed:
+            return defer.fail(Closed('Channel closed by the broker'))
+
+        self.published.append(args['routing_key'])
+        return defer.succeed(None)
+
+
+class PublisherTestCase(TestCase):
+    def setUp(self):
+        self.chan = DummyChannel()
+
+    def test_no_confirms(self):
+        publisher = Publisher()
+        publisher.reset(self.chan, confirms=True)
+        d = publisher.publish(routing_key='a')
+
+        self.assertEqual(self.chan.published, ['a'])
+        self.successResultOf(d)
+
+    def test_confirms(self):
+        publisher = Publisher(window=10)
+        publisher.reset(self.chan, confirms=True)
+        d1 = publisher.publish(routing_key='a')
+        d2 = publisher.publish(routing_key='b')
+        d3 = publisher.publish(routing_key='c')
+        self.assertNoResult(d1)
+
+        publisher.handle_ack(2, multiple=True)
+        self.successResultOf(d1)
+        self.successResultOf(d2)
+        self.assertNoResult(d3)
+
+        publisher.handle_nack(3)
+        self.failureResultOf(d3, PublishError)
+        self.assertEqual(publisher.pending(), 0)
+
+    def test_window(self):
+        publisher = Publisher(window=2, spill_size=10)
+        publisher.reset(self.chan, confirms=True)
+        for routing_key in 'abcd':
+            publisher.publish(routing_key=routing_key)
+        self.assertEqual(self.chan.published, ['a', 'b'])
+
+        publisher.handle_ack(1)
+        self.assertEqual(self.chan.published, ['a', 'b', 'c'])
+
+    def test_spill_while_disconnected(self):
+        publisher = Publisher(window=10, spill_size=2)
+        d1 = publisher.publish(routing_key='a')
+        publisher.publish(routing_key='b')
+        self.failureResultOf(publisher.publish(routing_key='c'), PublishError)
+
+        publisher.reset(self.chan, confirms=True)
+        self.assertEqual(self.chan.published, ['a', 'b'])
+        publisher.handle_ack(1)
+        self.successResultOf(d1)
+
+    def test_republish_unconfirmed(self):
+        publisher = Publisher(window=10, spill_size=10)
+        publisher.reset(self.chan, confirms=True)
+        d1 = publisher.publish(routing_key='a')
+        publisher.publish(routing_key='b')
+        publisher.handle_ack(1)
+
+        # Connection lost
+        publisher.reset()
+        publisher.publish(routing_key='c')
+
+        chan = DummyChannel()
+        publisher.reset(chan, confirms=True)
+        self.successResultOf(d1)
+        self.assertEqual(chan.published, ['b', 'c'])
+        self.assertEqual(publisher.pending(), 2)
+
+        # Sequence numbers start over with the new channel
+        publisher.handle_ack(2, multiple=True)
+        self.assertEqual(publisher.pending(), 0)
+
+    def test_closed_channel(self):
+        publisher = Publisher(window=10, spill_size=10)
+        publisher.reset(self.chan, confirms=True)
+        d1 = publisher.publish(routing_key='a')
+
+        # Channel is closed by the broker while the connection is up
+        self.chan.closed = True
+        d2 = publisher.publish(routing_key='b')
+        self.failureResultOf(d1, PublishError)
+        self.failureResultOf(d2, PublishError)
+
+        # Next messages wait for a new channel
+        d3 = publisher.publish(routing_key='c')
+        self.assertNoResult(d3)
+        chan = DummyChannel()
+        publisher.reset(chan, confirms=True)
+        self.assertEqual(chan.published, ['c'])
+        publisher.handle_ack(1)
+        self.successResultOf(d3)
@@ -0,0 +1,104 @@
+from twisted.internet import defer
+from twisted.trial.unittest import TestCase
+from txamqp.content import Content
+
+from jasmin.queues.publish import PublishError
+from jasmin.queues.retry import RetryScheduler, retries
+
+
+class DummyChannel:
+    def __init__(self):
+        self.exchanges = []
+        self.queues = {}
+        self.bindings = []
+
+    def exchange_declare(self, exchange, type):
+        self.exchanges.append((exchange, type))
+        return defer.succeed(None)
+
+    def queue_declare(self, queue, arguments):
+        self.queues[queue] = arguments
+        return defer.succeed(None)
+
+    def queue_bind(self, queue, exchange):
+        self.bindings.append((queue, exchange))
+        return defer.succeed(None)
+
+
+class DummyBroker:
+    def __init__(self):
+        self.chan = DummyChannel()
+        self.published = []
+        self.acked = []
+        self.rejected = []
+        self.publish_error = None
+
+    def publish(self, exchange, routing_key, content):
+        if self.publish_error is not None:
+            return defer.fail(self.publish_error)
+        self.published.append((exchange, routing_key, content))
+        return defer.succeed(None)
+
+    def ack(self, message):
+        self.acked.append(message)
+        return defer.succeed(None)
+
+    def reject(self, message, requeue=0):
+        self.rejected.append((message, requeue))
+        return defer.succeed(None)
+
+
+class DummyMessage:
+    def __init__(self, headers=None):
+        self.routing_key = 'dlr_thrower.http'
+        self.content = Content(b'body', properties={'message-id': '1', 'headers': headers or {}})
+
+
+class RetrySchedulerTestCase(TestCase):
+    def setUp(self):
+        self.broker = DummyBroker()
+        self.scheduler = RetryScheduler(self.broker, 'dlr_thrower')
+
+    @defer.inlineCallbacks
+    def test_retry_with_delay(self):
+        message = DummyMessage({'level': 1})
+        yield self.scheduler.retry(message, 30)
+
+        self.assertEqual(self.broker.chan.queues['dlr_thrower.retry.30'],
+                         {'x-message-ttl': 30000, 'x-dead-letter-exchange': 'dlr_thrower.requeue'})
+        self.assertIn(('dlr_thrower', 'dlr_thrower.requeue'), self.broker.chan.bindings)
+        self.assertIn(('dlr_thrower.retry.30', 'dlr_thrower.retry.30'), self.broker.chan.bindings)
+
+        exchange, routing_key, content = self.broker.published[0]
+        self.assertEqual(exchange, 'dlr_thrower.retry.30')
+        self.assertEqual(routing_key, 'dlr_thrower.http')
+        self.assertEqual(content.body, b'body')
+        self.assertEqual(content.properties['headers'], {'level': 1, 'x-retries': 1})
+        self.assertEqual(self.broker.acked, [message])
+
+        # The consumed message is not altered
+        self.assertEqual(retries(message), 0)
+
+        # Declarations are done once
+        yield self.scheduler.retry(message, 30)
+        self.assertEqual(len(self.broker.chan.exchanges), 2)
+
+    @defer.inlineCallbacks
+    def test_retry_without_delay(self):
+        message = DummyMessage({'x-retries': 2})
+        yield self.scheduler.retry(message)
+
+        exchange, _, content = self.broker.published[0]
+        self.assertEqual(exchange, 'dlr_thrower.requeue')
+        self.assertEqual(content.properties['headers']['x-retries'], 3)
+        self.assertEqual(self.broker.chan.queues, {})
+
+    @defer.inlineCallbacks
+    def test_publish_failure(self):
+        self.broker.publish_error = PublishError()
+        message = DummyMessage()
+        r = yield self.scheduler.retry(message, 30)
+
+        self.assertFalse(r)
+        self.assertEqual(self.broker.acked, [])
+        self.assertEqual(self.broker.rejected, [(message, 1)])
@@ -0,0 +1,106 @@
+from twisted.internet import defer, task
+from twisted.trial.unittest import TestCase
+
+from jasmin.redis.client import RedisWriteBatcher, RedisForJasminFactory
+from jasmin.redis.configs import RedisForJasminConfig
+
+
+class DummyPipeline:
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+
+    def __getattr__(self, command):
+        return lambda *args: self.commands.append((command,) + args)
+
+    def execute_pipeline(self):
+        self.client.executed.append(self.commands)
+        if self.client.error is not None:
+            return defer.fail(self.client.error)
+        return defer.succeed(['OK' if c[0] == 'set' else 1 for c in self.commands])
+
+
+class DummyClient:
+    def __init__(self):
+        self.executed = []
+        self.error = None
+
+    def pipeline(self):
+        return defer.succeed(DummyPipeline(self))
+
+
+class RedisWriteBatcherTestCase(TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.client = DummyClient()
+
+    def test_no_flush_window(self):
+        batcher = RedisWriteBatcher(self.client, clock=self.clock)
+        batcher.set_expire('dlr:1', b'map', 60)
+        batcher.set_expire('dlr:2', b'map', 60)
+
+        self.assertEqual(len(self.client.executed), 2)
+        self.assertEqual(self.client.executed[0], [('set', 'dlr:1', b'map', 60)])
+
+    def test_flush_window(self):
+        batcher = RedisWriteBatcher(self.client, flush_window=0.1, clock=self.clock)
+        results = []
+        batcher.set_expire('dlr:1', b'map', 60).addCallback(results.append)
+        batcher.delete('dlr:2').addCallback(results.append)
+        self.assertEqual(self.client.executed, [])
+
+        self.clock.advance(0.1)
+        self.assertEqual(self.client.executed, [
+            [('set', 'dlr:1', b'map', 60), ('delete', 'dlr:2')]])
+        self.assertEqual(results, [['OK'], [1]])
+
+    def test_max_writes(self):
+        batcher = RedisWriteBatcher(self.client, flush_window=0.1, max_writes=2, clock=self.clock)
+        batcher.delete('dlr:1')
+        batcher.delete('dlr:2')
+        batcher.delete('dlr:3')
+
+        self.assertEqual(self.client.executed, [[('delete', 'dlr:1'), ('delete', 'dlr:2')]])
+        self.clock.advance(0.1)
+        self.assertEqual(len(self.client.executed), 2)
+
+    def test_error(self):
+        self.client.error = ValueError('Pipeline failed')
+        batcher = RedisWriteBatcher(self.client, flush_window=0.1, clock=self.clock)
+        d1 = batcher.delete('dlr:1')
+        d2 = batcher.delete('dlr:2')
+        self.clock.advance(0.1)
+
+        self.failureResultOf(d1, ValueError)
+        self.failureResultOf(d2, ValueError)
+
+
+class LocalCacheTestCase(TestCase):
+    def get_client(self, max_keys):
+        config = RedisForJasminConfig()
+        config.write_flush_window = 1
+        config.local_cache_max_keys = max_keys
+        client = RedisForJasminFactory('127.0.0.1:6379', None, 1, config=config).handler
+        client.writes.clock = task.Clock()
+
+        return client
+
+    def test_write_through(self):
+        client = self.get_client(10)
+        client.set_expire('dlr:1', b'map', 60)
+
+        self.assertEqual(self.successResultOf(client.cached_get('dlr:1')), b'map')
+        self.assertEqual(len(client.writes.writes), 1)
+
+    def test_delete(self):
+        client = self.get_client(10)
+        client.set_expire('dlr:1', b'map', 60)
+        client.batched_delete('dlr:1')
+
+        self.assertNotIn('dlr:1', client.cache)
+
+    def test_disabled(self):
+        client = self.get_client(0)
+        client.set_expire('dlr:1', b'map', 60)
+
+        self.assertNotIn('dlr:1', client.cache)
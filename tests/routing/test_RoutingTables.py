@@ -1,5 +1,7 @@
 # pylint: disable=W0401,W0611
 
+import pickle
+
 from twisted.trial.unittest import TestCase
 from jasmin.routing.RoutingTables import *
 from jasmin.routing.Routes import *
@@ -150,3 +152,91 @@ class MORoutingTableTestCase(RoutingTableTests, TestCase):
         self.routable_matching_route1 = RoutableDeliverSm(self.PDU_dst_1, self.connector1)
         self.routable_matching_route2 = RoutableDeliverSm(self.PDU_dst_2, self.connector1)
         self.routable_notmatching_any = RoutableDeliverSm(self.PDU_dst_3, self.connector1)
+
+
+class RoutingIndexTestCase(TestCase):
+    def setUp(self):
+        self.group100 = Group(100)
+        self.group200 = Group(200)
+        self.users = [User(uid, self.group100 if uid % 2 == 0 else self.group200, 'u%s' % uid, 'password')
+                      for uid in range(1, 6)]
+        self.connectors = [SmppClientConnector('c%s' % i) for i in range(8)]
+
+    def _linearRouteFor(self, routing_t, routable):
+        for r in routing_t.getAll():
+            route = list(r.values())[0]
+            if route.matchFilters(routable):
+                return route
+        return None
+
+    def test_getDestinationPrefix(self):
+        self.assertEqual(getDestinationPrefix(r'^33\d+'), '33')
+        self.assertEqual(getDestinationPrefix(r'33'), '33')
+        self.assertEqual(getDestinationPrefix(r'^\+33'), '+33')
+        self.assertEqual(getDestinationPrefix(r'^334?'), '33')
+        self.assertEqual(getDestinationPrefix(r'^33+'), '33')
+        self.assertEqual(getDestinationPrefix(r'^3{2}'), None)
+        self.assertEqual(getDestinationPrefix(r'^33|^44'), None)
+        self.assertEqual(getDestinationPrefix(r'^(33)'), None)
+        self.assertEqual(getDestinationPrefix(r'^\d+'), None)
+
+    def test_same_result_as_linear_scan(self):
+        routing_t = MTRoutingTable()
+        routing_t.add(DefaultRoute(self.connectors[0]), 0)
+        routing_t.add(StaticMTRoute([UserFilter(self.users[0]), DestinationAddrFilter(r'^33\d+')],
+                                    self.connectors[1], 0.0), 100)
+        routing_t.add(StaticMTRoute([DestinationAddrFilter(r'^336')], self.connectors[2], 0.0), 90)
+        routing_t.add(StaticMTRoute([GroupFilter(self.group100)], self.connectors[3], 0.0), 80)
+        routing_t.add(StaticMTRoute([TagFilter(12)], self.connectors[4], 0.0), 70)
+        routing_t.add(StaticMTRoute([DestinationAddrFilter(r'^(44|55)')], self.connectors[5], 0.0), 60)
+        routing_t.add(StaticMTRoute([EvalPyFilter("result = routable.user.uid == 5")],
+                                    self.connectors[6], 0.0), 50)
+        routing_t.add(StaticMTRoute([UserFilter(self.users[2])], self.connectors[7], 0.0), 40)
+
+        for user in self.users:
+            for destination_addr in [b'3361', b'3370', b'336', b'44', b'55', b'66', b'']:
+                for tags in [[], [12], [12, 13]]:
+                    routable = RoutableSubmitSm(SubmitSM(source_addr=b'x', destination_addr=destination_addr,
+                                                         short_message=b'hello world'), user)
+                    for tag in tags:
+                        routable.addTag(tag)
+
+                    self.assertEqual(routing_t.getRouteFor(routable), self._linearRouteFor(routing_t, routable))
+
+    def test_evalpy_adding_tag(self):
+        routing_t = MTRoutingTable()
+        routing_t.add(DefaultRoute(self.connectors[0]), 0)
+        routing_t.add(StaticMTRoute([EvalPyFilter("routable.addTag(12)\nresult = False")],
+                                    self.connectors[1], 0.0), 20)
+        routing_t.add(StaticMTRoute([TagFilter(12)], self.connectors[2], 0.0), 10)
+
+        routable = RoutableSubmitSm(SubmitSM(source_addr=b'x', destination_addr=b'3361',
+                                             short_message=b'hello world'), self.users[0])
+        self.assertEqual(routing_t.getRouteFor(routable).getConnector(), self.connectors[2])
+
+    def test_index_rebuilt_on_update(self):
+        routing_t = MTRoutingTable()
+        routing_t.add(DefaultRoute(self.connectors[0]), 0)
+        routable = RoutableSubmitSm(SubmitSM(source_addr=b'x', destination_addr=b'3361',
+                                             short_message=b'hello world'), self.users[0])
+        self.assertEqual(routing_t.getRouteFor(routable).getConnector(), self.connectors[0])
+
+        routing_t.add(StaticMTRoute([DestinationAddrFilter(r'^33')], self.connectors[1], 0.0), 10)
+        self.assertEqual(routing_t.getRouteFor(routable).getConnector(), self.connectors[1])
+
+        routing_t.remove(10)
+        self.assertEqual(routing_t.getRouteFor(routable).getConnector(), self.connectors[0])
+
+        routing_t.flush()
+        self.assertEqual(routing_t.getRouteFor(routable), None)
+
+    def test_index_not_pickled(self):
+        routing_t = MTRoutingTable()
+        routing_t.add(StaticMTRoute([DestinationAddrFilter(r'^33')], self.connectors[1], 0.0), 10)
+        routing_t.getIndex()
+
+        self.assertNotIn('_index', routing_t.__getstate__())
+        unpickled = pickle.loads(pickle.dumps(routing_t))
+        routable = RoutableSubmitSm(SubmitSM(source_addr=b'x', destination_addr=b'3361',
+                                             short_message=b'hello world'), self.users[0])
+        self.assertEqual(unpickled.getRouteFor(routable).getConnector().cid, 'c1')
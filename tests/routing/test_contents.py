@@ -4,6 +4,9 @@ Test cases for amqp contents
 
 import pickle
 from twisted.trial.unittest import TestCase
+from smpp.pdu.operations import DeliverSM
+from jasmin.managers import pducodec
+from jasmin.managers.content import decode_body
 from jasmin.routing.content import RoutedDeliverSmContent
 from jasmin.routing.jasminApi import HttpConnector, SmppServerSystemIdConnector
 
@@ -51,3 +54,12 @@ class RoutedDeliverSmContentTestCase(ContentTestCase):
         _dcs = pickle.loads(c['headers']['dst-connectors'])
         self.assertEqual(_dcs[0].cid, dcs[0].cid)
         self.assertEqual(len(_dcs), len(dcs))
+
+    def test_smpp_encoding(self):
+        pdu = DeliverSM(seqNum=1, source_addr=b'123', destination_addr=b'456', short_message=b'hello')
+        dcs = [HttpConnector('def', 'http://127.0.0.1')]
+        c = RoutedDeliverSmContent(pdu, self.msgid, self.scid, dcs, encoding='smpp')
+
+        self.assertEqual(c['content-type'], pducodec.CONTENT_TYPE)
+        self.assertEqual(decode_body(c), pdu)
+        self.assertEqual(c['headers']['src-connector-id'], self.scid)
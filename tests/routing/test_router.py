@@ -518,6 +518,57 @@ class UserAndGroupTestCases(RouterPBProxy, RouterPBTestCase):
         r = yield self.user_authenticate('incorrect', 'incorrect')
         self.assertEqual(r, None)
 
+    @defer.inlineCallbacks
+    def test_authenticate_after_password_update(self):
+        yield self.connect('127.0.0.1', self.pbPort)
+
+        g1 = Group(1)
+        yield self.group_add(g1)
+
+        u1 = User(1, g1, 'username', 'password')
+        yield self.user_add(u1)
+
+        # Twice: second authentication is served from cache
+        for _ in range(2):
+            r = yield self.user_authenticate('username', 'password')
+            self.assertNotEqual(r, None)
+        self.assertEqual(1, len(self.pbRoot_f.authentication_cache))
+
+        # Update password, cached credentials must not be accepted anymore
+        u1 = User(1, g1, 'username', 'newpwd')
+        yield self.user_add(u1)
+
+        r = yield self.user_authenticate('username', 'password')
+        self.assertEqual(r, None)
+        r = yield self.user_authenticate('username', 'newpwd')
+        self.assertNotEqual(r, None)
+
+        # Disabled users are still refused when their credentials are cached
+        yield self.user_disable(1)
+        r = yield self.user_authenticate('username', 'newpwd')
+        self.assertEqual(r, None)
+
+    @defer.inlineCallbacks
+    def test_get_user_and_group(self):
+        yield self.connect('127.0.0.1', self.pbPort)
+
+        g1 = Group(1)
+        yield self.group_add(g1)
+        u1 = User(1, g1, 'username', 'password')
+        yield self.user_add(u1)
+
+        self.assertEqual(self.pbRoot_f.getUser(1).username, 'username')
+        self.assertEqual(self.pbRoot_f.getUser('1').username, 'username')
+        self.assertEqual(self.pbRoot_f.getGroup(1).gid, g1.gid)
+        self.assertEqual(self.pbRoot_f.getUserByUsername('username').uid, u1.uid)
+
+        yield self.user_remove(1)
+        self.assertEqual(self.pbRoot_f.getUser(1), None)
+        self.assertEqual(self.pbRoot_f.getUserByUsername('username'), None)
+
+        yield self.group_remove(1)
+        self.assertEqual(self.pbRoot_f.getGroup(1), None)
+
     @defer.inlineCallbacks
     def test_enable_disable_group(self):
         yield self.connect('127.0.0.1', self.pbPort)
@@ -872,7 +872,7 @@ class HttpDlrCallbackingTestCases(RouterPBProxy, HappySMSCTestCase, SubmitSmTest
         yield self.prepareRoutingsAndStartConnector()
 
         # Make a new connection to redis
-        # It is used to wrap DLRLookup's redis client and slowdown calls to hmset
+        # It is used to wrap DLRLookup's redis client and slowdown calls to set_expire
         RCInstance = RedisForJasminConfig()
         r = yield ConnectionWithConfiguration(RCInstance)
         # Authenticate and select db
@@ -880,17 +880,17 @@ class HttpDlrCallbackingTestCases(RouterPBProxy, HappySMSCTestCase, SubmitSmTest
             yield r.auth(RCInstance.password)
             yield r.select(RCInstance.dbid)
 
-        # Mock hmset redis's call to slow it down
+        # Mock set_expire redis's call to slow it down
         @defer.inlineCallbacks
-        def mocked_hmset(k, v):
-            # Slow down hmset
+        def mocked_set_expire(k, v, expiry):
+            # Slow down set_expire
             # We need to receive the deliver_sm dlr before submit_sm_resp
             if k[:11] == 'queue-msgid':
                 yield waitFor(1)
 
-            yield r.hmset(k, v)
+            yield r.set_expire(k, v, expiry)
 
-        self.dlrlookup.redisClient.hmset = MagicMock(wraps=mocked_hmset)
+        self.dlrlookup.redisClient.set_expire = MagicMock(wraps=mocked_set_expire)
 
         # Ask for DLR
         self.params['dlr-url'] = self.dlr_url
@@ -1761,7 +1761,7 @@ class SmppsDlrCallbackingTestCases(SmppsDlrCallbacking):
         self.smpps_factory.lastProto.sendPDU = Mock(wraps=self.smpps_factory.lastProto.sendPDU)
 
         # Make a new connection to redis
-        # It is used to wrap DLRLookup's redis client and slowdown calls to hmset
+        # It is used to wrap DLRLookup's redis client and slowdown calls to set_expire
         RCInstance = RedisForJasminConfig()
         r = yield ConnectionWithConfiguration(RCInstance)
         # Authenticate and select db
@@ -1769,17 +1769,17 @@ class SmppsDlrCallbackingTestCases(SmppsDlrCallbacking):
             yield r.auth(RCInstance.password)
             yield r.select(RCInstance.dbid)
 
-        # Mock hmset redis's call to slow it down
+        # Mock set_expire redis's call to slow it down
         @defer.inlineCallbacks
-        def mocked_hmset(k, v):
-            # Slow down hmset
+        def mocked_set_expire(k, v, expiry):
+            # Slow down set_expire
             # We need to receive the deliver_sm dlr before submit_sm_resp
             if k[:11] == 'queue-msgid':
                 yield waitFor(1)
 
-            yield r.hmset(k, v)
+            yield r.set_expire(k, v, expiry)
 
-        self.dlrlookup.redisClient.hmset = MagicMock(wraps=mocked_hmset)
+        self.dlrlookup.redisClient.set_expire = MagicMock(wraps=mocked_set_expire)
 
         # Ask for DLR
         SubmitSmPDU = copy.deepcopy(self.SubmitSmPDU)
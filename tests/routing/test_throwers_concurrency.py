@@ -0,0 +1,63 @@
+from twisted.internet import defer
+from twisted.trial.unittest import TestCase
+from txamqp.queue import TimeoutDeferredQueue
+
+from jasmin.routing.configs import deliverSmThrowerConfig
+from jasmin.routing.throwers import Thrower, deliverSmThrower
+
+
+class DummyHTTPClient:
+    def __init__(self):
+        self.requests = []
+
+    def request(self, method, url, **kwargs):
+        d = defer.Deferred()
+        self.requests.append((url, d))
+        return d
+
+
+class ThrowingConcurrencyTestCase(TestCase):
+    def setUp(self):
+        config = deliverSmThrowerConfig()
+        config.log_file = 'stdout'
+        config.concurrency = 2
+        config.http_concurrency_per_host = 1
+
+        self.thrower = deliverSmThrower(config)
+        self.thrower.thrower_q = TimeoutDeferredQueue()
+        self.throws = []
+        self.thrower.callback = self.throwing_callback
+
+    def tearDown(self):
+        return self.thrower.stopService()
+
+    def throwing_callback(self, message):
+        Thrower.throwing_callback(self.thrower, message)
+
+        d = defer.Deferred()
+        self.throws.append(d)
+        return d
+
+    def test_concurrency(self):
+        for i in range(4):
+            self.thrower.thrower_q.put(i)
+
+        self.thrower.consume()
+        self.assertEqual(len(self.throws), 2)
+
+        # Consuming is resumed once a message is thrown
+        self.throws[0].callback(None)
+        self.assertEqual(len(self.throws), 3)
+        self.throws[1].callback(None)
+        self.throws[2].callback(None)
+        self.assertEqual(len(self.throws), 4)
+        self.assertEqual(self.thrower.throwing, 1)
+
+    def test_http_concurrency_per_host(self):
+        self.thrower.http_client = DummyHTTPClient()
+        self.thrower.http_request('POST', 'http://127.0.0.1:1401/mo')
+        self.thrower.http_request('POST', 'http://127.0.0.1:1401/mo')
+        self.thrower.http_request('POST', b'http://10.0.0.1/mo')
+
+        self.assertEqual([url for url, _ in self.thrower.http_client.requests],
+                         ['http://127.0.0.1:1401/mo', b'http://10.0.0.1/mo'])
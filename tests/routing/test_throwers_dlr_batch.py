@@ -0,0 +1,71 @@
+import json
+
+from twisted.internet import defer
+from twisted.trial.unittest import TestCase
+
+from jasmin.managers.content import DLRContentForHttpapi
+from jasmin.routing.configs import DLRThrowerConfig
+from jasmin.routing.throwers import DLRThrower
+
+
+class DummyResponse:
+    code = 200
+
+
+class DummyMessage:
+    def __init__(self, msgid):
+        self.content = DLRContentForHttpapi('DELIVRD', msgid, 'http://127.0.0.1/dlr', 1, method='BATCH')
+        self.routing_key = 'dlr_thrower.http'
+
+
+class DLRBatchTestCase(TestCase):
+    def setUp(self):
+        config = DLRThrowerConfig()
+        config.log_file = 'stdout'
+        config.http_batch_size = 3
+        config.http_batch_delay = 10
+
+        self.thrower = DLRThrower(config)
+        self.requests = []
+        self.thrower.http_request = self.http_request
+        self.acked = []
+        self.failed = []
+        self.thrower.ackMessage = lambda message: self.acked.append(message.content.properties['message-id'])
+        self.thrower.http_dlr_failed = lambda message, e: self.failed.append(message.content.properties['message-id'])
+
+    def tearDown(self):
+        return self.thrower.stopService()
+
+    def http_request(self, method, url, **kwargs):
+        d = defer.Deferred()
+        self.requests.append((method, url, json.loads(kwargs['data']), d))
+        return d
+
+    @defer.inlineCallbacks
+    def test_batch_size(self):
+        for msgid in ['1', '2', '3']:
+            yield self.thrower.http_dlr_callback(DummyMessage(msgid))
+
+        self.assertEqual(len(self.requests), 1)
+        method, url, body, d = self.requests[0]
+        self.assertEqual(method, 'POST')
+        self.assertEqual(url, 'http://127.0.0.1/dlr')
+        self.assertEqual([dlr['id'] for dlr in body], ['1', '2', '3'])
+
+        d.callback((DummyResponse(), 'ACK/Jasmin'))
+        self.assertEqual(self.acked, ['1', '2', '3'])
+        self.assertEqual(self.thrower.dlrBatches, {})
+
+    @defer.inlineCallbacks
+    def test_partial_ack(self):
+        for msgid in ['1', '2']:
+            yield self.thrower.http_dlr_callback(DummyMessage(msgid))
+        self.assertEqual(len(self.requests), 0)
+
+        # Batch is flushed after http_batch_delay
+        self.thrower.dlrBatchTimers['http://127.0.0.1/dlr'].cancel()
+        self.thrower.flushDLRBatch('http://127.0.0.1/dlr')
+        self.requests[0][3].callback((DummyResponse(), '["2"]'))
+
+        self.assertEqual(self.acked, ['2'])
+        self.assertEqual(self.failed, ['1'])
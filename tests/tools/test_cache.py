@@ -0,0 +1,57 @@
+import time
+
+from twisted.trial.unittest import TestCase
+
+from jasmin.tools.cache import LRUCache
+
+
+class LRUCacheTestCase(TestCase):
+    def test_get_set(self):
+        cache = LRUCache(10)
+        cache.set('a', 1)
+
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('b', 2), 2)
+        self.assertIn('a', cache)
+        self.assertEqual(len(cache), 1)
+
+    def test_evict_least_recently_used(self):
+        cache = LRUCache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        # Mark 'a' as recently used
+        cache.get('a')
+        cache.set('c', 3)
+
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('c'), 3)
+
+    def test_ttl(self):
+        cache = LRUCache(10, ttl=0.05)
+        cache.set('a', 1)
+        cache.set('b', 2, ttl=60)
+        time.sleep(0.1)
+
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache.get('b'), 2)
+        self.assertEqual(len(cache), 1)
+
+    def test_disabled(self):
+        cache = LRUCache(0)
+        cache.set('a', 1)
+
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(len(cache), 0)
+
+    def test_pop_and_clear(self):
+        cache = LRUCache(10)
+        cache.set('a', 1)
+        cache.set('b', 2)
+
+        self.assertEqual(cache.pop('a'), 1)
+        self.assertEqual(cache.pop('a'), None)
+        cache.clear()
+        self.assertEqual(len(cache), 0)
@@ -0,0 +1,92 @@
+from twisted.internet import task
+from twisted.trial.unittest import TestCase
+
+from jasmin.tools.qos import TokenBucket, SendWindow
+
+
+class TokenBucketTestCase(TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+
+    def consume(self, bucket, count):
+        fired = []
+        for i in range(count):
+            bucket.consume().addCallback(lambda _, i=i: fired.append(i))
+
+        return fired
+
+    def test_unlimited(self):
+        bucket = TokenBucket(0, clock=self.clock)
+
+        self.assertEqual(len(self.consume(bucket, 100)), 100)
+
+    def test_rate(self):
+        bucket = TokenBucket(2, clock=self.clock)
+        fired = self.consume(bucket, 5)
+
+        self.assertEqual(fired, [0])
+        self.clock.advance(0.5)
+        self.assertEqual(fired, [0, 1])
+        self.clock.pump([0.5, 0.5])
+        self.assertEqual(fired, [0, 1, 2, 3])
+        self.clock.advance(0.5)
+        self.assertEqual(fired, [0, 1, 2, 3, 4])
+
+    def test_burst(self):
+        bucket = TokenBucket(1, burst=3, clock=self.clock)
+        fired = self.consume(bucket, 4)
+
+        self.assertEqual(fired, [0, 1, 2])
+        self.clock.advance(1)
+        self.assertEqual(fired, [0, 1, 2, 3])
+
+        # Idle bucket cannot hold more than burst tokens
+        self.clock.advance(100)
+        fired = self.consume(bucket, 4)
+        self.assertEqual(fired, [0, 1, 2])
+
+    def test_set(self):
+        bucket = TokenBucket(1, clock=self.clock)
+        fired = self.consume(bucket, 3)
+        self.assertEqual(fired, [0])
+
+        bucket.set(0)
+        self.assertEqual(fired, [0, 1, 2])
+
+    def test_flush(self):
+        bucket = TokenBucket(1, clock=self.clock)
+        fired = self.consume(bucket, 3)
+
+        bucket.flush()
+        self.assertEqual(fired, [0, 1, 2])
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+
+class SendWindowTestCase(TestCase):
+    def test_window(self):
+        window = SendWindow(2)
+        fired = []
+        for i in range(4):
+            window.acquire().addCallback(lambda _, i=i: fired.append(i))
+
+        self.assertEqual(fired, [0, 1])
+        window.release()
+        self.assertEqual(fired, [0, 1, 2])
+        self.assertEqual(window.pending, 2)
+
+    def test_resize(self):
+        window = SendWindow(1)
+        fired = []
+        for i in range(4):
+            window.acquire().addCallback(lambda _, i=i: fired.append(i))
+
+        window.resize(3)
+        self.assertEqual(fired, [0, 1, 2])
+
+        # Shrinking will wait for pending transactions to complete
+        window.resize(1)
+        window.release()
+        window.release()
+        self.assertEqual(fired, [0, 1, 2])
+        window.release()
+        self.assertEqual(fired, [0, 1, 2, 3])